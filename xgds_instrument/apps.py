@@ -0,0 +1,36 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from django.apps import AppConfig
+
+
+class XgdsInstrumentConfig(AppConfig):
+    name = 'xgds_instrument'
+    verbose_name = 'xGDS Instrument'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+        from xgds_instrument import importerRegistry, instrumentCache
+        from xgds_instrument.models import updatePositionProducts
+
+        importerRegistry.loadImporters()
+        post_save.connect(instrumentCache.invalidate, sender=settings.XGDS_INSTRUMENT_INSTRUMENT_MODEL,
+                          dispatch_uid='xgds_instrument_cache_save')
+        post_delete.connect(instrumentCache.invalidate, sender=settings.XGDS_INSTRUMENT_INSTRUMENT_MODEL,
+                            dispatch_uid='xgds_instrument_cache_delete')
+        post_save.connect(updatePositionProducts, sender=settings.GEOCAM_TRACK_PAST_POSITION_MODEL,
+                          dispatch_uid='xgds_instrument_position_products')
@@ -0,0 +1,301 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Benchmarks of the paths instrument data goes through: import with instrumentDataImport,
+features and similarity indexing with updateDerivedData, sample retrieval with
+getInstrumentDataJson, export with getInstrumentDataCsvResponse, editInstrumentDataPosition,
+and search with the product model's search form.
+
+Synthetic spectra of a thousand to a million points are imported by the instrument's own
+importer into content addressed storage on local disk rather than CouchDB.  Everything
+runs in a transaction that is rolled back, with the stored files and sample cache in a
+temporary directory, so the database and the real data storage are left as they were.
+
+Each case records latency percentiles, throughput, the most queries made by one call and
+the peak memory allocated during one more, untimed, call traced by tracemalloc.  Python 2
+has no tracemalloc, so there only the peak of the whole process is reported, once per run.
+Run it with the benchmarkInstrumentData command, which can save the results and compare
+them with a saved baseline.
+"""
+
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+from contextlib import contextmanager
+from io import BytesIO
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.functional import empty
+
+from geocamUtil.loader import LazyGetModelByName
+from xgds_instrument import bulkImport, importerRegistry, models, sampleCache, views
+from xgds_instrument.forms import SearchInstrumentDataForm
+
+SIZES = (1000, 10000, 100000, 1000000)
+PERCENTILES = (50, 90, 99)
+LOD_POINTS = 1000
+BENCHMARK_USERNAME = 'instrumentDataBenchmark'
+LOCATION = (37.4178, -122.0624)  # products are scattered within about a km of this
+
+
+def syntheticSpectrum(pointCount, seed=0):
+    """
+    A reproducible (pointCount, 2) array of wavelength (nm) and reflectance:
+    a sloped continuum with a few absorption bands and a little noise.
+    """
+    random = np.random.RandomState(seed)
+    x = np.linspace(350.0, 2500.0, pointCount)
+    y = 0.2 + 0.3 * (x - x[0]) / (x[-1] - x[0])
+    for center, width, depth in random.uniform((400.0, 10.0, 0.02), (2450.0, 80.0, 0.15), (6, 3)):
+        y -= depth * np.exp(-0.5 * ((x - center) / width) ** 2)
+    y += random.normal(0.0, 0.002, pointCount)
+    return np.column_stack((x, y))
+
+
+def formatSpectrum(samples, labels, delimiter=','):
+    """ The samples as delimited text with a header row, like a portable data file """
+    buf = BytesIO()
+    np.savetxt(buf, samples, fmt='%.6f', delimiter=delimiter, header=delimiter.join(labels), comments='')
+    return buf.getvalue()
+
+
+def getProcessPeakMemoryMb():
+    """ The peak resident memory of this process so far; it never goes down, so it is not per case """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)  # bytes on macOS, kilobytes elsewhere
+    return peak / 1024.0
+
+
+def measureMemory(function, index):
+    """ The peak MB allocated during one call of function, or None without tracemalloc """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        function(index)
+        return tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+    finally:
+        tracemalloc.stop()
+
+
+def measure(function, repeat, items=1, setup=None):
+    """
+    Call function repeat times, calling setup untimed before each call, and return the statistics.
+    items is how much one call handles (points or products), for the throughput.  Memory is
+    traced in one more call, as tracing slows the calls down.
+    """
+    seconds = []
+    queries = []
+    for i in range(repeat):
+        if setup:
+            setup(i)
+        with CaptureQueriesContext(connection) as context:
+            start = timeit.default_timer()
+            function(i)
+            seconds.append(timeit.default_timer() - start)
+        queries.append(len(context.captured_queries))
+    if setup:
+        setup(repeat)
+    peakMemoryMb = measureMemory(function, repeat)
+    result = dict(('p%d' % p, float(np.percentile(seconds, p))) for p in PERCENTILES)
+    result.update({'repeat': repeat,
+                   'max': max(seconds),
+                   'throughput': items * repeat / sum(seconds) if sum(seconds) else None,
+                   'queries': max(queries),
+                   'peakMemoryMb': peakMemoryMb})
+    return result
+
+
+def compareToBaseline(results, baseline, tolerance=0.25):
+    """
+    Returns a line for each case whose median time or peak memory is more than tolerance
+    above the baseline, or that makes more queries.  Cases missing from either are skipped,
+    as is memory when either was run without tracemalloc.
+    """
+    regressions = []
+    for key in sorted(results):
+        result = results[key]
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if result['p50'] > previous['p50'] * (1 + tolerance):
+            regressions.append('%s: median %.4fs, baseline %.4fs' % (key, result['p50'], previous['p50']))
+        if result['queries'] > previous['queries']:
+            regressions.append('%s: %d queries, baseline %d' % (key, result['queries'], previous['queries']))
+        if (result['peakMemoryMb'] is not None and previous['peakMemoryMb'] is not None and
+                result['peakMemoryMb'] > previous['peakMemoryMb'] * (1 + tolerance)):
+            regressions.append('%s: peak memory %.1fMB, baseline %.1fMB' %
+                               (key, result['peakMemoryMb'], previous['peakMemoryMb']))
+    return regressions
+
+
+def getEnvironment():
+    """ What the results depend on besides the code, saved with them """
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'database': connection.vendor,
+            'machine': platform.machine(),
+            'processor': platform.processor()}
+
+
+@contextmanager
+def localStorage():
+    """ Keep stored data files and the sample cache in a temporary directory instead of CouchDB and DATA_ROOT """
+    root = tempfile.mkdtemp(prefix='instrumentDataBenchmark')
+    try:
+        with override_settings(
+                XGDS_INSTRUMENT_DATA_STORAGE='xgds_instrument.contentStorage.ContentAddressedFileSystemStorage',
+                XGDS_INSTRUMENT_DATA_STORAGE_ROOT=os.path.join(root, 'data'),
+                XGDS_INSTRUMENT_DATA_STORAGE_URL='/benchmark/',
+                XGDS_INSTRUMENT_SAMPLE_CACHE_DIR=os.path.join(root, 'sampleCache'),
+                XGDS_INSTRUMENT_STAGING_DIR=os.path.join(root, 'staging')):
+            # the data storage is created on first use, so have it created again from these settings
+            models.dataStorage._wrapped = empty
+            try:
+                yield root
+            finally:
+                models.dataStorage._wrapped = empty
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class InstrumentDataBenchmark(object):
+    """
+    Benchmark one science instrument and the data product model its importer creates.
+    Results are keyed by case and size, e.g. json_100000.
+    """
+    def __init__(self, instrument, productModel, sizes=SIZES, repeat=5, delimiter=','):
+        self.instrument = instrument
+        self.productModel = productModel
+        self.model = LazyGetModelByName(productModel).get()
+        self.importer = importerRegistry.getImporter(instrument.dataImportFunctionName)
+        self.sizes = sizes
+        self.repeat = repeat
+        self.delimiter = delimiter
+        self.client = Client()
+        self.dataProducts = []
+
+    def getPortableFileName(self, size, seed):
+        extensions = self.importer.portableExtensions or ('.csv',)
+        return 'benchmark_%d_%d%s' % (size, seed, extensions[0])
+
+    def getLabels(self):
+        return self.importer.sampleColumns or ('Wavelength (nm)', 'Reflectance')
+
+    def importSpectrum(self, size, seed):
+        """ Post a synthetic spectrum to instrumentDataImport and return the product created """
+        portableFile = BytesIO(formatSpectrum(syntheticSpectrum(size, seed), self.getLabels(), self.delimiter))
+        portableFile.name = self.getPortableFileName(size, seed)
+        random = np.random.RandomState(seed)
+        response = self.client.post(reverse('instrument_data_import'),
+                                    {'instrument': self.instrument.pk,
+                                     'portableDataFile': portableFile,
+                                     'dataCollectionTime': '2016-06-01 12:00:00',
+                                     'timezone': 'Etc/UTC',
+                                     'lat': LOCATION[0] + random.uniform(-0.01, 0.01),
+                                     'lon': LOCATION[1] + random.uniform(-0.01, 0.01)})
+        success, pk, message = bulkImport.getImportResult(response)
+        if not success:
+            raise RuntimeError('Importing %s failed: %s' % (portableFile.name, message))
+        if pk is None:
+            return self.model.objects.filter(instrument=self.instrument).latest('pk')
+        return self.model.objects.get(pk=pk)
+
+    def get(self, urlName, dataProduct, data=None):
+        response = self.client.get(reverse(urlName, kwargs={'productModel': self.productModel,
+                                                            'productPk': dataProduct.pk}), data or {})
+        if response.status_code != 200:
+            raise RuntimeError('%s of %s returned %d' % (urlName, dataProduct.pk, response.status_code))
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def runSize(self, size):
+        results = {}
+        dataProducts = []
+        results['import_%d' % size] = measure(lambda i: dataProducts.append(self.importSpectrum(size, size + i)),
+                                              self.repeat, items=size)
+        self.dataProducts.extend(dataProducts)
+        dataProduct = dataProducts[0]
+        # computed once the import commits, which never happens in the rolled back run, so run here
+        results['derived_%d' % size] = measure(
+            lambda i: models.updateDerivedData(self.productModel, dataProducts[i % len(dataProducts)].pk),
+            self.repeat, items=size)
+
+        results['json_cold_%d' % size] = measure(lambda i: self.get('instrument_data_json', dataProduct),
+                                                 self.repeat, items=size,
+                                                 setup=lambda i: sampleCache.clearProductCache(dataProduct))
+        results['json_%d' % size] = measure(lambda i: self.get('instrument_data_json', dataProduct),
+                                            self.repeat, items=size)
+        results['json_lod_%d' % size] = measure(lambda i: self.get('instrument_data_json', dataProduct,
+                                                                   {'maxPoints': LOD_POINTS}),
+                                                self.repeat, items=size)
+        results['csv_%d' % size] = measure(lambda i: self.get('instrument_data_csv', dataProduct),
+                                           self.repeat, items=size)
+
+        def editPosition(i):
+            offset = 0.001 * (i + 1)
+            views.editInstrumentDataPosition(dataProduct, str(LOCATION[0] + offset), str(LOCATION[1] + offset), '10')
+        results['position_%d' % size] = measure(editPosition, self.repeat)
+        return results
+
+    def getSearchForm(self, data):
+        formClass = views.getSearchFormClass(self.productModel) or SearchInstrumentDataForm
+        form = formClass(data, model=self.model)
+        if not form.is_valid():
+            raise RuntimeError('Invalid search: %s' % form.errors.as_text())
+        return form
+
+    def runSearch(self):
+        """ Search the products imported by the other cases by area and feature value """
+        data = {'min_latitude': LOCATION[0] - 0.02, 'max_latitude': LOCATION[0] + 0.02,
+                'min_longitude': LOCATION[1] - 0.02, 'max_longitude': LOCATION[1] + 0.02,
+                'feature_name': 'y_max', 'min_feature_value': 0}
+
+        def search(i):
+            query = self.getSearchForm(data).getQuery()
+            return self.model.objects.filter(query).toFlatDicts()
+        return {'search_%d' % len(self.dataProducts): measure(search, self.repeat, items=len(self.dataProducts))}
+
+    def getUser(self):
+        return User.objects.create_superuser(BENCHMARK_USERNAME, '', BENCHMARK_USERNAME)
+
+    def run(self):
+        """ Run every case and return the results; nothing the cases create is kept """
+        results = {}
+        with localStorage(), transaction.atomic():
+            self.client.force_login(self.getUser())
+            for size in self.sizes:
+                results.update(self.runSize(size))
+            results.update(self.runSearch())
+            transaction.set_rollback(True)
+        return results
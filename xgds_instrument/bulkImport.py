@@ -0,0 +1,246 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Import many instrument data files at once, from a zip archive or a server side directory.
+
+Portable data files are paired with the manufacturer data file that has the same base
+name, and each pair is handed to the instrument's importer function exactly as a single
+upload through instrumentDataImport would be.
+"""
+
+import datetime
+import httplib
+import json
+import os
+import tempfile
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import pytz
+from django.conf import settings
+from django.core.files import File
+from django.db import connection
+
+from xgds_instrument import contentStorage
+from xgds_instrument.models import findDuplicateProducts
+
+
+def getStagingDir():
+    stagingDir = settings.XGDS_INSTRUMENT_STAGING_DIR
+    if not stagingDir:
+        stagingDir = os.path.join(getattr(settings, 'DATA_ROOT', tempfile.gettempdir()),
+                                  settings.XGDS_INSTRUMENT_DATA_SUBDIRECTORY,
+                                  'staging')
+    if not os.path.isdir(stagingDir):
+        try:
+            os.makedirs(stagingDir)
+        except OSError:
+            if not os.path.isdir(stagingDir):
+                raise
+    return stagingDir
+
+
+def getExtension(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def listDirectory(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if not name.startswith('.'):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def extractZip(zipFile, destination):
+    """ Extract the files in the zip into destination, ignoring directory structure, and return their paths """
+    paths = []
+    with zipfile.ZipFile(zipFile) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if not name or name.startswith('.'):
+                continue
+            path = os.path.join(destination, name)
+            with archive.open(info) as source, open(path, 'wb') as target:
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+            # keep the time the file was written, it is the fallback collection time
+            stamp = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(path, (stamp, stamp))
+            paths.append(path)
+    return sorted(paths)
+
+
+def pairInstrumentFiles(paths, portableExtensions=None, manufacturerExtensions=None):
+    """
+    Pair each portable data file with the manufacturer data file of the same base name.
+    Returns a list of (portablePath, manufacturerPath or None) and a list of results for files that were skipped.
+    """
+    if portableExtensions is None:
+        portableExtensions = settings.XGDS_INSTRUMENT_PORTABLE_EXTENSIONS
+    if manufacturerExtensions is None:
+        manufacturerExtensions = settings.XGDS_INSTRUMENT_MANUFACTURER_EXTENSIONS
+
+    portables = {}
+    manufacturers = {}
+    skipped = []
+    for path in paths:
+        stem = os.path.splitext(path)[0]
+        extension = getExtension(path)
+        if extension in portableExtensions:
+            portables[stem] = path
+        elif extension in manufacturerExtensions:
+            manufacturers[stem] = path
+        else:
+            skipped.append(buildResult(path, False, 'Not an instrument data file.'))
+
+    pairs = []
+    for stem in sorted(portables):
+        pairs.append((portables[stem], manufacturers.pop(stem, None)))
+    for stem in sorted(manufacturers):
+        skipped.append(buildResult(manufacturers[stem], False, 'No portable data file for this manufacturer data file.'))
+    return pairs, skipped
+
+
+def buildResult(path, success, message='', pk=None):
+    return {'file': os.path.basename(path),
+            'status': 'success' if success else 'error',
+            'message': message,
+            'pk': pk}
+
+
+def buildDuplicateResult(path, dataProduct):
+    return {'file': os.path.basename(path),
+            'status': 'duplicate',
+            'message': 'Already imported as %s' % dataProduct.pk,
+            'pk': dataProduct.pk}
+
+
+def getImportResult(result):
+    """
+    Importer functions return an HttpResponse, or a dict with status and pk.
+    Returns (success, pk, message) for either.
+    """
+    if isinstance(result, dict):
+        return (result.get('status', 'success') == 'success',
+                result.get('pk', result.get('object_id')),
+                result.get('message', ''))
+
+    statusCode = getattr(result, 'status_code', httplib.OK)
+    success = statusCode < httplib.BAD_REQUEST
+    pk = None
+    message = ''
+    if result is not None and result.get('Content-Type', '').startswith('application/json'):
+        try:
+            body = json.loads(result.content)
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            pk = body.get('pk', body.get('object_id'))
+            message = body.get('message', body.get('error', ''))
+    if not success and not message:
+        message = 'Importer failed with status %d.' % statusCode
+    return success, pk, message
+
+
+def getFileTime(path):
+    """ The modification time of the file in utc """
+    return datetime.datetime.fromtimestamp(os.path.getmtime(path), pytz.utc)
+
+
+def importFilePair(importFxn, instrument, portablePath, manufacturerPath, user=None, timezone=pytz.utc,
+                   vehicle=None, collector=None, utcStamp=None, latitude=None, longitude=None, altitude=None,
+                   object_id=None):
+    """ Run the importer on one pair of files on disk and return a result dict """
+    portableHash = contentStorage.getPathHash(portablePath)
+    if settings.XGDS_INSTRUMENT_SKIP_DUPLICATE_IMPORTS:
+        duplicates = findDuplicateProducts(instrument, portableHash)
+        if duplicates:
+            return buildDuplicateResult(portablePath, duplicates[0])
+    if utcStamp is None:
+        utcStamp = getFileTime(portablePath)
+    portableFile = File(open(portablePath, 'rb'), name=os.path.basename(portablePath))
+    portableFile.sha256 = portableHash
+    manufacturerFile = None
+    if manufacturerPath:
+        manufacturerFile = File(open(manufacturerPath, 'rb'), name=os.path.basename(manufacturerPath))
+    try:
+        result = importFxn(instrument=instrument,
+                           portableDataFile=portableFile,
+                           manufacturerDataFile=manufacturerFile,
+                           utcStamp=utcStamp,
+                           timezone=timezone,
+                           vehicle=vehicle,
+                           user=user,
+                           latitude=latitude,
+                           longitude=longitude,
+                           altitude=altitude,
+                           collector=collector,
+                           object_id=object_id)
+        success, pk, message = getImportResult(result)
+    except Exception as e:
+        success, pk, message = False, None, str(e)
+    finally:
+        portableFile.close()
+        if manufacturerFile:
+            manufacturerFile.close()
+    return buildResult(portablePath, success, message, pk)
+
+
+def importPairs(importFxn, instrument, pairs, poolSize=None, onResult=None, **importKwargs):
+    """
+    Import each (portablePath, manufacturerPath) pair, up to poolSize pairs at a time.
+    onResult is called with each result as it completes, in the calling thread.
+    Returns the result dicts in completion order.
+    """
+    if poolSize is None:
+        poolSize = settings.XGDS_INSTRUMENT_IMPORT_POOL_SIZE
+    if not pairs:
+        return []
+
+    def importPair(pair):
+        try:
+            return importFilePair(importFxn, instrument, pair[0], pair[1], **importKwargs)
+        finally:
+            connection.close()
+
+    results = []
+    pool = ThreadPool(max(1, min(poolSize, len(pairs))))
+    try:
+        for result in pool.imap_unordered(importPair, pairs):
+            results.append(result)
+            if onResult:
+                onResult(result)
+    finally:
+        pool.terminate()
+    return results
+
+
+def runBulkImport(importer, instrument, paths, poolSize=None, **importKwargs):
+    """
+    Pair the files by the extensions the importer accepts, and import each pair up to poolSize pairs at a time.
+    importer is an importerRegistry.ImporterInfo.
+    Returns one result dict per file pair or skipped file, in file name order.
+    """
+    pairs, results = pairInstrumentFiles(paths, importer.portableExtensions, importer.manufacturerExtensions)
+    results.extend(importPairs(importer.function, instrument, pairs, poolSize, **importKwargs))
+    return sorted(results, key=lambda result: result['file'])
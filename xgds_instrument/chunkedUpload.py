@@ -0,0 +1,198 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Chunked, resumable uploads of instrument data files.
+
+A client declares the file name, size and sha256, then sends the bytes in chunks, each
+tagged with the offset it starts at.  Chunks are appended to a file in the staging
+directory, so after a dropped connection the client asks how much arrived and carries on
+from there.  When the last byte arrives the checksum is verified, and the staged file can
+be handed to the importer by its upload id.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+
+from xgds_instrument import bulkImport
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+META_NAME = 'upload.json'
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadChecksumError(UploadError):
+    """ The received file did not match its declared sha256, and was removed """
+    pass
+
+
+class UploadOffsetError(UploadError):
+    """ A chunk did not start where the received data ends """
+    def __init__(self, offset):
+        super(UploadOffsetError, self).__init__('Upload continues at offset %d' % offset)
+        self.offset = offset
+
+
+def getUploadRoot():
+    return os.path.join(bulkImport.getStagingDir(), 'uploads')
+
+
+def getUploadDir(uploadId):
+    if not UPLOAD_ID_PATTERN.match(uploadId or ''):
+        raise UploadError('No upload %s' % uploadId)
+    return os.path.join(getUploadRoot(), uploadId)
+
+
+def getUploadMeta(uploadId):
+    """ The declared name, size and sha256 of the upload, raising UploadError if there is none """
+    try:
+        with open(os.path.join(getUploadDir(uploadId), META_NAME)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        raise UploadError('No upload %s' % uploadId)
+
+
+def writeUploadMeta(uploadId, meta):
+    path = os.path.join(getUploadDir(uploadId), META_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.rename(path + '.tmp', path)
+
+
+def getStagedPath(uploadId, meta=None):
+    meta = meta or getUploadMeta(uploadId)
+    return os.path.join(getUploadDir(uploadId), meta['filename'])
+
+
+def getReceivedSize(uploadId, meta=None):
+    try:
+        return os.path.getsize(getStagedPath(uploadId, meta))
+    except OSError:
+        return 0
+
+
+def getUploadStatus(uploadId):
+    meta = getUploadMeta(uploadId)
+    offset = getReceivedSize(uploadId, meta)
+    return {'uploadId': uploadId,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'offset': offset,
+            'complete': offset == meta['size'],
+            'verified': meta.get('verified', False)}
+
+
+def getLastActivity(path):
+    """
+    When the upload in the directory at path last changed: appending a chunk only touches
+    the staged file, and verifying it the meta file, not the directory itself.
+    """
+    times = [os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)]
+    return max(times) if times else os.path.getmtime(path)
+
+
+def removeExpiredUploads():
+    root = getUploadRoot()
+    if not os.path.isdir(root):
+        return
+    expiry = time.time() - settings.XGDS_INSTRUMENT_UPLOAD_EXPIRY_HOURS * 3600
+    for entry in os.listdir(root):
+        path = os.path.join(root, entry)
+        try:
+            if getLastActivity(path) < expiry:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def createUpload(filename, size, sha256):
+    """ Start an upload and return its id """
+    filename = os.path.basename(filename or '')
+    if not filename or filename in (META_NAME, META_NAME + '.tmp'):
+        raise UploadError('Give the name of the file.')
+    if size < 0 or size > settings.XGDS_INSTRUMENT_UPLOAD_MAX_SIZE:
+        raise UploadError('Files must be at most %d bytes.' % settings.XGDS_INSTRUMENT_UPLOAD_MAX_SIZE)
+    if not SHA256_PATTERN.match(sha256 or ''):
+        raise UploadError('Give the sha256 of the file as 64 hex digits.')
+    removeExpiredUploads()
+    uploadId = uuid.uuid4().hex
+    os.makedirs(getUploadDir(uploadId))
+    meta = {'filename': filename, 'size': size, 'sha256': sha256}
+    open(getStagedPath(uploadId, meta), 'wb').close()
+    writeUploadMeta(uploadId, meta)
+    return uploadId
+
+
+def verifyUpload(uploadId, meta):
+    sha = hashlib.sha256()
+    with open(getStagedPath(uploadId, meta), 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    if sha.hexdigest() != meta['sha256']:
+        removeUpload(uploadId)
+        raise UploadChecksumError('The uploaded file does not match its sha256; upload it again.')
+    meta['verified'] = True
+    writeUploadMeta(uploadId, meta)
+
+
+def appendChunk(uploadId, offset, stream):
+    """
+    Append the data read from stream at offset and return the upload status.  Chunks that
+    overlap data already received raise UploadOffsetError with the offset to resume from.
+    """
+    meta = getUploadMeta(uploadId)
+    with open(getStagedPath(uploadId, meta), 'ab') as target:
+        fcntl.flock(target, fcntl.LOCK_EX)
+        received = os.fstat(target.fileno()).st_size
+        if offset != received or meta.get('verified'):
+            raise UploadOffsetError(received)
+        for chunk in iter(lambda: stream.read(64 * 1024), b''):
+            received += len(chunk)
+            if received > meta['size']:
+                target.truncate(offset)
+                raise UploadError('The upload is longer than its declared size.')
+            target.write(chunk)
+        target.flush()
+    if received == meta['size']:
+        verifyUpload(uploadId, meta)
+    return getUploadStatus(uploadId)
+
+
+def takeVerifiedUpload(uploadId, stagingDir):
+    """ Move a verified upload into stagingDir and return its path there """
+    meta = getUploadMeta(uploadId)
+    if not meta.get('verified'):
+        raise UploadError('Upload %s is not complete.' % uploadId)
+    path = os.path.join(stagingDir, meta['filename'])
+    os.rename(getStagedPath(uploadId, meta), path)
+    removeUpload(uploadId)
+    return path
+
+
+def removeUpload(uploadId):
+    shutil.rmtree(getUploadDir(uploadId), ignore_errors=True)
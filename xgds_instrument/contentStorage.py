@@ -0,0 +1,216 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Content addressed storage of instrument data files.
+
+The backend is the storage class named by XGDS_INSTRUMENT_DATA_STORAGE.  It is the plain
+CouchDbStorage unless one of the content addressed storages here is chosen: CouchDB
+attachments, or the local filesystem, which also serves memory mapped reads for
+sample parsing on single node servers.
+
+With those, files are stored under their sha256 digest, so importing the same file again links the
+blob that is already stored instead of uploading another copy.  The digest is computed
+while the upload streams in by the hashing upload handlers, or from the file when it is
+saved if it came from somewhere else.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.utils.functional import LazyObject
+from django.utils.module_loading import import_string
+
+from xgds_core.couchDbStorage import CouchDbStorage
+
+DIGEST_PATTERN = re.compile(r'sha256/[0-9a-f]{2}/([0-9a-f]{64})')
+
+
+def getContentHash(content):
+    """ The sha256 hex digest of a File, remembered on it so the file is only read once """
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    content.sha256 = sha.hexdigest()
+    return content.sha256
+
+
+def getPathHash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def getContentName(digest, originalName):
+    extension = os.path.splitext(originalName)[1].lower()
+    return '%ssha256/%s/%s%s' % (settings.XGDS_INSTRUMENT_DATA_SUBDIRECTORY, digest[:2], digest, extension)
+
+
+def getNameHash(name):
+    """ The digest in a content addressed file name, or None """
+    match = DIGEST_PATTERN.search(name or '')
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorageMixin(object):
+    """ Mix into a Storage class so saves are named by content and existing blobs are not written again """
+    def save(self, name, content, max_length=None):
+        name = getContentName(getContentHash(content), name or content.name)
+        if self.exists(name):
+            return name
+        return super(ContentAddressedStorageMixin, self).save(name, content, max_length=max_length)
+
+
+class PooledCouchDbStorage(CouchDbStorage):
+    """ CouchDbStorage reading and writing through the shared keep-alive client """
+    @property
+    def client(self):
+        from xgds_instrument import couchClient  # requests is only loaded once a file is read or written
+        return couchClient.getClient()
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.client.getAttachment(name), name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        data = b''.join(content.chunks())
+        return self.client.putAttachment(name, data, getattr(content, 'content_type', None) or
+                                         'application/octet-stream')
+
+    def exists(self, name):
+        return self.client.exists(name)
+
+    def size(self, name):
+        return self.client.getSize(name)
+
+    def fetchMany(self, names, poolSize=None):
+        """ Yield (name, data or exception) for many files, fetched concurrently """
+        return self.client.fetchAttachments(names, poolSize)
+
+
+class ContentAddressedCouchDbStorage(ContentAddressedStorageMixin, PooledCouchDbStorage):
+    pass
+
+
+class ContentAddressedFileSystemStorage(ContentAddressedStorageMixin, FileSystemStorage):
+    """ Files on local disk under XGDS_INSTRUMENT_DATA_STORAGE_ROOT, DATA_ROOT by default """
+    def __init__(self, location=None, base_url=None, **kwargs):
+        if location is None:
+            location = settings.XGDS_INSTRUMENT_DATA_STORAGE_ROOT or getattr(settings, 'DATA_ROOT', None)
+        if base_url is None:
+            base_url = settings.XGDS_INSTRUMENT_DATA_STORAGE_URL or getattr(settings, 'DATA_URL', None)
+        super(ContentAddressedFileSystemStorage, self).__init__(location=location, base_url=base_url, **kwargs)
+
+
+def getStorageClass(path=None):
+    return import_string(path or settings.XGDS_INSTRUMENT_DATA_STORAGE)
+
+
+class DataStorage(LazyObject):
+    """ The configured instrument data storage, created on first use like django's default_storage """
+    def _setup(self):
+        self._wrapped = getStorageClass()()
+
+    def deconstruct(self):
+        # so model fields using it do not serialize the configured backend into migrations
+        return ('xgds_instrument.contentStorage.DataStorage', (), {})
+
+
+def getLocalPath(storage, name):
+    """ The path of the stored file on local disk, or None if the storage is remote """
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+@contextmanager
+def openDataBuffer(storage, name):
+    """
+    The content of a stored file as a read only buffer: memory mapped from local disk when
+    the storage has a path for it, otherwise read from the storage.
+    """
+    path = getLocalPath(storage, name)
+    if path is None:
+        dataFile = storage.open(name, 'rb')
+        try:
+            yield dataFile.read()
+        finally:
+            dataFile.close()
+        return
+    with open(path, 'rb') as dataFile:
+        if os.fstat(dataFile.fileno()).st_size == 0:
+            yield b''  # empty files cannot be mapped
+            return
+        mapped = mmap.mmap(dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+class HashingUploadHandlerMixin(object):
+    """ Hash uploaded files chunk by chunk as they stream in, setting sha256 on the uploaded file """
+    def new_file(self, *args, **kwargs):
+        self.sha = hashlib.sha256()
+        return super(HashingUploadHandlerMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha.update(raw_data)
+        return super(HashingUploadHandlerMixin, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploadedFile = super(HashingUploadHandlerMixin, self).file_complete(file_size)
+        if uploadedFile is not None:
+            uploadedFile.sha256 = self.sha.hexdigest()
+        return uploadedFile
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def useHashingUploadHandlers(request):
+    """
+    Hash the files uploaded with this request as they stream in, in place of django's default
+    handlers; other configured handlers are kept.  Call before request.POST or FILES is read.
+    """
+    handlers = [handler for handler in request.upload_handlers
+                if type(handler) not in (MemoryFileUploadHandler, TemporaryFileUploadHandler)]
+    handlers.insert(0, HashingTemporaryFileUploadHandler(request))
+    handlers.insert(0, HashingMemoryFileUploadHandler(request))
+    request.upload_handlers = handlers
@@ -0,0 +1,115 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Pooled CouchDB client for instrument data file attachments.
+
+CouchDbStorage keeps each file as a document whose id is the file name, with the data in
+an attachment named 'content'.  CouchAttachmentClient reads and writes those documents
+over one requests session whose keep-alive connection pool is shared by every thread, so
+batch reads, exports and reindexing can fetch many attachments at once without opening a
+connection per file.
+"""
+
+import base64
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+ATTACHMENT_NAME = 'content'
+
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+class CouchAttachmentClient(object):
+    def __init__(self, serverUrl, database, poolSize=None, timeout=None):
+        self.databaseUrl = '%s/%s' % (serverUrl.rstrip('/'), quote(database, safe=''))
+        self.poolSize = poolSize or settings.XGDS_INSTRUMENT_COUCHDB_POOL_SIZE
+        self.timeout = timeout or settings.XGDS_INSTRUMENT_COUCHDB_TIMEOUT
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.poolSize, pool_block=True,
+                              max_retries=settings.XGDS_INSTRUMENT_COUCHDB_RETRIES)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def getDocumentUrl(self, name):
+        return '%s/%s' % (self.databaseUrl, quote(name, safe=''))
+
+    def getAttachmentUrl(self, name):
+        return '%s/%s' % (self.getDocumentUrl(name), ATTACHMENT_NAME)
+
+    def exists(self, name):
+        response = self.session.head(self.getDocumentUrl(name), timeout=self.timeout)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def getAttachment(self, name):
+        """ The attachment data of the named file, raising IOError if it is missing """
+        response = self.session.get(self.getAttachmentUrl(name), timeout=self.timeout)
+        if response.status_code == 404:
+            raise IOError('No file %s in CouchDB' % name)
+        response.raise_for_status()
+        return response.content
+
+    def putAttachment(self, name, data, contentType='application/octet-stream'):
+        """ Store the data as a new document in one request """
+        document = {'size': len(data),
+                    '_attachments': {ATTACHMENT_NAME: {'content_type': contentType,
+                                                       'data': base64.b64encode(data).decode('ascii')}}}
+        response = self.session.put(self.getDocumentUrl(name), json=document, timeout=self.timeout)
+        response.raise_for_status()
+        return name
+
+    def getSize(self, name):
+        response = self.session.head(self.getAttachmentUrl(name), timeout=self.timeout)
+        response.raise_for_status()
+        return int(response.headers['Content-Length'])
+
+    def fetchAttachments(self, names, poolSize=None):
+        """ Yield (name, data or the exception raised) for each name in order, poolSize at a time """
+        def fetch(name):
+            try:
+                return name, self.getAttachment(name)
+            except (IOError, requests.RequestException) as e:
+                return name, e
+        pool = ThreadPool(poolSize or self.poolSize)
+        try:
+            for result in pool.imap(fetch, names):
+                yield result
+        finally:
+            pool.terminate()
+
+
+def getClient(serverUrl=None, database=None):
+    """ The shared client for the CouchDB file store, one per server and database """
+    serverUrl = serverUrl or settings.XGDS_INSTRUMENT_COUCHDB_URL or settings.COUCHDB_URL
+    database = database or settings.XGDS_INSTRUMENT_COUCHDB_DATABASE or settings.COUCHDB_FILESTORE_NAME
+    with _clientsLock:
+        key = (serverUrl, database)
+        if key not in _clients:
+            _clients[key] = CouchAttachmentClient(serverUrl, database)
+        return _clients[key]
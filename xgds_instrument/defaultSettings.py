@@ -41,13 +41,91 @@ XGDS_INSTRUMENT_INSTRUMENT_MODEL = 'xgds_instrument.ScienceInstrument'
 XGDS_INSTRUMENT_IMPORT_MODULE_PATH = 'xgds_instrument.instrumentDataImporters'
 XGDS_INSTRUMENT_DATA_SUBDIRECTORY = "xgds_instrument/"
 
+# Storage class for instrument data files, and where the local filesystem one keeps them
+# (DATA_ROOT and DATA_URL when blank).  The content addressed storages name each file by the
+# sha256 of its contents so identical files are stored once; use the filesystem one on single
+# node servers.  migrateInstrumentDataStorage copies existing files between backends.
+XGDS_INSTRUMENT_DATA_STORAGE = 'xgds_core.couchDbStorage.CouchDbStorage'
+# XGDS_INSTRUMENT_DATA_STORAGE = 'xgds_instrument.contentStorage.ContentAddressedCouchDbStorage'
+# XGDS_INSTRUMENT_DATA_STORAGE = 'xgds_instrument.contentStorage.ContentAddressedFileSystemStorage'
+XGDS_INSTRUMENT_DATA_STORAGE_ROOT = ''
+XGDS_INSTRUMENT_DATA_STORAGE_URL = ''
+
+# CouchDB data files are read through one keep-alive connection pool per process.
+# The url and database default to COUCHDB_URL and COUCHDB_FILESTORE_NAME.
+XGDS_INSTRUMENT_COUCHDB_URL = ''
+XGDS_INSTRUMENT_COUCHDB_DATABASE = ''
+XGDS_INSTRUMENT_COUCHDB_POOL_SIZE = 16
+XGDS_INSTRUMENT_COUCHDB_TIMEOUT = 30  # seconds
+XGDS_INSTRUMENT_COUCHDB_RETRIES = 2
+
+# Science instruments are cached in each process; edits made by other processes show up within this many seconds
+XGDS_INSTRUMENT_CACHE_TIMEOUT = 300
+
+# Decoded samples are cached as .npy files so portable data files are only parsed once.
+# If XGDS_INSTRUMENT_SAMPLE_CACHE_DIR is empty the cache lives under DATA_ROOT.
+XGDS_INSTRUMENT_SAMPLE_CACHE = True
+XGDS_INSTRUMENT_SAMPLE_CACHE_DIR = ''
+
+# Upper limit on the maxPoints level of detail parameter of getInstrumentDataJson
+XGDS_INSTRUMENT_MAX_PLOT_POINTS = 20000
+
+# Time series data products store their samples in blocks of this many rows
+XGDS_INSTRUMENT_TIME_SERIES_BLOCK_SIZE = 4096
+
+# Chunked uploads (see chunkedUpload.py) may be this large, and are removed if left unfinished this long
+XGDS_INSTRUMENT_UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+XGDS_INSTRUMENT_UPLOAD_EXPIRY_HOURS = 48
+
+# Files already imported for an instrument, by content, are not imported again
+XGDS_INSTRUMENT_SKIP_DUPLICATE_IMPORTS = True
+
+# Extra features computed from the samples of each instrument's products, see sampleFeatures.py
+XGDS_INSTRUMENT_FEATURES = {}
+
+# Products are resampled onto a common x grid per instrument for similarity search, see similarityIndex.py.
+# Grids are (min x, max x, points) by instrument shortName; otherwise one spans the first product indexed.
+XGDS_INSTRUMENT_SIMILARITY_INDEX = True
+XGDS_INSTRUMENT_SIMILARITY_GRIDS = {}
+XGDS_INSTRUMENT_SIMILARITY_GRID_SIZE = 512
+XGDS_INSTRUMENT_SIMILARITY_MAX_RESULTS = 100
+
+# Map clusters are this many pixels across; from XGDS_INSTRUMENT_CLUSTER_MAX_ZOOM on the map gets individual products
+XGDS_INSTRUMENT_CLUSTER_CELL_PIXELS = 64
+XGDS_INSTRUMENT_CLUSTER_MAX_ZOOM = 16
+
+# The change feed cursor is moved back this far so rows committed during a query are sent again rather than missed
+XGDS_INSTRUMENT_CHANGES_OVERLAP_SECONDS = 5
+
+# How many data products' samples are read at once by batch requests
+XGDS_INSTRUMENT_READ_POOL_SIZE = 8
+
+# File extensions accepted for the portable and manufacturer data files
+XGDS_INSTRUMENT_PORTABLE_EXTENSIONS = ('.spc', '.txt', '.csv', '.asp')
+XGDS_INSTRUMENT_MANUFACTURER_EXTENSIONS = ('.pdz', '.a2r', '.asd')
+
+# Bulk import.  Uploads are unpacked in XGDS_INSTRUMENT_STAGING_DIR (under DATA_ROOT if empty),
+# and server side directories can only be imported from within XGDS_INSTRUMENT_BULK_IMPORT_ROOT.
+XGDS_INSTRUMENT_STAGING_DIR = ''
+XGDS_INSTRUMENT_BULK_IMPORT_ROOT = ''
+XGDS_INSTRUMENT_IMPORT_POOL_SIZE = 4
+
+# Number of import jobs each server process runs at once when imports are posted with async=true
+XGDS_INSTRUMENT_IMPORT_JOB_WORKERS = 2
+
+# Features and similarity index entries of saved products are computed on the import job workers
+# once the save commits; turn this off to compute them in the saving thread instead.
+XGDS_INSTRUMENT_DERIVED_DATA_ASYNC = True
+
 # Include a dictionary of name to url for imports if you wish to include import functionality
 XGDS_DATA_IMPORTS = getOrCreateDict('XGDS_DATA_IMPORTS')
 XGDS_DATA_IMPORTS["Science Instruments"]= '/xgds_instrument/instrumentDataImport'
+XGDS_DATA_IMPORTS["Science Instruments (Bulk)"]= '/xgds_instrument/instrumentDataBulkImport'
 
 SCIENCE_INSTRUMENT_DATA_IMPORTERS = []
 
 XGDS_MAP_SERVER_JS_MAP = getOrCreateDict('XGDS_MAP_SERVER_JS_MAP')
+# The ol files use xgds_instrument/js/olInstrumentDataLayer.js, which the map page must load first
 # XGDS_MAP_SERVER_JS_MAP['InstrumentDataProduct'] = {'ol': 'xgds_instrument/js/olInstrumentDataProduct.js',
 #                                                    'model': XGDS_INSTRUMENT_DATA_PRODUCT_MODEL,
 #                                                    'hiddenColumns': []}
\ No newline at end of file
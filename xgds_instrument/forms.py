@@ -14,10 +14,15 @@
 # specific language governing permissions and limitations under the License.
 # __END_LICENSE__
 
+import copy
 import datetime
+import math
+import os
 import pytz
 from django import forms
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db.models import ExpressionWrapper, F, FloatField, Q
 from django.utils.functional import lazy
 
 from dal import autocomplete
@@ -30,12 +35,29 @@ from geocamUtil.forms.AbstractImportForm import getTimezoneChoices
 
 from xgds_core.forms import SearchForm, AbstractImportVehicleForm
 from xgds_core.models import XgdsUser
+from xgds_instrument import chunkedUpload, importerRegistry, instrumentCache
 
 
 class InstrumentModelChoiceField(ModelChoiceField):
     def label_from_instance(self, obj):
         return obj.displayName
 
+    def to_python(self, value):
+        """
+        Look the chosen instrument up in instrumentCache instead of querying for it, unless the
+        queryset has been narrowed, e.g. to active instruments.  The cached instance is shared,
+        so the form gets a copy.
+        """
+        if value in self.empty_values:
+            return None
+        query = self.queryset.query
+        if query.has_filters() or not query.can_filter():
+            return super(InstrumentModelChoiceField, self).to_python(value)
+        try:
+            return copy.copy(instrumentCache.getInstrument(int(value)))
+        except (ValueError, TypeError, ObjectDoesNotExist):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
 
 class ImportInstrumentDataForm(AbstractImportVehicleForm):
     date_formats = list(forms.DateTimeField.input_formats) + [
@@ -52,19 +74,49 @@ class ImportInstrumentDataForm(AbstractImportVehicleForm):
                                        required=False)
 
     INSTRUMENT_MODEL = LazyGetModelByName(settings.XGDS_INSTRUMENT_INSTRUMENT_MODEL)
-    instrument = InstrumentModelChoiceField(INSTRUMENT_MODEL.get().objects.all(), 
-                                            label="Instrument")
-    portableDataFile = ExtFileField(ext_whitelist=(".spc",".txt",".csv",".asp" ),
+    instrument = InstrumentModelChoiceField(None, label="Instrument")  # queryset set in __init__
+    portableDataFile = ExtFileField(ext_whitelist=settings.XGDS_INSTRUMENT_PORTABLE_EXTENSIONS,
                                     required=True,
                                     label="Portable Data File")
-    manufacturerDataFile = ExtFileField(ext_whitelist=(".pdz",".a2r",".asd" ),
+    manufacturerDataFile = ExtFileField(ext_whitelist=settings.XGDS_INSTRUMENT_MANUFACTURER_EXTENSIONS,
                                         required=False,
                                         label="Manufacturer Data File")
 
     lat = forms.FloatField(label="Latitude", required=False)
     lon = forms.FloatField(label="Longitude", required=False)
     alt = forms.FloatField(label="Altitude", required=False)
-    
+
+    def __init__(self, *args, **kwargs):
+        super(ImportInstrumentDataForm, self).__init__(*args, **kwargs)
+        self.fields['instrument'].queryset = self.INSTRUMENT_MODEL.get().objects.all()
+        # accept whatever any registered importer accepts; clean checks the chosen instrument's importer
+        if 'portableDataFile' in self.fields:
+            self.fields['portableDataFile'].ext_whitelist = importerRegistry.getAllPortableExtensions()
+        if 'manufacturerDataFile' in self.fields:
+            self.fields['manufacturerDataFile'].ext_whitelist = importerRegistry.getAllManufacturerExtensions()
+
+    def clean_instrument(self):
+        instrument = self.cleaned_data['instrument']
+        if instrument:
+            try:
+                importerRegistry.getImporter(instrument.dataImportFunctionName)
+            except ImproperlyConfigured as e:
+                raise forms.ValidationError("%s has no importer: %s" % (instrument.displayName, e))
+        return instrument
+
+    def clean(self):
+        cleaned_data = super(ImportInstrumentDataForm, self).clean()
+        instrument = cleaned_data.get('instrument')
+        if instrument:
+            importer = importerRegistry.getImporter(instrument.dataImportFunctionName)
+            for key, extensions in (('portableDataFile', importer.portableExtensions),
+                                    ('manufacturerDataFile', importer.manufacturerExtensions)):
+                dataFile = cleaned_data.get(key)
+                if dataFile and os.path.splitext(dataFile.name)[1].lower() not in extensions:
+                    self.add_error(key, "%s data files must be one of %s" % (instrument.displayName,
+                                                                             ', '.join(extensions)))
+        return cleaned_data
+
     def editingSetup(self, dataProduct):
         self.fields['portableDataFile'].widget = forms.HiddenInput()
         self.fields['manufacturerDataFile'].widget = forms.HiddenInput()
@@ -107,6 +159,94 @@ class ImportInstrumentDataForm(AbstractImportVehicleForm):
         return instance
 
 
+class BulkImportInstrumentDataForm(ImportInstrumentDataForm):
+    """ Import every data file in an uploaded zip or a server side directory """
+    dataCollectionTime = DateTimeField(label="Collection Time",
+                                       input_formats=ImportInstrumentDataForm.date_formats,
+                                       required=False,
+                                       help_text="Leave blank to use the time of each file")
+    portableDataFile = None
+    manufacturerDataFile = None
+    archive = ExtFileField(ext_whitelist=(".zip",),
+                           required=False,
+                           label="Zip Archive")
+    directory = forms.CharField(required=False,
+                                label="Server Directory",
+                                help_text="Within %s" % settings.XGDS_INSTRUMENT_BULK_IMPORT_ROOT)
+
+    def clean_directory(self):
+        directory = self.cleaned_data['directory']
+        if not directory:
+            return directory
+        root = settings.XGDS_INSTRUMENT_BULK_IMPORT_ROOT
+        if not root:
+            raise forms.ValidationError("Importing from server directories is not enabled.")
+        directory = os.path.realpath(os.path.join(root, directory))
+        if not directory.startswith(os.path.realpath(root) + os.sep) and directory != os.path.realpath(root):
+            raise forms.ValidationError("Directory must be within %s." % root)
+        if not os.path.isdir(directory):
+            raise forms.ValidationError("No such directory.")
+        return directory
+
+    def clean(self):
+        cleaned_data = super(BulkImportInstrumentDataForm, self).clean()
+        if bool(cleaned_data.get('archive')) == bool(cleaned_data.get('directory')):
+            raise forms.ValidationError("Choose either a zip archive or a server directory.")
+        return cleaned_data
+
+
+class StagedImportInstrumentDataForm(ImportInstrumentDataForm):
+    """ Import files that arrived through the chunked upload endpoints, named by their upload ids """
+    portableDataFile = None
+    manufacturerDataFile = None
+    portableUploadId = forms.CharField(required=True, label="Portable Data Upload")
+    manufacturerUploadId = forms.CharField(required=False, label="Manufacturer Data Upload")
+
+    def clean_upload(self, key):
+        uploadId = self.cleaned_data[key]
+        if not uploadId:
+            return None
+        try:
+            status = chunkedUpload.getUploadStatus(uploadId)
+        except chunkedUpload.UploadError as e:
+            raise forms.ValidationError(str(e))
+        if not status['verified']:
+            raise forms.ValidationError("Upload %s has %d of %d bytes." % (uploadId, status['offset'], status['size']))
+        return status
+
+    def clean_portableUploadId(self):
+        return self.clean_upload('portableUploadId')
+
+    def clean_manufacturerUploadId(self):
+        return self.clean_upload('manufacturerUploadId')
+
+    def clean(self):
+        cleaned_data = super(StagedImportInstrumentDataForm, self).clean()
+        instrument = cleaned_data.get('instrument')
+        if instrument:
+            importer = importerRegistry.getImporter(instrument.dataImportFunctionName)
+            for key, extensions in (('portableUploadId', importer.portableExtensions),
+                                    ('manufacturerUploadId', importer.manufacturerExtensions)):
+                upload = cleaned_data.get(key)
+                if upload and os.path.splitext(upload['filename'])[1].lower() not in extensions:
+                    self.add_error(key, "%s data files must be one of %s" % (instrument.displayName,
+                                                                             ', '.join(extensions)))
+        return cleaned_data
+
+
+METERS_PER_DEGREE = 111320.0
+POSITION_BOUNDS_FIELDS = ('latitude', 'longitude')
+
+
+def splitBoundName(fieldname, minimum=False, maximum=False):
+    """ The name a min_ or max_ search field bounds, and whether it is a minimum or a maximum """
+    if fieldname.startswith('min_'):
+        return fieldname[4:], True, maximum
+    if fieldname.startswith('max_'):
+        return fieldname[4:], minimum, True
+    return fieldname, minimum, maximum
+
+
 class SearchInstrumentDataForm(SearchForm):
     min_acquisition_time = forms.DateTimeField(input_formats=settings.XGDS_CORE_DATE_FORMATS,
                                                required=False, label='Min Time',
@@ -122,6 +262,23 @@ class SearchInstrumentDataForm(SearchForm):
                                        widget=autocomplete.ModelSelect2(url='select2_model_user'),
                                        required=False)
 
+    min_latitude = forms.FloatField(required=False, label='Min Latitude')
+    max_latitude = forms.FloatField(required=False, label='Max Latitude')
+    min_longitude = forms.FloatField(required=False, label='Min Longitude')
+    max_longitude = forms.FloatField(required=False, label='Max Longitude')
+    near_latitude = forms.FloatField(required=False, label='Near Latitude')
+    near_longitude = forms.FloatField(required=False, label='Near Longitude')
+    radius = forms.FloatField(required=False, min_value=0, label='Within (m)',
+                              help_text='Distance from the near latitude and longitude')
+    feature_name = forms.CharField(required=False, label='Feature',
+                                   help_text='e.g. y_max, peak_1_x or a configured band')
+    min_feature_value = forms.FloatField(required=False, label='Min Feature Value')
+    max_feature_value = forms.FloatField(required=False, label='Max Feature Value')
+
+    def __init__(self, *args, **kwargs):
+        # the product model searched, needed by the radius query; a model form's own model by default
+        self.model = kwargs.pop('model', None) or getattr(getattr(self, '_meta', None), 'model', None)
+        super(SearchInstrumentDataForm, self).__init__(*args, **kwargs)
     
     # populate the times properly
     def clean_min_acquisition_time(self):
@@ -152,13 +309,68 @@ class SearchInstrumentDataForm(SearchForm):
                 )
             else:
                 del cleaned_data["acquisition_timezone"]
+
+        nearFields = [cleaned_data.get(f) is not None for f in ('near_latitude', 'near_longitude', 'radius')]
+        if any(nearFields) and not all(nearFields):
+            raise forms.ValidationError("Near latitude, near longitude and distance go together.")
+
+        if not cleaned_data.get('feature_name') and (cleaned_data.get('min_feature_value') is not None or
+                                                     cleaned_data.get('max_feature_value') is not None):
+            raise forms.ValidationError("Feature is required for min / max feature values.")
         return cleaned_data
 
+    def buildBoundsQuery(self, name, value, minimum, maximum):
+        lookup = 'effective_%s__%s' % (name, 'gte' if minimum else 'lte')
+        return Q(**{lookup: value})
+
+    def buildRadiusQuery(self, radius):
+        """
+        Products within radius meters of the near latitude and longitude: an indexed bounding box,
+        refined by an equirectangular distance computed in sql.
+        """
+        latitude = self.cleaned_data['near_latitude']
+        longitude = self.cleaned_data['near_longitude']
+        latitudeRange = radius / METERS_PER_DEGREE
+        cosLatitude = max(math.cos(math.radians(latitude)), 0.01)
+        longitudeRange = latitudeRange / cosLatitude
+        boxQuery = Q(effective_latitude__range=(latitude - latitudeRange, latitude + latitudeRange),
+                     effective_longitude__range=(longitude - longitudeRange, longitude + longitudeRange))
+        if self.model is None:
+            raise ImproperlyConfigured('%s needs the product model to search within a radius'
+                                       % self.__class__.__name__)
+        dy = F('effective_latitude') - latitude
+        dx = (F('effective_longitude') - longitude) * cosLatitude
+        withinRadius = self.model.objects.filter(boxQuery).annotate(
+            squaredDegrees=ExpressionWrapper(dx * dx + dy * dy, output_field=FloatField())
+        ).filter(squaredDegrees__lte=latitudeRange * latitudeRange).values('pk')
+        return boxQuery & Q(pk__in=withinRadius)
+
+    def buildFeatureQuery(self, name):
+        """ Products with a stored feature of that name within the min and max values, one indexed join """
+        conditions = {'features__name': name}
+        if self.cleaned_data.get('min_feature_value') is not None:
+            conditions['features__value__gte'] = self.cleaned_data['min_feature_value']
+        if self.cleaned_data.get('max_feature_value') is not None:
+            conditions['features__value__lte'] = self.cleaned_data['max_feature_value']
+        return Q(**conditions)
 
     def buildQueryForField(self, fieldname, field, value, minimum=False, maximum=False):
+        # the min_ and max_ fields may come with their prefix or stripped with minimum or maximum set
+        name, isMinimum, isMaximum = splitBoundName(fieldname, minimum, maximum)
+        if name == 'feature_name':
+            return self.buildFeatureQuery(value)
+        if name == 'feature_value':
+            return Q()  # used by feature_name
+        if name in POSITION_BOUNDS_FIELDS:
+            return self.buildBoundsQuery(name, value, isMinimum, isMaximum)
+        if fieldname in ('near_latitude', 'near_longitude'):
+            return Q()  # used by radius
+        if fieldname == 'radius':
+            return self.buildRadiusQuery(value)
         if fieldname == 'description' or fieldname == 'name':
             return self.buildContainsQuery(fieldname, field, value)
         return super(SearchInstrumentDataForm, self).buildQueryForField(fieldname, field, value, minimum, maximum)
 
+
     class Meta:
         abstract = True
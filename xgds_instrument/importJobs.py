@@ -0,0 +1,131 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Asynchronous instrument data imports, and the features and similarity index entries
+computed after products are saved.
+
+Uploaded files are copied to a staging directory and an InstrumentImportJob row is
+created, then the import runs on a worker pool in this process while the client polls
+the job status.  The job row is updated as each file finishes, so any server process
+can report progress.
+"""
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+
+from xgds_instrument import bulkImport, models
+from xgds_instrument.models import InstrumentImportJob
+
+logger = logging.getLogger(__name__)
+
+_workerPool = None
+_workerPoolLock = threading.Lock()
+
+
+def getWorkerPool():
+    global _workerPool
+    with _workerPoolLock:
+        if _workerPool is None:
+            _workerPool = ThreadPool(settings.XGDS_INSTRUMENT_IMPORT_JOB_WORKERS)
+        return _workerPool
+
+
+def createStagingDir():
+    return tempfile.mkdtemp(dir=bulkImport.getStagingDir())
+
+
+def stageUploadedFile(uploadedFile, stagingDir):
+    """ Copy an uploaded file into the staging directory and return its path """
+    path = os.path.join(stagingDir, os.path.basename(uploadedFile.name))
+    with open(path, 'wb') as target:
+        for chunk in uploadedFile.chunks():
+            target.write(chunk)
+    return path
+
+
+def submitImportJob(importFxn, instrument, pairs, stagingDir=None, user=None, skipped=None, **importKwargs):
+    """
+    Queue the import of (portablePath, manufacturerPath) pairs and return the new job.
+    Results for files that were skipped before the import can be passed in skipped.
+    The staging directory is removed when the job finishes.
+    """
+    skipped = skipped or []
+    creator = user if user is not None and user.is_authenticated() else None
+    job = InstrumentImportJob.objects.create(instrument=instrument,
+                                             creator=creator,
+                                             creation_time=datetime.datetime.now(pytz.utc),
+                                             total=len(pairs) + len(skipped),
+                                             completed=len(skipped),
+                                             results=json.dumps(skipped))
+    importKwargs['user'] = user
+    # start once the job row is committed so the worker can see it
+    transaction.on_commit(lambda: getWorkerPool().apply_async(runImportJob,
+                                                              (job.pk, importFxn, instrument, pairs, stagingDir),
+                                                              importKwargs))
+    return job
+
+
+def submitDerivedDataUpdate(productModelName, pk):
+    """ Compute a saved product's features and similarity index entry on the worker pool """
+    getWorkerPool().apply_async(runDerivedDataUpdate, (productModelName, pk))
+
+
+def runDerivedDataUpdate(productModelName, pk):
+    try:
+        models.updateDerivedData(productModelName, pk)
+    except Exception:
+        logger.exception('Could not update the derived data of %s %s', productModelName, pk)
+    finally:
+        connection.close()
+
+
+def runImportJob(jobId, importFxn, instrument, pairs, stagingDir, **importKwargs):
+    job = InstrumentImportJob.objects.get(pk=jobId)
+    results = job.getResults()
+
+    def recordResult(result):
+        results.append(result)
+        InstrumentImportJob.objects.filter(pk=jobId).update(completed=len(results),
+                                                            results=json.dumps(results))
+
+    try:
+        InstrumentImportJob.objects.filter(pk=jobId).update(status=InstrumentImportJob.STATUS_RUNNING)
+        bulkImport.importPairs(importFxn, instrument, pairs, onResult=recordResult, **importKwargs)
+        failures = len([r for r in results if r['status'] != 'success'])
+        InstrumentImportJob.objects.filter(pk=jobId).update(
+            status=InstrumentImportJob.STATUS_DONE,
+            end_time=datetime.datetime.now(pytz.utc),
+            message='Imported %d of %d files' % (len(results) - failures, len(results)))
+    except Exception as e:
+        logger.exception('Instrument import job %s failed', jobId)
+        InstrumentImportJob.objects.filter(pk=jobId).update(status=InstrumentImportJob.STATUS_FAILED,
+                                                            end_time=datetime.datetime.now(pytz.utc),
+                                                            message=str(e)[:1024])
+    finally:
+        if stagingDir:
+            shutil.rmtree(stagingDir, ignore_errors=True)
+        connection.close()
@@ -0,0 +1,153 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Registry of instrument data importer functions.
+
+Importer functions live in XGDS_INSTRUMENT_IMPORT_MODULE_PATH and are named by
+ScienceInstrument.dataImportFunctionName.  The module is imported once when the app
+is ready; functions listed in SCIENCE_INSTRUMENT_DATA_IMPORTERS or decorated with
+importerMetadata are registered then, and any other name is resolved and cached on
+first use.
+
+An importer can describe itself with the importerMetadata decorator:
+
+  @importerMetadata(portableExtensions=('.txt',), manufacturerExtensions=('.asd',),
+                    sampleColumns=('Wavelength (nm)', 'Reflectance'))
+  def asdImporter(instrument, portableDataFile, manufacturerDataFile, ...):
+"""
+
+import importlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+_importers = {}
+_lock = threading.Lock()
+
+
+def importerMetadata(portableExtensions=None, manufacturerExtensions=None, sampleColumns=None):
+    """ Decorator declaring the files an importer accepts and the sample columns it produces """
+    def decorate(function):
+        function.isInstrumentDataImporter = True
+        if portableExtensions is not None:
+            function.portableExtensions = tuple(e.lower() for e in portableExtensions)
+        if manufacturerExtensions is not None:
+            function.manufacturerExtensions = tuple(e.lower() for e in manufacturerExtensions)
+        if sampleColumns is not None:
+            function.sampleColumns = tuple(sampleColumns)
+        return function
+    return decorate
+
+
+class ImporterInfo(object):
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self.portableExtensions = getattr(function, 'portableExtensions',
+                                          tuple(settings.XGDS_INSTRUMENT_PORTABLE_EXTENSIONS))
+        self.manufacturerExtensions = getattr(function, 'manufacturerExtensions',
+                                              tuple(settings.XGDS_INSTRUMENT_MANUFACTURER_EXTENSIONS))
+        self.sampleColumns = getattr(function, 'sampleColumns', None)
+
+    def toDict(self):
+        return {'name': self.name,
+                'portableExtensions': list(self.portableExtensions),
+                'manufacturerExtensions': list(self.manufacturerExtensions),
+                'sampleColumns': list(self.sampleColumns) if self.sampleColumns else None}
+
+
+def getImportModule():
+    return importlib.import_module(settings.XGDS_INSTRUMENT_IMPORT_MODULE_PATH)
+
+
+def register(name, function):
+    if not callable(function):
+        raise ImproperlyConfigured('Instrument data importer %s is not callable' % name)
+    with _lock:
+        _importers[name] = ImporterInfo(name, function)
+    return _importers[name]
+
+
+def loadImporters():
+    """ Import the importer module and register its importers; called once when the app is ready """
+    try:
+        module = getImportModule()
+    except ImportError as e:
+        logger.warning('Could not load instrument data importers from %s: %s',
+                       settings.XGDS_INSTRUMENT_IMPORT_MODULE_PATH, e)
+        return
+    for name in settings.SCIENCE_INSTRUMENT_DATA_IMPORTERS:
+        function = getattr(module, name, None)
+        if function is None:
+            logger.warning('Instrument data importer %s is not in %s',
+                           name, settings.XGDS_INSTRUMENT_IMPORT_MODULE_PATH)
+            continue
+        register(name, function)
+    for name, function in vars(module).items():
+        if getattr(function, 'isInstrumentDataImporter', False):
+            register(name, function)
+
+
+def getImporter(name):
+    """ The ImporterInfo for the importer function name, raising ImproperlyConfigured if there is none """
+    info = _importers.get(name)
+    if info is not None:
+        return info
+    try:
+        function = getattr(getImportModule(), name)
+    except (ImportError, AttributeError):
+        raise ImproperlyConfigured('No instrument data importer %s in %s' %
+                                   (name, settings.XGDS_INSTRUMENT_IMPORT_MODULE_PATH))
+    return register(name, function)
+
+
+def getImporterFunction(name):
+    return getImporter(name).function
+
+
+def getRegisteredImporters():
+    with _lock:
+        return dict(_importers)
+
+
+def getAllPortableExtensions():
+    extensions = set(settings.XGDS_INSTRUMENT_PORTABLE_EXTENSIONS)
+    for info in getRegisteredImporters().values():
+        extensions.update(info.portableExtensions)
+    return sorted(extensions)
+
+
+def getAllManufacturerExtensions():
+    extensions = set(settings.XGDS_INSTRUMENT_MANUFACTURER_EXTENSIONS)
+    for info in getRegisteredImporters().values():
+        extensions.update(info.manufacturerExtensions)
+    return sorted(extensions)
+
+
+def validateInstruments(instruments):
+    """ Returns a list of problems with the importers named by the given science instruments """
+    problems = []
+    for instrument in instruments:
+        try:
+            getImporter(instrument.dataImportFunctionName)
+        except ImproperlyConfigured as e:
+            problems.append('%s: %s' % (instrument.shortName, e))
+    return problems
@@ -0,0 +1,97 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Process local cache of ScienceInstrument rows.
+
+There are a handful of instruments and they rarely change, but their names, labels,
+units and importer names are needed on nearly every request.  All instruments are
+loaded with one query on first use and kept until an instrument is saved or deleted in
+this process, or XGDS_INSTRUMENT_CACHE_TIMEOUT seconds pass so other processes' edits
+show up.  The cached instances are shared; do not modify them.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+from geocamUtil.loader import LazyGetModelByName
+
+INSTRUMENT_MODEL = LazyGetModelByName(settings.XGDS_INSTRUMENT_INSTRUMENT_MODEL)
+
+_lock = threading.Lock()
+_cache = None
+
+
+def load():
+    instruments = list(INSTRUMENT_MODEL.get().objects.all().order_by('pk'))
+    return {'loadTime': time.time(),
+            'all': instruments,
+            'pk': dict((instrument.pk, instrument) for instrument in instruments),
+            'shortName': dict((instrument.shortName, instrument) for instrument in instruments),
+            'displayName': dict((instrument.displayName, instrument) for instrument in instruments)}
+
+
+def getCache():
+    global _cache
+    with _lock:
+        if _cache is None or time.time() - _cache['loadTime'] > settings.XGDS_INSTRUMENT_CACHE_TIMEOUT:
+            _cache = load()
+        return _cache
+
+
+def invalidate(*args, **kwargs):
+    """ Drop the cache; connected to the instrument model's post_save and post_delete """
+    global _cache
+    with _lock:
+        _cache = None
+
+
+def lookup(key, value):
+    """ The instrument whose key field is value, raising DoesNotExist if there is none """
+    instrument = getCache()[key].get(value)
+    if instrument is None:
+        raise INSTRUMENT_MODEL.get().DoesNotExist('No science instrument with %s %s' % (key, value))
+    return instrument
+
+
+def getInstrument(pk):
+    return lookup('pk', pk)
+
+
+def getInstrumentByShortName(shortName):
+    return lookup('shortName', shortName)
+
+
+def getInstrumentByDisplayName(displayName):
+    return lookup('displayName', displayName)
+
+
+def getInstruments(active=None):
+    instruments = getCache()['all']
+    if active is not None:
+        instruments = [instrument for instrument in instruments if instrument.active == active]
+    return instruments
+
+
+def getPlotLabels(instrument):
+    """ The plot labels from XGDS_MAP_SERVER_JS_MAP, or labels made from the instrument's own labels and units """
+    mapEntry = settings.XGDS_MAP_SERVER_JS_MAP.get(instrument.displayName, {})
+    if 'plotLabels' in mapEntry:
+        return mapEntry['plotLabels']
+    return ['%s (%s)' % (instrument.xLabel, instrument.xUnits) if instrument.xUnits else instrument.xLabel,
+            '%s (%s)' % (instrument.yLabel, instrument.yUnits) if instrument.yUnits else instrument.yLabel]
@@ -28,14 +28,20 @@ one of the steps is "prepapps", which calls
 management/appCommands/prep.py command for each app (if it exists).
 """
 
+from django.conf import settings
 from django.core.management.base import NoArgsCommand
 
+from geocamUtil.loader import LazyGetModelByName
 from geocamUtil.management import commandUtil
+from xgds_instrument import importerRegistry
 
 
 class Command(NoArgsCommand):
     help = 'Prep xgds_instrument'
 
     def handle_noargs(self, **options):
-        # put your code here
-        pass
+        # make sure every science instrument names an importer that exists
+        INSTRUMENT_MODEL = LazyGetModelByName(settings.XGDS_INSTRUMENT_INSTRUMENT_MODEL)
+        problems = importerRegistry.validateInstruments(INSTRUMENT_MODEL.get().objects.filter(active=True))
+        for problem in problems:
+            self.stderr.write('WARNING: %s' % problem)
@@ -0,0 +1,82 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import json
+
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from xgds_instrument import benchmarks, instrumentCache
+
+
+class Command(BaseCommand):
+    help = ('Benchmark importing, reading, exporting, moving and searching synthetic instrument data, '
+            'optionally comparing with a saved baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('instrument', help='shortName of the science instrument')
+        parser.add_argument('productModel', help='data product model its importer creates, e.g. myApp.MyDataProduct')
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(benchmarks.SIZES),
+                            help='numbers of points in the synthetic spectra')
+        parser.add_argument('--repeat', type=int, default=5, help='times each case is run')
+        parser.add_argument('--delimiter', default=',', help='column delimiter of the synthetic data files')
+        parser.add_argument('--output', help='save the results to this json file, e.g. as the next baseline')
+        parser.add_argument('--baseline', help='compare with results saved by --output')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='fraction the median time or peak memory may grow over the baseline')
+
+    def handle(self, *args, **options):
+        try:
+            instrument = instrumentCache.getInstrumentByShortName(options['instrument'])
+        except ObjectDoesNotExist:
+            raise CommandError('No science instrument %s' % options['instrument'])
+        try:
+            benchmark = benchmarks.InstrumentDataBenchmark(instrument, options['productModel'],
+                                                           sizes=options['sizes'],
+                                                           repeat=options['repeat'],
+                                                           delimiter=options['delimiter'])
+        except (ImproperlyConfigured, LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        results = benchmark.run()
+        self.stdout.write('%-24s %10s %10s %10s %12s %8s %10s' %
+                          ('case', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'per second', 'queries', 'peak (MB)'))
+        for key in sorted(results):
+            result = results[key]
+            peakMemory = '%.1f' % result['peakMemoryMb'] if result['peakMemoryMb'] is not None else '-'
+            self.stdout.write('%-24s %10.4f %10.4f %10.4f %12.1f %8d %10s' %
+                              (key, result['p50'], result['p90'], result['p99'], result['throughput'] or 0,
+                               result['queries'], peakMemory))
+        processPeakMemoryMb = benchmarks.getProcessPeakMemoryMb()
+        self.stdout.write('Process peak memory %.1fMB' % processPeakMemoryMb)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'environment': benchmarks.getEnvironment(),
+                           'processPeakMemoryMb': processPeakMemoryMb,
+                           'results': results}, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if baseline.get('environment') != benchmarks.getEnvironment():
+                self.stdout.write('The baseline was recorded in a different environment: %s' % baseline.get('environment'))
+            regressions = benchmarks.compareToBaseline(results, baseline['results'], options['tolerance'])
+            for regression in regressions:
+                self.stdout.write(regression)
+            if regressions:
+                raise CommandError('%d regressions from %s' % (len(regressions), options['baseline']))
+            self.stdout.write('No regressions from %s' % options['baseline'])
@@ -0,0 +1,96 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+import pytz
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from geocamUtil.loader import LazyGetModelByName
+from xgds_instrument import bulkImport, importerRegistry, instrumentCache
+
+
+class Command(BaseCommand):
+    help = 'Import instrument data files from directories and zip archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('instrument', help='shortName of the science instrument')
+        parser.add_argument('paths', nargs='+', help='directories, zip archives or data files')
+        parser.add_argument('--timezone', default=settings.TIME_ZONE,
+                            help='timezone of the instrument clock')
+        parser.add_argument('--vehicle', help='name of the vehicle')
+        parser.add_argument('--user', help='username recorded as the creator')
+        parser.add_argument('--collector', help='username of the person who collected the data')
+        parser.add_argument('--poolSize', type=int, default=None,
+                            help='number of file pairs imported at once')
+
+    def getUser(self, username):
+        if not username:
+            return None
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError('No user %s' % username)
+
+    def handle(self, *args, **options):
+        try:
+            instrument = instrumentCache.getInstrumentByShortName(options['instrument'])
+        except ObjectDoesNotExist:
+            raise CommandError('No science instrument %s' % options['instrument'])
+        try:
+            importer = importerRegistry.getImporter(instrument.dataImportFunctionName)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        vehicle = None
+        if options['vehicle']:
+            VEHICLE_MODEL = LazyGetModelByName(settings.XGDS_CORE_VEHICLE_MODEL)
+            vehicle = VEHICLE_MODEL.get().objects.get(name=options['vehicle'])
+
+        stagingDir = tempfile.mkdtemp(dir=bulkImport.getStagingDir())
+        try:
+            paths = []
+            for path in options['paths']:
+                if os.path.isdir(path):
+                    paths.extend(bulkImport.listDirectory(path))
+                elif zipfile.is_zipfile(path):
+                    zipDir = tempfile.mkdtemp(dir=stagingDir)
+                    paths.extend(bulkImport.extractZip(path, zipDir))
+                else:
+                    paths.append(path)
+
+            results = bulkImport.runBulkImport(importer, instrument, paths,
+                                               poolSize=options['poolSize'],
+                                               user=self.getUser(options['user']),
+                                               timezone=pytz.timezone(options['timezone']),
+                                               vehicle=vehicle,
+                                               collector=self.getUser(options['collector']))
+        finally:
+            shutil.rmtree(stagingDir, ignore_errors=True)
+
+        failures = 0
+        for result in results:
+            if result['status'] != 'success':
+                failures += 1
+            self.stdout.write('%s %s %s %s' % (result['status'], result['file'],
+                                               result['pk'] if result['pk'] is not None else '',
+                                               result['message']))
+        self.stdout.write('Imported %d of %d files' % (len(results) - failures, len(results)))
@@ -0,0 +1,113 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from multiprocessing.pool import ThreadPool
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from xgds_core.couchDbStorage import CouchDbStorage
+
+from xgds_instrument import contentStorage
+from xgds_instrument.models import AbstractInstrumentDataProduct
+
+FILE_FIELDS = ('portable_data_file', 'manufacturer_data_file')
+
+
+class Command(BaseCommand):
+    help = ('Copy instrument data files from one storage backend to another and point the products at the copies. '
+            'The source files are kept unless --delete-source is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='xgds_core.couchDbStorage.CouchDbStorage',
+                            help='storage class the files are in now')
+        parser.add_argument('--target', default=settings.XGDS_INSTRUMENT_DATA_STORAGE,
+                            help='storage class to copy them to, XGDS_INSTRUMENT_DATA_STORAGE by default')
+        parser.add_argument('--poolSize', type=int, default=settings.XGDS_INSTRUMENT_READ_POOL_SIZE,
+                            help='number of files copied at once')
+        parser.add_argument('--delete-source', action='store_true', dest='deleteSource',
+                            help='delete each source file once the products point at its copy')
+
+    def getProductModels(self):
+        return [model for model in apps.get_models() if issubclass(model, AbstractInstrumentDataProduct)]
+
+    def getStoredNames(self):
+        names = set()
+        for model in self.getProductModels():
+            for fieldName in FILE_FIELDS:
+                names.update(model.objects.exclude(**{fieldName: ''}).exclude(**{fieldName: None})
+                             .values_list(fieldName, flat=True).distinct())
+        return sorted(names)
+
+    def copyFile(self, name):
+        """ Returns (name, new name, error) """
+        try:
+            if contentStorage.getNameHash(name) and self.target.exists(name):
+                return name, name, None
+            source = self.source.open(name, 'rb')
+            try:
+                return name, self.target.save(name, File(source, name=name)), None
+            finally:
+                source.close()
+        except Exception as e:
+            return name, None, str(e)
+
+    def renameStoredFile(self, name, newName):
+        for model in self.getProductModels():
+            for fieldName in FILE_FIELDS:
+                model.objects.filter(**{fieldName: name}).update(**{fieldName: newName})
+
+    def isSameFile(self, name, newName):
+        """ True if the copy is the source file itself, kept under its name in the same store """
+        if newName != name:
+            return False
+        if isinstance(self.source, CouchDbStorage) and isinstance(self.target, CouchDbStorage):
+            return True
+        return (isinstance(self.source, FileSystemStorage) and isinstance(self.target, FileSystemStorage) and
+                self.source.location == self.target.location)
+
+    def deleteSourceFile(self, name):
+        try:
+            self.source.delete(name)
+            return True
+        except Exception as e:
+            self.stderr.write('%s: not deleted, %s' % (name, e))
+            return False
+
+    def handle(self, *args, **options):
+        self.source = contentStorage.getStorageClass(options['source'])()
+        self.target = contentStorage.getStorageClass(options['target'])()
+        names = self.getStoredNames()
+        copied = failures = deleted = 0
+        pool = ThreadPool(max(1, options['poolSize']))
+        try:
+            for name, newName, error in pool.imap_unordered(self.copyFile, names):
+                if error is not None:
+                    failures += 1
+                    self.stderr.write('%s: %s' % (name, error))
+                    continue
+                if newName != name:
+                    self.renameStoredFile(name, newName)
+                copied += 1
+                if options['deleteSource'] and not self.isSameFile(name, newName) and self.deleteSourceFile(name):
+                    deleted += 1
+        finally:
+            pool.terminate()
+        self.stdout.write('Copied %d of %d files, %d failed' % (copied, len(names), failures))
+        if options['deleteSource']:
+            self.stdout.write('Deleted %d source files' % deleted)
@@ -0,0 +1,46 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from geocamUtil.loader import LazyGetModelByName
+from xgds_instrument import similarityIndex
+from xgds_instrument.models import AbstractInstrumentDataProduct
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the similarity index of each science instrument from its products, dropping superseded rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('instruments', nargs='*', help='shortNames of the instruments, all by default')
+
+    def iterSampleArrays(self, instrument):
+        for model in apps.get_models():
+            if issubclass(model, AbstractInstrumentDataProduct) and model.similarityIndexed:
+                # sampleArray reads the cached array, so each product's samples are loaded once
+                for dataProduct in model.objects.filter(instrument=instrument).order_by('pk').iterator():
+                    yield dataProduct, dataProduct.sampleArray
+
+    def handle(self, *args, **options):
+        INSTRUMENT_MODEL = LazyGetModelByName(settings.XGDS_INSTRUMENT_INSTRUMENT_MODEL)
+        instruments = INSTRUMENT_MODEL.get().objects.all()
+        if options['instruments']:
+            instruments = instruments.filter(shortName__in=options['instruments'])
+        for instrument in instruments:
+            count = similarityIndex.rebuildIndex(instrument, self.iterSampleArrays(instrument))
+            self.stdout.write('Indexed %d %s products' % (count, instrument.shortName))
@@ -0,0 +1,45 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from xgds_instrument.models import AbstractInstrumentDataProduct
+
+
+class Command(BaseCommand):
+    help = 'Compute the summary features of existing instrument data products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', default=False,
+                            help='only products that have no features yet')
+
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            if not issubclass(model, AbstractInstrumentDataProduct):
+                continue
+            dataProducts = model.objects.all()
+            if options['missing']:
+                dataProducts = dataProducts.filter(features__isnull=True)
+            count = failures = 0
+            for dataProduct in dataProducts.iterator():
+                try:
+                    dataProduct.updateFeatures()
+                    count += 1
+                except Exception as e:
+                    failures += 1
+                    self.stderr.write('%s %s: %s' % (model._meta.label, dataProduct.pk, e))
+            self.stdout.write('Updated %d %s, %d failed' % (count, model._meta.label, failures))
@@ -0,0 +1,39 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from xgds_instrument.models import AbstractInstrumentDataProduct
+
+
+class Command(BaseCommand):
+    help = 'Fill in the effective position columns of existing instrument data products'
+
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            if not issubclass(model, AbstractInstrumentDataProduct):
+                continue
+            count = 0
+            with transaction.atomic():
+                for dataProduct in model.objects.all().iterator():
+                    dataProduct.updateEffectivePosition()
+                    model.objects.filter(pk=dataProduct.pk).update(effective_latitude=dataProduct.effective_latitude,
+                                                                   effective_longitude=dataProduct.effective_longitude,
+                                                                   effective_altitude=dataProduct.effective_altitude)
+                    count += 1
+            self.stdout.write('Updated %d %s' % (count, model._meta.label))
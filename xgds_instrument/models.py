@@ -14,16 +14,26 @@
 # specific language governing permissions and limitations under the License.
 # __END_LICENSE__
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Avg, Count, F, Func
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.fields import GenericRelation
+from django.contrib.contenttypes.models import ContentType
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from geocamUtil.modelJson import modelToDict
 from geocamUtil.UserUtil import getUserName
-from xgds_core.couchDbStorage import CouchDbStorage
 from xgds_core.models import SearchableModel
+from xgds_instrument import contentStorage, instrumentCache, sampleCache
+import datetime
+import json
+import logging
 import pytz
-import pandas as pd
+
+logger = logging.getLogger(__name__)
 
 def getNewDataFileName(instance, filename):
     return settings.XGDS_INSTRUMENT_DATA_SUBDIRECTORY + filename
@@ -52,13 +62,53 @@ class ScienceInstrument(models.Model):
 
     @classmethod
     def getInstrument(self, name):
-        return ScienceInstrument.objects.get(shortName=name)
+        return instrumentCache.getInstrumentByShortName(name)
 
     def __unicode__(self):
         return "%s(%s): %s %s SN:%s" % (self.displayName, self.shortName, 
                                      self.brand, self.model, self.serialNum)
     
-couchStore = CouchDbStorage()
+dataStorage = contentStorage.DataStorage()
+couchStore = dataStorage  # the name before the backend was configurable
+
+
+class InstrumentDataProductQuerySet(models.QuerySet):
+    def withRelated(self):
+        """ Join everything the product properties follow, so listing products is a single query """
+        return self.select_related(*self.model.getSelectRelatedFields())
+
+    def toFlatDicts(self):
+        return [dataProduct.toFlatDict() for dataProduct in self.withRelated()]
+
+    def inBounds(self, minLatitude, minLongitude, maxLatitude, maxLongitude):
+        return self.filter(effective_latitude__gte=minLatitude, effective_latitude__lte=maxLatitude,
+                           effective_longitude__gte=minLongitude, effective_longitude__lte=maxLongitude)
+
+    def toClusters(self, cellSize):
+        """
+        Count the products in each grid cell of cellSize degrees per instrument, grouped in the database.
+        Returns dicts with the instrument, count and centroid of each cell.
+        """
+        cells = self.filter(effective_latitude__isnull=False, effective_longitude__isnull=False)
+        cells = cells.annotate(cellX=Func(F('effective_longitude') / cellSize, function='FLOOR',
+                                          output_field=models.IntegerField()),
+                               cellY=Func(F('effective_latitude') / cellSize, function='FLOOR',
+                                          output_field=models.IntegerField()))
+        cells = cells.values('cellX', 'cellY', 'instrument__shortName', 'instrument__displayName')
+        cells = cells.annotate(count=Count('pk'),
+                               lat=Avg('effective_latitude'),
+                               lon=Avg('effective_longitude')).order_by()
+        return [{'instrument': cell['instrument__shortName'],
+                 'instrument_name': cell['instrument__displayName'],
+                 'count': cell['count'],
+                 'lat': cell['lat'],
+                 'lon': cell['lon']} for cell in cells]
+
+
+class InstrumentDataProductManager(models.Manager.from_queryset(InstrumentDataProductQuerySet)):
+    """ Plain querysets by default; views listing many products call withRelated() for the joins """
+    pass
+
 
 class AbstractInstrumentDataProduct(models.Model, SearchableModel):
     """ 
@@ -67,16 +117,19 @@ class AbstractInstrumentDataProduct(models.Model, SearchableModel):
     name = models.CharField(max_length=128, default='', blank=True, null=True, db_index=True)
     description = models.CharField(max_length=2048, blank=True)
 
-    manufacturer_data_file = models.FileField(upload_to=getNewDataFileName, max_length=256, null=True, blank=True, storage=couchStore)
+    manufacturer_data_file = models.FileField(upload_to=getNewDataFileName, max_length=256, null=True, blank=True, storage=dataStorage)
     manufacturer_mime_type = models.CharField(max_length=128,
                                              default="application/octet-stream",
                                               null=True, blank=True)
-    portable_data_file = models.FileField(upload_to=getNewDataFileName, max_length=256, storage=couchStore)
+    portable_data_file = models.FileField(upload_to=getNewDataFileName, max_length=256, storage=dataStorage)
     portable_mime_type = models.CharField(max_length=128, default="text/plain")
+    portable_file_sha256 = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    manufacturer_file_sha256 = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
     portable_file_format_name = models.CharField(max_length=128, default="ASCII")
     acquisition_time = models.DateTimeField(null=True, blank=True, db_index=True)
     acquisition_timezone = models.CharField(max_length=128, db_index=True)
     creation_time = models.DateTimeField(null=True, blank=True, db_index=True) # this is the SERVER creation time, not the acquisition time
+    modification_time = models.DateTimeField(null=True, blank=True, db_index=True, editable=False) # SERVER time of the last save
     track_position = models.ForeignKey(settings.GEOCAM_TRACK_PAST_POSITION_MODEL, null=True, blank=True, related_name="%(app_label)s_%(class)s_track_position")
     user_position = models.ForeignKey(settings.GEOCAM_TRACK_PAST_POSITION_MODEL, null=True, blank=True, related_name="%(app_label)s_%(class)s_user_position")
     collector = models.ForeignKey(User, null=True, blank=True, related_name="%(app_label)s_%(class)s_collector") # person who collected the instrument data
@@ -84,6 +137,42 @@ class AbstractInstrumentDataProduct(models.Model, SearchableModel):
     
     instrument = models.ForeignKey(ScienceInstrument)
 
+    # the position from getPosition, kept up to date on save so spatial searches run in sql
+    effective_latitude = models.FloatField(null=True, blank=True, editable=False)
+    effective_longitude = models.FloatField(null=True, blank=True, editable=False)
+    effective_altitude = models.FloatField(null=True, blank=True, editable=False)
+
+    features = GenericRelation('xgds_instrument.InstrumentDataFeature')
+
+    objects = InstrumentDataProductManager()
+
+    similarityIndexed = True  # whether products are added to similarityIndex
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(AbstractInstrumentDataProduct, cls).from_db(db, field_names, values)
+        # remember the stored file so saves can tell when derived features are stale
+        storedFile = instance.__dict__.get('portable_data_file')
+        instance._loadedPortableFileName = getattr(storedFile, 'name', storedFile) or None
+        return instance
+
+    @classmethod
+    def getSelectRelatedFields(cls):
+        """ Foreign keys joined by default when querying products; subclasses add their own """
+        return ['instrument', 'collector', 'creator', 'track_position', 'user_position']
+
+    @classmethod
+    def getProductModelName(cls):
+        return '%s.%s' % (cls._meta.app_label, cls._meta.object_name)
+
+    @classmethod
+    def getClustersUrl(cls):
+        return reverse('instrument_data_clusters', kwargs={'productModel': cls.getProductModelName()})
+
+    @classmethod
+    def getChangesUrl(cls):
+        return reverse('instrument_data_changes', kwargs={'productModel': cls.getProductModelName()})
+
     @classmethod
     def timesearchField(self):
         return 'acquisition_time'
@@ -105,6 +194,11 @@ class AbstractInstrumentDataProduct(models.Model, SearchableModel):
         return reverse('instrument_data_json',  kwargs={'productModel': self.app_label + '.' + self.model_type,
                                                         'productPk': str(self.pk)})
 
+    @property
+    def similarDataUrl(self):
+        return reverse('instrument_data_similar', kwargs={'productModel': self.app_label + '.' + self.model_type,
+                                                          'productPk': str(self.pk)})
+
     @property
     def csvDataUrl(self):
         return reverse('instrument_data_csv',  kwargs={'productModel': self.app_label + '.' + self.model_type,
@@ -122,10 +216,19 @@ class AbstractInstrumentDataProduct(models.Model, SearchableModel):
             return self.portable_data_file.url
         return None
  
+    def getCachedInstrument(self):
+        """ The product's instrument, already joined or from instrumentCache, without a query; do not modify it """
+        if self.instrument_id is None:
+            return None
+        if hasattr(self, self._meta.get_field('instrument').get_cache_name()):
+            return self.instrument
+        return instrumentCache.getInstrument(self.instrument_id)
+
     @property
     def instrument_name(self):
-        if self.instrument:
-            return self.instrument.displayName
+        instrument = self.getCachedInstrument()
+        if instrument:
+            return instrument.displayName
         return None
 
 
@@ -134,10 +237,94 @@ class AbstractInstrumentDataProduct(models.Model, SearchableModel):
             return self.user_position
         return self.track_position
 
+    def updateEffectivePosition(self):
+        position = self.getPosition()
+        self.effective_latitude = position.latitude if position else None
+        self.effective_longitude = position.longitude if position else None
+        self.effective_altitude = position.altitude if position else None
+
+    def toFlatDict(self):
+        """ A flat dictionary of what map layers and lists show, built without further queries on a withRelated queryset """
+        position = self.getPosition()
+        return {'pk': self.pk,
+                'type': self.type,
+                'name': self.name,
+                'description': self.description,
+                'instrument_name': self.instrument_name,
+                'collector_name': self.collector_name,
+                'acquisition_time': self.acquisition_time.isoformat() if self.acquisition_time else None,
+                'acquisition_timezone': self.acquisition_timezone,
+                'modification_time': self.modification_time.isoformat() if self.modification_time else None,
+                'lat': position.latitude if position else '',
+                'lon': position.longitude if position else '',
+                'alt': position.altitude if position else '',
+                'view_url': getattr(self, 'view_url', None),
+                'jsonDataUrl': self.jsonDataUrl,
+                'csvDataUrl': self.csvDataUrl,
+                'similarDataUrl': self.similarDataUrl if self.similarityIndexed else None,
+                'changesUrl': self.getChangesUrl(),
+                'portable_data_file_url': self.portable_data_file_url,
+                'manufacturer_data_file_url': self.manufacturer_data_file_url}
+
+    def toMapDict(self):
+        """
+        What the map server gives map layers: the flat dictionary, so layers can poll the change
+        feed, and the url layers load their clusters from.
+        """
+        result = self.toFlatDict()
+        result['clustersUrl'] = self.getClustersUrl()
+        return result
+
     # Returns the instrument reading(s) for this data product (e.g. wavenumber and reflectance for a spectrum)
     @property
     def samples(self):
         return []
+
+    @property
+    def sampleArray(self):
+        """ The samples as a read only float64 array cached on local disk, or None if they are not numeric """
+        return sampleCache.getSampleArray(self)
+
+    def openPortableData(self):
+        """
+        Context manager giving the portable data file content as a read only buffer, memory mapped
+        when the data storage is local; samples implementations can parse it without a copy.
+        """
+        return contentStorage.openDataBuffer(self.portable_data_file.storage, self.portable_data_file.name)
+
+    def updateFileHashes(self):
+        """ Record the content digest of each file, from its content addressed name or its new content """
+        for fieldName, hashName in (('portable_data_file', 'portable_file_sha256'),
+                                    ('manufacturer_data_file', 'manufacturer_file_sha256')):
+            dataFile = getattr(self, fieldName)
+            if not dataFile:
+                setattr(self, hashName, '')
+            elif not dataFile._committed:
+                setattr(self, hashName, contentStorage.getContentHash(dataFile.file))
+            else:
+                setattr(self, hashName, contentStorage.getNameHash(dataFile.name) or getattr(self, hashName))
+
+    def updateFeatures(self):
+        """ Recompute the stored summary features from the samples """
+        from xgds_instrument import sampleFeatures
+        features = sampleFeatures.getProductFeatures(self)
+        contentType = ContentType.objects.get_for_model(self)
+        InstrumentDataFeature.objects.filter(content_type=contentType, object_id=self.pk).delete()
+        InstrumentDataFeature.objects.bulk_create([InstrumentDataFeature(content_type=contentType,
+                                                                         object_id=self.pk,
+                                                                         name=name,
+                                                                         value=value)
+                                                   for name, value in sorted(features.items())])
+        return features
+
+    def getFeatureDict(self):
+        return dict(self.features.values_list('name', 'value'))
+
+    def getSampleList(self):
+        sampleArray = self.sampleArray
+        if sampleArray is not None:
+            return sampleArray.tolist()
+        return self.samples
     
     @classmethod
     def getSearchFormFields(cls):
@@ -157,20 +344,350 @@ class AbstractInstrumentDataProduct(models.Model, SearchableModel):
                 'flight__vehicle',
                 'acquisition_timezone',
                 'min_acquisition_time',
-                'max_acquisition_time']
+                'max_acquisition_time',
+                'min_latitude',
+                'max_latitude',
+                'min_longitude',
+                'max_longitude',
+                'near_latitude',
+                'near_longitude',
+                'radius',
+                'feature_name',
+                'min_feature_value',
+                'max_feature_value']
 
-    def getInstrumentDataCsv(self):
-        sampleList = self.samples
-        labels = settings.XGDS_MAP_SERVER_JS_MAP[self.instrument.displayName]['plotLabels']
+    def getInstrumentDataCsvFilename(self):
         stringtime = self.acquisition_time.astimezone(pytz.timezone(self.acquisition_timezone)).strftime(
             '%Y_%m_%d_%H%M')
-        filename = "%s_%s.csv" % (self.instrument.displayName, stringtime)
-        dataframe = pd.DataFrame(data=sampleList, columns=labels)
-        return filename, dataframe
+        return "%s_%s.csv" % (self.instrument_name, stringtime)
+
+    def getInstrumentDataCsvLabels(self):
+        return instrumentCache.getPlotLabels(self.getCachedInstrument())
+
+    def iterInstrumentDataCsvChunks(self, chunkSize=1000):
+        """ Yield the sample rows in lists of up to chunkSize rows, for streaming csv output """
+        sampleList = self.sampleArray
+        if sampleList is None:
+            sampleList = self.samples
+        return iterSampleChunks(sampleList, chunkSize)
+
+    def getInstrumentDataCsv(self):
+        import pandas as pd  # only needed by callers that want a DataFrame
+        sampleList = self.sampleArray
+        if sampleList is None:
+            sampleList = self.samples
+        dataframe = pd.DataFrame(data=sampleList, columns=self.getInstrumentDataCsvLabels())
+        return self.getInstrumentDataCsvFilename(), dataframe
 
     class Meta:
         abstract = True
+        # subclasses that declare their own Meta should extend AbstractInstrumentDataProduct.Meta to keep this
+        index_together = [['effective_latitude', 'effective_longitude']]
 
     def __unicode__(self):
         return "%s: %s, %s" % (self.acquisition_time, self.instrument.codeName, self.mimeType)
 
+
+class AbstractTimeSeriesDataProduct(AbstractInstrumentDataProduct):
+    """
+    A data product from a continuously logging instrument.  The samples are rows of
+    [seconds since the epoch, value, ...] kept in InstrumentTimeSeriesBlock rows, so a time
+    range can be read without loading the whole series.  acquisition_time is the time of the
+    first sample and end_time the time of the last.
+    """
+    end_time = models.DateTimeField(null=True, blank=True, db_index=True)
+    sample_count = models.IntegerField(default=0)
+    similarityIndexed = False
+    blocks = GenericRelation('xgds_instrument.InstrumentTimeSeriesBlock')
+
+    @property
+    def samples(self):
+        return self.samples_between().tolist()
+
+    def getTimeSeriesLabels(self, columns):
+        yLabel = self.getCachedInstrument().yLabel
+        if columns == 2:
+            return ['Time', yLabel]
+        return ['Time'] + ['%s %d' % (yLabel, i) for i in range(1, columns)]
+
+    def getInstrumentDataCsvLabels(self):
+        firstBlock = self.blocks.order_by('start_time').first()
+        return self.getTimeSeriesLabels(firstBlock.columns if firstBlock else 2)
+
+    def getBlocksBetween(self, t0=None, t1=None):
+        blocks = self.blocks.order_by('start_time')
+        if t0 is not None:
+            blocks = blocks.filter(end_time__gte=t0)
+        if t1 is not None:
+            blocks = blocks.filter(start_time__lte=t1)
+        return blocks
+
+    def iterSamplesBetween(self, t0=None, t1=None):
+        """ Yield the sample arrays of each block overlapping t0 to t1, sliced to that range """
+        from xgds_instrument import timeSeriesBlocks
+        start, end = timeSeriesBlocks.toEpochSeconds(t0), timeSeriesBlocks.toEpochSeconds(t1)
+        for block in self.getBlocksBetween(t0, t1).iterator():
+            samples = timeSeriesBlocks.sliceBlock(block.getSamples(), start, end)
+            if len(samples):
+                yield samples
+
+    def samples_between(self, t0=None, t1=None):
+        """ The samples with t0 <= time <= t1 as one array; either end may be None """
+        import numpy as np
+        arrays = list(self.iterSamplesBetween(t0, t1))
+        if not arrays:
+            return np.empty((0, 2))
+        return np.concatenate(arrays)
+
+    def iterInstrumentDataCsvChunks(self, chunkSize=1000, t0=None, t1=None):
+        from xgds_instrument import timeSeriesBlocks
+        for samples in self.iterSamplesBetween(t0, t1):
+            for start in range(0, len(samples), chunkSize):
+                yield [[timeSeriesBlocks.toDatetime(row[0]).isoformat()] + row[1:].tolist()
+                       for row in samples[start:start + chunkSize]]
+
+    def appendSamples(self, samples):
+        """ Store rows of [seconds since the epoch, value, ...] in new blocks and widen the time range """
+        from xgds_instrument import timeSeriesBlocks
+        contentType = ContentType.objects.get_for_model(self)
+        blocks = []
+        for blockSamples in timeSeriesBlocks.splitBlocks(samples, settings.XGDS_INSTRUMENT_TIME_SERIES_BLOCK_SIZE):
+            blocks.append(InstrumentTimeSeriesBlock(content_type=contentType,
+                                                    object_id=self.pk,
+                                                    start_time=timeSeriesBlocks.toDatetime(blockSamples[0, 0]),
+                                                    end_time=timeSeriesBlocks.toDatetime(blockSamples[-1, 0]),
+                                                    count=len(blockSamples),
+                                                    columns=blockSamples.shape[1],
+                                                    data=timeSeriesBlocks.encodeBlock(blockSamples)))
+        if not blocks:
+            return
+        InstrumentTimeSeriesBlock.objects.bulk_create(blocks)
+        if self.acquisition_time is None or blocks[0].start_time < self.acquisition_time:
+            self.acquisition_time = blocks[0].start_time
+        if self.end_time is None or blocks[-1].end_time > self.end_time:
+            self.end_time = blocks[-1].end_time
+        self.sample_count += sum(block.count for block in blocks)
+        self.save()
+        # the cache is keyed on the portable data file, which a time series does not have
+        sampleCache.clearProductCache(self)
+        scheduleDerivedDataUpdate(self)
+
+    def toFlatDict(self):
+        result = super(AbstractTimeSeriesDataProduct, self).toFlatDict()
+        result['end_time'] = self.end_time.isoformat() if self.end_time else None
+        result['sample_count'] = self.sample_count
+        result['timeSeriesJsonUrl'] = reverse('instrument_time_series_json',
+                                              kwargs={'productModel': self.getProductModelName(),
+                                                      'productPk': str(self.pk)})
+        result['timeSeriesCsvUrl'] = reverse('instrument_time_series_csv',
+                                             kwargs={'productModel': self.getProductModelName(),
+                                                     'productPk': str(self.pk)})
+        return result
+
+    class Meta:
+        abstract = True
+
+
+class InstrumentTimeSeriesBlock(models.Model):
+    """
+    Consecutive samples of a time series data product, stored column by column as float64
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    start_time = models.DateTimeField(db_index=True)
+    end_time = models.DateTimeField(db_index=True)
+    count = models.IntegerField()
+    columns = models.PositiveSmallIntegerField()
+    data = models.BinaryField()
+
+    def getSamples(self):
+        from xgds_instrument import timeSeriesBlocks
+        return timeSeriesBlocks.decodeBlock(self.data, self.count, self.columns)
+
+    class Meta:
+        index_together = [['content_type', 'object_id', 'start_time'],
+                          ['content_type', 'object_id', 'end_time']]
+
+    def __unicode__(self):
+        return "%s %s: %d samples from %s" % (self.content_type, self.object_id, self.count, self.start_time)
+
+
+class InstrumentDataFeature(models.Model):
+    """
+    A summary value derived from the samples of a data product, e.g. y_max or a band area
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    name = models.CharField(max_length=64)
+    value = models.FloatField()
+
+    class Meta:
+        index_together = [['content_type', 'object_id'],
+                          ['content_type', 'name', 'value']]
+
+    def __unicode__(self):
+        return "%s %s: %s=%s" % (self.content_type, self.object_id, self.name, self.value)
+
+
+class DeletedInstrumentDataProduct(models.Model):
+    """
+    Record of a deleted data product, so change feeds can tell clients to remove it
+    """
+    product_model = models.CharField(max_length=128)  # app_label.ModelName
+    product_pk = models.IntegerField()
+    deletion_time = models.DateTimeField(db_index=True)
+
+    class Meta:
+        index_together = [['product_model', 'deletion_time']]
+
+    def __unicode__(self):
+        return "%s %s deleted %s" % (self.product_model, self.product_pk, self.deletion_time)
+
+
+class InstrumentImportJob(models.Model):
+    """
+    An instrument data import running on the local import worker pool, so clients can poll its progress
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = ((STATUS_QUEUED, 'Queued'),
+                      (STATUS_RUNNING, 'Running'),
+                      (STATUS_DONE, 'Done'),
+                      (STATUS_FAILED, 'Failed'))
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    instrument = models.ForeignKey(ScienceInstrument, null=True, blank=True)
+    creator = models.ForeignKey(User, null=True, blank=True, related_name="%(app_label)s_%(class)s_creator")
+    creation_time = models.DateTimeField(null=True, blank=True, db_index=True)
+    end_time = models.DateTimeField(null=True, blank=True)
+    total = models.IntegerField(default=0)  # number of files in the job
+    completed = models.IntegerField(default=0)  # number of files imported or failed so far
+    results = models.TextField(default='[]', blank=True)  # json list of per file results
+    message = models.CharField(max_length=1024, default='', blank=True)
+
+    def getResults(self):
+        return json.loads(self.results) if self.results else []
+
+    @property
+    def statusUrl(self):
+        return reverse('instrument_import_job_status', kwargs={'jobId': str(self.pk)})
+
+    def toDict(self):
+        results = self.getResults()
+        return {'id': self.pk,
+                'status': self.status,
+                'total': self.total,
+                'completed': self.completed,
+                'message': self.message,
+                'results': results,
+                'pks': [r['pk'] for r in results if r.get('pk') is not None],
+                'statusUrl': self.statusUrl}
+
+    def __unicode__(self):
+        return "Import job %s: %s %d/%d" % (self.pk, self.status, self.completed, self.total)
+
+
+@receiver(pre_save)
+def updateProductOnSave(sender, instance, **kwargs):
+    if isinstance(instance, AbstractInstrumentDataProduct):
+        instance.modification_time = datetime.datetime.now(pytz.utc)
+        if instance.creation_time is None and instance._state.adding:
+            instance.creation_time = instance.modification_time
+        instance.updateEffectivePosition()
+        instance.updateFileHashes()
+
+
+def iterSampleChunks(sampleList, chunkSize=1000):
+    """ Yield a sample array or list in lists of up to chunkSize rows """
+    if hasattr(sampleList, 'ndim') and sampleList.ndim == 1:
+        sampleList = sampleList.reshape(-1, 1)
+    for start in range(0, len(sampleList), chunkSize):
+        chunk = sampleList[start:start + chunkSize]
+        yield chunk.tolist() if hasattr(chunk, 'tolist') else chunk
+
+
+def findDuplicateProducts(instrument, portableFileHash):
+    """ Products of the instrument whose portable data file has that content """
+    duplicates = []
+    for model in apps.get_models():
+        if issubclass(model, AbstractInstrumentDataProduct):
+            duplicates.extend(model.objects.filter(instrument=instrument, portable_file_sha256=portableFileHash))
+    return duplicates
+
+
+def updateDerivedData(productModelName, pk):
+    """ Compute the stored features and similarity index entry of the product, if it still exists """
+    instance = apps.get_model(productModelName).objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    try:
+        instance.updateFeatures()
+    except Exception:
+        # the product is saved either way; updateInstrumentDataFeatures can fill these in later
+        logger.exception('Could not compute features of %s %s', productModelName, pk)
+    if instance.similarityIndexed and settings.XGDS_INSTRUMENT_SIMILARITY_INDEX:
+        from xgds_instrument import similarityIndex
+        try:
+            similarityIndex.indexProduct(instance)
+        except Exception:
+            logger.exception('Could not index %s %s', productModelName, pk)
+
+
+def scheduleDerivedDataUpdate(instance):
+    """
+    Update the derived data of the product once the transaction saving it commits, on the
+    import job pool unless XGDS_INSTRUMENT_DERIVED_DATA_ASYNC is off.
+    """
+    productModelName, pk = instance.getProductModelName(), instance.pk
+
+    def submit():
+        if settings.XGDS_INSTRUMENT_DERIVED_DATA_ASYNC:
+            from xgds_instrument import importJobs
+            importJobs.submitDerivedDataUpdate(productModelName, pk)
+        else:
+            updateDerivedData(productModelName, pk)
+    transaction.on_commit(submit)
+
+
+@receiver(post_save)
+def updateProductDerivedData(sender, instance, created=False, **kwargs):
+    """ Schedule the derived data of new products and of products whose portable data file changed """
+    if not isinstance(instance, AbstractInstrumentDataProduct):
+        return
+    fileName = instance.portable_data_file.name if instance.portable_data_file else None
+    if not created and fileName == getattr(instance, '_loadedPortableFileName', None):
+        return
+    instance._loadedPortableFileName = fileName
+    scheduleDerivedDataUpdate(instance)
+
+
+def updatePositionProducts(sender, instance, created=False, **kwargs):
+    """ When a position is edited, update the effective position of the products that use it """
+    if created:
+        return
+    values = {'effective_latitude': instance.latitude,
+              'effective_longitude': instance.longitude,
+              'effective_altitude': instance.altitude,
+              'modification_time': datetime.datetime.now(pytz.utc)}
+    for model in apps.get_models():
+        if issubclass(model, AbstractInstrumentDataProduct):
+            model.objects.filter(user_position=instance).update(**values)
+            model.objects.filter(track_position=instance, user_position=None).update(**values)
+
+
+@receiver(post_delete)
+def clearDeletedProductSampleCache(sender, instance, **kwargs):
+    if isinstance(instance, AbstractInstrumentDataProduct):
+        sampleCache.clearProductCache(instance)
+        if instance.similarityIndexed and settings.XGDS_INSTRUMENT_SIMILARITY_INDEX:
+            from xgds_instrument import similarityIndex
+            try:
+                similarityIndex.removeProduct(instance)
+            except Exception:
+                logger.exception('Could not remove %s %s from the similarity index',
+                                 instance.getProductModelName(), instance.pk)
+        DeletedInstrumentDataProduct.objects.create(product_model=instance.getProductModelName(),
+                                                    product_pk=instance.pk,
+                                                    deletion_time=datetime.datetime.now(pytz.utc))
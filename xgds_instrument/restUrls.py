@@ -20,4 +20,16 @@ from xgds_instrument import views
 
 urlpatterns = [
     url(r'^getInstrumentDataJson/(?P<productModel>[\w]+[\.]*[\w]*)/(?P<productPk>[\d]+)$', views.getInstrumentDataJson, name='instrument_data_json'),
+    url(r'^getTimeSeriesJson/(?P<productModel>[\w]+[\.]*[\w]*)/(?P<productPk>[\d]+)$', views.getTimeSeriesJson, name='instrument_time_series_json'),
+    url(r'^getTimeSeriesCsv/(?P<productModel>[\w]+[\.]*[\w]*)/(?P<productPk>[\d]+)$', views.getTimeSeriesCsv, name='instrument_time_series_csv'),
+    url(r'^getSimilarInstrumentData/(?P<productModel>[\w]+[\.]*[\w]*)/(?P<productPk>[\d]+)$', views.getSimilarInstrumentData, name='instrument_data_similar'),
+    url(r'^getInstrumentDataJsonBatch/(?P<productModel>[\w]+[\.]*[\w]*)$', views.getInstrumentDataJsonBatch, name='instrument_data_json_batch'),
+    url(r'^getInstrumentDataList/(?P<productModel>[\w]+[\.]*[\w]*)$', views.getInstrumentDataList, name='instrument_data_list'),
+    url(r'^getInstrumentDataClusters/(?P<productModel>[\w]+[\.]*[\w]*)$', views.getInstrumentDataClusters, name='instrument_data_clusters'),
+    url(r'^getInstrumentDataChanges/(?P<productModel>[\w]+[\.]*[\w]*)$', views.getInstrumentDataChanges, name='instrument_data_changes'),
+    url(r'^instrumentDataUpload$', views.createInstrumentDataUpload, name='instrument_data_upload_create'),
+    url(r'^instrumentDataUpload/(?P<uploadId>[0-9a-f]{32})$', views.instrumentDataUpload, name='instrument_data_upload'),
+    url(r'^instrumentDataImportStaged$', views.instrumentDataImportStaged, name='instrument_data_import_staged'),
+    url(r'^getInstrumentImporters.json$', views.getInstrumentImporters, name='instrument_importers'),
+    url(r'^getImportJobStatus/(?P<jobId>[\d]+)$', views.getImportJobStatus, name='instrument_import_job_status'),
 ]
@@ -0,0 +1,168 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Persistent on-disk cache of decoded instrument data samples.
+
+The first time the samples of a data product are needed they are parsed by the
+product's samples property and saved as a float64 .npy file under
+XGDS_INSTRUMENT_SAMPLE_CACHE_DIR.  Later reads memory map that file instead of
+fetching and parsing the portable data file again.
+
+Cache entries live in a directory keyed on the portable data file name, so
+replacing the portable data file invalidates everything cached for the product.
+
+numpy is imported when an array is first read or written, not with this module,
+because models imports it.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+
+
+def getCacheRoot():
+    root = settings.XGDS_INSTRUMENT_SAMPLE_CACHE_DIR
+    if not root:
+        root = os.path.join(getattr(settings, 'DATA_ROOT', tempfile.gettempdir()),
+                            settings.XGDS_INSTRUMENT_DATA_SUBDIRECTORY,
+                            'sampleCache')
+    return root
+
+
+def getProductCacheDir(dataProduct):
+    label = '%s.%s' % (dataProduct._meta.app_label, dataProduct._meta.model_name)
+    return os.path.join(getCacheRoot(), label, str(dataProduct.pk))
+
+
+def getFileCacheDir(dataProduct):
+    """ The cache directory for the current portable data file of the product """
+    fileName = dataProduct.portable_data_file.name if dataProduct.portable_data_file else ''
+    fileKey = hashlib.sha1(fileName.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(getProductCacheDir(dataProduct), fileKey)
+
+
+def loadArray(path):
+    import numpy as np
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # empty arrays cannot be memory mapped
+        return np.load(path)
+
+
+def storeArray(path, array):
+    """ Atomically write the array, removing entries cached for older portable data files """
+    fileDir = os.path.dirname(path)
+    productDir = os.path.dirname(fileDir)
+    if os.path.isdir(productDir):
+        for entry in os.listdir(productDir):
+            if entry != os.path.basename(fileDir):
+                shutil.rmtree(os.path.join(productDir, entry), ignore_errors=True)
+    try:
+        os.makedirs(fileDir)
+    except OSError:
+        if not os.path.isdir(fileDir):
+            raise
+    import numpy as np
+    fd, tempPath = tempfile.mkstemp(suffix='.npy', dir=fileDir)
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, array)
+    os.rename(tempPath, path)
+
+
+def getCachedArray(dataProduct, variant, computeArray):
+    """
+    Return the array cached for the product under the variant name, memory mapped read only.
+    On a miss computeArray() is called and its result stored; if it returns None nothing is cached.
+    """
+    if not settings.XGDS_INSTRUMENT_SAMPLE_CACHE or dataProduct.pk is None:
+        return computeArray()
+
+    path = os.path.join(getFileCacheDir(dataProduct), re.sub(r'[^\w.-]', '_', variant) + '.npy')
+    if os.path.exists(path):
+        try:
+            return loadArray(path)
+        except (IOError, ValueError):
+            pass  # unreadable or partially removed entry, rebuild it
+
+    array = computeArray()
+    if array is None:
+        return None
+    try:
+        storeArray(path, array)
+    except (IOError, OSError):
+        return array
+    return loadArray(path)
+
+
+def samplesToArray(sampleList):
+    """ Convert a list of sample rows to a float64 array, or None if they are not all numeric """
+    import numpy as np
+    try:
+        array = np.asarray(sampleList, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    return array
+
+
+def getSampleArray(dataProduct):
+    return getCachedArray(dataProduct, 'samples',
+                          lambda: samplesToArray(dataProduct.samples))
+
+
+def loadSamples(dataProduct):
+    """ The samples of the product as a list, read through the cache """
+    try:
+        return dataProduct.getSampleList()
+    finally:
+        # pool threads each open their own database connection if a product needs one
+        connection.close()
+
+
+def iterLoadedSamples(dataProducts, poolSize=None):
+    """
+    Yield (dataProduct, sampleList) for each product in order, fetching up to poolSize
+    products' samples concurrently.  Products are consumed in chunks of poolSize so only
+    that many sample lists are held in memory at once.
+    """
+    if poolSize is None:
+        poolSize = settings.XGDS_INSTRUMENT_READ_POOL_SIZE
+    poolSize = max(1, poolSize)
+    pool = ThreadPool(poolSize)
+    try:
+        chunk = []
+        for dataProduct in dataProducts:
+            chunk.append(dataProduct)
+            if len(chunk) == poolSize:
+                for result in zip(chunk, pool.map(loadSamples, chunk)):
+                    yield result
+                chunk = []
+        if chunk:
+            for result in zip(chunk, pool.map(loadSamples, chunk)):
+                yield result
+    finally:
+        pool.terminate()
+
+
+def clearProductCache(dataProduct):
+    shutil.rmtree(getProductCacheDir(dataProduct), ignore_errors=True)
@@ -0,0 +1,55 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Compact binary encoding of sample arrays, decoded by xgds_instrument.decodeSamples in instrumentView.js.
+
+  bytes 0-3   MAGIC
+  bytes 4-7   header length N, unsigned little endian
+  next N      json header {"dtype": "float32" or "float64", "shape": [rows, columns], "labels": [...]},
+              space padded so the data starts on an 8 byte boundary
+  the rest    the samples, row by row, as little endian floats
+"""
+
+import json
+import struct
+
+MAGIC = b'XSMP'
+CONTENT_TYPE = 'application/octet-stream'
+DTYPES = ('float32', 'float64')
+
+
+def encodeSamples(samples, labels=None, dtype='float64'):
+    import numpy as np
+    data = np.ascontiguousarray(samples, dtype=np.dtype(dtype).newbyteorder('<'))
+    header = json.dumps({'dtype': dtype,
+                         'shape': list(data.shape),
+                         'labels': list(labels) if labels else None}).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+    return MAGIC + struct.pack('<I', len(header)) + header + data.tobytes()
+
+
+def decodeSamples(content):
+    """ Returns (samples, labels) from bytes made by encodeSamples """
+    import numpy as np
+    if content[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not an encoded sample array')
+    headerLength = struct.unpack('<I', content[len(MAGIC):len(MAGIC) + 4])[0]
+    offset = len(MAGIC) + 4
+    header = json.loads(content[offset:offset + headerLength].decode('utf-8'))
+    samples = np.frombuffer(content, dtype=np.dtype(header['dtype']).newbyteorder('<'),
+                            offset=offset + headerLength)
+    return samples.reshape(header['shape']), header['labels']
@@ -0,0 +1,78 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Summary values derived from the samples of a data product, stored as InstrumentDataFeature
+rows when the product is saved so searches do not have to read sample files.
+
+Every product gets y_min, y_max, y_mean, x_min, x_max, sample_count and the x of its
+highest peaks.  Instruments can add band areas and values at given x in
+XGDS_INSTRUMENT_FEATURES, keyed by the instrument shortName:
+
+  XGDS_INSTRUMENT_FEATURES = {'asd': {'bands': {'band_2200': (2150, 2250)},
+                                      'points': {'r2200': 2200}}}
+"""
+
+import numpy as np
+from django.conf import settings
+
+PEAK_COUNT = 3
+
+
+def getPeakIndexes(y, count=PEAK_COUNT):
+    """ Indexes of the count highest local maxima of y, highest first """
+    if len(y) < 3:
+        return np.array([int(np.argmax(y))]) if len(y) else np.array([], dtype=int)
+    interior = np.flatnonzero((y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:])) + 1
+    if not len(interior):
+        return np.array([int(np.argmax(y))])
+    return interior[np.argsort(y[interior])[::-1][:count]]
+
+
+def computeFeatures(samples, bands=None, points=None):
+    """ A dict of feature name to value for a sample array with x in the first column and y in the second """
+    if samples is None or samples.ndim != 2 or samples.shape[1] < 2:
+        return {}
+    samples = samples[np.isfinite(samples[:, 0]) & np.isfinite(samples[:, 1])]
+    if not len(samples):
+        return {}
+    order = np.argsort(samples[:, 0], kind='mergesort')
+    x = samples[order, 0]
+    y = samples[order, 1]
+
+    features = {'y_min': y.min(),
+                'y_max': y.max(),
+                'y_mean': y.mean(),
+                'x_min': x[0],
+                'x_max': x[-1],
+                'sample_count': len(x)}
+    for rank, index in enumerate(getPeakIndexes(y)):
+        features['peak_%d_x' % (rank + 1)] = x[index]
+
+    for name, (low, high) in (bands or {}).items():
+        inBand = (x >= low) & (x <= high)
+        if np.count_nonzero(inBand) > 1:
+            bandX, bandY = x[inBand], y[inBand]
+            features[name] = np.sum(np.diff(bandX) * (bandY[1:] + bandY[:-1])) / 2.0
+    for name, position in (points or {}).items():
+        if x[0] <= position <= x[-1]:
+            features[name] = np.interp(position, x, y)
+    return dict((name, float(value)) for name, value in features.items())
+
+
+def getProductFeatures(dataProduct):
+    config = settings.XGDS_INSTRUMENT_FEATURES.get(dataProduct.getCachedInstrument().shortName, {})
+    return computeFeatures(dataProduct.sampleArray, config.get('bands'), config.get('points'))
@@ -0,0 +1,141 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Level of detail reduction of sample arrays for plotting.
+
+Sample arrays have one row per sample with x in the first column and y in the second.
+A plot a few hundred pixels wide cannot show more than a few points per pixel, so the
+samples are decimated in a way that keeps the shape of the curve: either the min and
+max y of each bucket of samples, or largest triangle three buckets (LTTB).
+"""
+
+import numpy as np
+
+from xgds_instrument import sampleCache
+
+METHODS = ('minmax', 'lttb')
+
+
+def getY(samples):
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] > 1:
+        return samples[:, 1]
+    return samples[:, 0]
+
+
+def selectRange(samples, xmin=None, xmax=None):
+    """ The samples with x between xmin and xmax, whichever way x is ordered """
+    if samples.ndim != 2 or (xmin is None and xmax is None):
+        return samples
+    x = samples[:, 0]
+    mask = np.ones(len(x), dtype=bool)
+    if xmin is not None:
+        mask &= x >= xmin
+    if xmax is not None:
+        mask &= x <= xmax
+    return samples[mask]
+
+
+def evenlySpaced(samples, maxPoints):
+    """ maxPoints samples spread evenly from the first to the last, for counts too small to bucket """
+    return samples[np.unique(np.linspace(0, len(samples) - 1, max(1, maxPoints)).astype(int))]
+
+
+def minMaxDecimate(samples, maxPoints):
+    """
+    Keep the first and last samples and the samples with the min and max y in each of
+    (maxPoints - 2) / 2 buckets, so at most maxPoints samples are returned.
+    """
+    count = len(samples)
+    if count <= maxPoints:
+        return samples
+    if maxPoints < 4:
+        return evenlySpaced(samples, maxPoints)
+    bucketSize = int(np.ceil(count / float((maxPoints - 2) // 2)))
+    bucketCount = int(np.ceil(count / float(bucketSize)))
+
+    padded = np.empty(bucketCount * bucketSize)
+    padded[:count] = getY(samples)
+    padded[count:] = np.inf
+    minIndexes = padded.reshape(bucketCount, bucketSize).argmin(axis=1)
+    padded[count:] = -np.inf
+    maxIndexes = padded.reshape(bucketCount, bucketSize).argmax(axis=1)
+
+    offsets = np.arange(bucketCount) * bucketSize
+    indexes = np.unique(np.concatenate((minIndexes + offsets, maxIndexes + offsets, [0, count - 1])))
+    return samples[indexes]
+
+
+def lttbDecimate(samples, maxPoints):
+    """ Largest triangle three buckets; each bucket is searched with vectorized numpy """
+    count = len(samples)
+    if count <= maxPoints:
+        return samples
+    if maxPoints < 3:
+        return evenlySpaced(samples, maxPoints)
+    y = getY(samples)
+    x = samples[:, 0] if samples.ndim == 2 and samples.shape[1] > 1 else np.arange(count, dtype=np.float64)
+
+    # the first and last samples are kept, the rest are split into maxPoints - 2 buckets
+    edges = np.linspace(1, count - 1, maxPoints - 1).astype(int)
+    indexes = np.empty(maxPoints, dtype=int)
+    indexes[0] = 0
+    indexes[-1] = count - 1
+    previous = 0
+    for bucket in range(maxPoints - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            nextStart, nextEnd = edges[bucket + 1], edges[bucket + 2]
+            nextX = x[nextStart:nextEnd].mean()
+            nextY = y[nextStart:nextEnd].mean()
+        else:
+            nextX, nextY = x[count - 1], y[count - 1]
+        areas = np.abs((x[previous] - nextX) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (nextY - y[previous]))
+        previous = start + int(areas.argmax()) if end > start else start
+        indexes[bucket + 1] = previous
+    return samples[np.unique(indexes)]
+
+
+def reduceSamples(samples, maxPoints=None, xmin=None, xmax=None, method='minmax'):
+    samples = selectRange(samples, xmin, xmax)
+    if not maxPoints:
+        return samples
+    if method == 'lttb':
+        return lttbDecimate(samples, maxPoints)
+    return minMaxDecimate(samples, maxPoints)
+
+
+def getReducedSamples(dataProduct, maxPoints=None, xmin=None, xmax=None, method='minmax', transform=None):
+    """
+    The decimated sample array for the product, or None if its samples are not numeric.
+    Reductions of the full x range are cached per product, method, resolution and
+    sampleTransforms transform; zoomed ranges are cut from the cached full resolution samples.
+    Transforms that are not cacheable are reduced without caching.
+    """
+    from xgds_instrument import sampleTransforms
+    samples = sampleTransforms.getTransformedSamples(dataProduct, transform)
+    if samples is None:
+        return None
+    if xmin is not None or xmax is not None or not maxPoints or (transform is not None and not transform.cacheable):
+        return reduceSamples(samples, maxPoints, xmin, xmax, method)
+    variant = 'lod_%s_%d' % (method, maxPoints)
+    if transform is not None:
+        variant += '_' + transform.key
+    return sampleCache.getCachedArray(dataProduct, variant,
+                                      lambda: reduceSamples(samples, maxPoints, method=method))
@@ -0,0 +1,205 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Vectorized transforms of sample arrays, so products from different instruments can be compared.
+
+A transform converts x and y to other units, starting from the ScienceInstrument xUnits
+and yUnits, optionally normalizes y, interpolates onto a target x grid and orders the rows.
+Transformed arrays are cached per product and transform with sampleCache, except those
+interpolated onto a grid: clients choose any grid, so those are computed on each request.
+
+Request parameters:
+  xUnits=um          convert x: nm, um, angstrom, m, cm-1 (wavenumber) or eV, keV
+  yUnits=percent     convert y: fraction or percent
+  normalize=max      scale y by its largest absolute value, or by its area
+  grid=400,2500,512  interpolate onto that many evenly spaced x from min to max, in the new x units
+  order=desc         sort rows by x ascending, descending, or as the instrument's reverseX says
+"""
+
+import numpy as np
+from django.conf import settings
+
+from xgds_instrument import sampleCache
+
+# every unit converts to and from the first unit of its group
+X_UNIT_GROUPS = (
+    {'nm': (lambda x: x, lambda x: x),
+     'um': (lambda x: x * 1e3, lambda x: x / 1e3),
+     'angstrom': (lambda x: x / 10.0, lambda x: x * 10.0),
+     'm': (lambda x: x * 1e9, lambda x: x / 1e9),
+     'cm-1': (lambda x: 1e7 / x, lambda x: 1e7 / x)},
+    {'ev': (lambda x: x, lambda x: x),
+     'kev': (lambda x: x * 1e3, lambda x: x / 1e3)},
+)
+Y_UNIT_SCALES = {'fraction': 1.0, 'percent': 100.0}
+UNIT_ALIASES = {u'\u00b5m': 'um', 'micron': 'um', 'microns': 'um', 'micrometers': 'um',
+                'nanometers': 'nm', u'\u00e5': 'angstrom', 'angstroms': 'angstrom',
+                'wavenumber': 'cm-1', 'wavenumbers': 'cm-1', '1/cm': 'cm-1', 'cm^-1': 'cm-1',
+                '%': 'percent', 'ratio': 'fraction', 'reflectance': 'fraction'}
+NORMALIZATIONS = ('max', 'area')
+ORDERS = ('asc', 'desc', 'instrument')
+
+
+def normalizeUnit(unit):
+    unit = (unit or '').strip().lower()
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def convertX(x, fromUnit, toUnit):
+    fromUnit, toUnit = normalizeUnit(fromUnit), normalizeUnit(toUnit)
+    if fromUnit == toUnit:
+        return x
+    for group in X_UNIT_GROUPS:
+        if fromUnit in group and toUnit in group:
+            with np.errstate(divide='ignore'):
+                return group[toUnit][1](group[fromUnit][0](x))
+    raise ValueError('Cannot convert x from %s to %s' % (fromUnit or 'unknown units', toUnit))
+
+
+def convertY(y, fromUnit, toUnit):
+    fromUnit, toUnit = normalizeUnit(fromUnit), normalizeUnit(toUnit)
+    if fromUnit == toUnit:
+        return y
+    if fromUnit not in Y_UNIT_SCALES or toUnit not in Y_UNIT_SCALES:
+        raise ValueError('Cannot convert y from %s to %s' % (fromUnit or 'unknown units', toUnit))
+    return y * (Y_UNIT_SCALES[toUnit] / Y_UNIT_SCALES[fromUnit])
+
+
+def relabel(label, fromUnit, toUnit):
+    """ The plot label with its units replaced, e.g. Wavelength (nm) to Wavelength (um) """
+    if fromUnit and fromUnit in label:
+        return label.replace(fromUnit, toUnit)
+    return '%s (%s)' % (label, toUnit)
+
+
+class SampleTransform(object):
+    def __init__(self, instrument, xUnits=None, yUnits=None, normalize=None, grid=None, order=None):
+        self.instrument = instrument
+        self.xUnits = xUnits
+        self.yUnits = yUnits
+        self.normalize = normalize
+        self.grid = grid
+        self.order = order
+
+    @classmethod
+    def fromParameters(cls, data, instrument):
+        """ The transform asked for by request parameters, or None; raises ValueError for bad values """
+        xUnits = normalizeUnit(data.get('xUnits')) or None
+        yUnits = normalizeUnit(data.get('yUnits')) or None
+        normalize = data.get('normalize') or None
+        if normalize is not None and normalize not in NORMALIZATIONS:
+            raise ValueError('normalize must be one of %s' % ', '.join(NORMALIZATIONS))
+        order = data.get('order') or None
+        if order is not None and order not in ORDERS:
+            raise ValueError('order must be one of %s' % ', '.join(ORDERS))
+        grid = data.get('grid') or None
+        if grid is not None:
+            try:
+                low, high, count = grid.split(',')
+                grid = (float(low), float(high), int(count))
+            except ValueError:
+                raise ValueError('grid must be min,max,count')
+            if not 2 <= grid[2] <= settings.XGDS_INSTRUMENT_MAX_PLOT_POINTS or grid[0] >= grid[1]:
+                raise ValueError('grid must go from min to a larger max with 2 to %d points' %
+                                 settings.XGDS_INSTRUMENT_MAX_PLOT_POINTS)
+        if not any((xUnits, yUnits, normalize, grid, order)):
+            return None
+        transform = cls(instrument, xUnits, yUnits, normalize, grid, order)
+        # fail on impossible unit conversions before anything is loaded
+        transform.convert(np.ones((1, 2)))
+        return transform
+
+    @property
+    def key(self):
+        """
+        Names the transform in the sample cache.  The cache is only keyed on the portable data
+        file, so the instrument's units and reverseX are part of the name.
+        """
+        grid = '%r:%r:%d' % self.grid if self.grid else ''
+        return 'transform_x=%s_y=%s_n=%s_g=%s_o=%s_from=%s_%s_r=%d' % (
+            self.xUnits or '', self.yUnits or '', self.normalize or '', grid, self.order or '',
+            normalizeUnit(self.instrument.xUnits), normalizeUnit(self.instrument.yUnits), self.instrument.reverseX)
+
+    @property
+    def cacheable(self):
+        """ Only a few transforms without a grid are possible, so only those are cached """
+        return self.grid is None
+
+    def getOrder(self):
+        if self.order == 'instrument':
+            return 'desc' if self.instrument.reverseX else 'asc'
+        if self.order is None and (self.grid or self.xUnits):
+            return 'asc'  # conversions such as nm to cm-1 reverse x, and grids are ascending
+        return self.order
+
+    def convert(self, samples):
+        samples = np.array(samples, dtype=np.float64)
+        if self.xUnits:
+            samples[:, 0] = convertX(samples[:, 0], self.instrument.xUnits, self.xUnits)
+        if self.yUnits:
+            samples[:, 1:] = convertY(samples[:, 1:], self.instrument.yUnits, self.yUnits)
+        return samples
+
+    def apply(self, samples):
+        """ The transformed copy of a sample array with x in the first column and y in the rest """
+        if samples is None or samples.ndim != 2 or samples.shape[1] < 2:
+            return None
+        samples = self.convert(samples)
+        samples = samples[np.all(np.isfinite(samples), axis=1)]
+        order = self.getOrder()
+        if order:
+            samples = samples[np.argsort(samples[:, 0], kind='mergesort')]
+
+        if self.normalize == 'max':
+            scale = np.abs(samples[:, 1:]).max(axis=0) if len(samples) else 1.0
+            samples[:, 1:] /= np.where(scale == 0, 1.0, scale)
+        elif self.normalize == 'area' and len(samples) > 1:
+            widths = np.diff(samples[:, 0])[:, np.newaxis]
+            area = np.abs(np.sum(widths * (samples[1:, 1:] + samples[:-1, 1:]), axis=0) / 2.0)
+            samples[:, 1:] /= np.where(area == 0, 1.0, area)
+
+        if self.grid and len(samples) > 1:
+            x = np.linspace(*self.grid)
+            # only the part of the grid the samples cover
+            x = x[(x >= samples[0, 0]) & (x <= samples[-1, 0])]
+            columns = [x] + [np.interp(x, samples[:, 0], samples[:, i]) for i in range(1, samples.shape[1])]
+            samples = np.column_stack(columns)
+
+        if order == 'desc':
+            samples = samples[::-1]
+        return np.ascontiguousarray(samples)
+
+    def getLabels(self, labels):
+        if not labels:
+            return labels
+        labels = list(labels)
+        if self.xUnits:
+            labels[0] = relabel(labels[0], self.instrument.xUnits, self.xUnits)
+        if self.yUnits or self.normalize:
+            yUnits = 'normalized' if self.normalize else self.yUnits
+            labels[1:] = [relabel(label, self.instrument.yUnits, yUnits) for label in labels[1:]]
+        return labels
+
+
+def getTransformedSamples(dataProduct, transform):
+    """ The product's samples with the transform applied, cached if it can be; None if they are not numeric """
+    if transform is None:
+        return dataProduct.sampleArray
+    if not transform.cacheable:
+        return transform.apply(dataProduct.sampleArray)
+    return sampleCache.getCachedArray(dataProduct, transform.key,
+                                      lambda: transform.apply(dataProduct.sampleArray))
@@ -0,0 +1,254 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Similarity search over the samples of instrument data products.
+
+Each instrument has an index directory under the sample cache holding:
+
+  meta.json     the common x grid and the product model labels
+  vectors.f32   one row per indexed product: y resampled onto the grid, unit length, float32
+  rows.f64      one row per vector: model index, product pk, acquisition time, valid flag
+
+Both files are append only, so indexing a new product costs one small write.  A product
+that is re-indexed or deleted gets a new row, and the latest row for a product wins.
+Queries memory map the files and rank every product with one matrix product; the
+spectral angle ranks the same as cosine similarity for unit vectors.
+rebuildSimilarityIndex rewrites the files without the superseded rows.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from xgds_instrument import sampleCache, timeSeriesBlocks
+
+METRICS = ('cosine', 'angle')
+ROW_COLUMNS = 4  # model index, pk, acquisition time, valid
+
+_lock = threading.Lock()
+
+
+def getIndexDir(instrument):
+    return os.path.join(sampleCache.getCacheRoot(), 'similarity', instrument.shortName)
+
+
+@contextmanager
+def lockedIndex(indexDir):
+    """ Hold the index of one instrument exclusively, across threads and processes """
+    with _lock:
+        if not os.path.isdir(indexDir):
+            os.makedirs(indexDir)
+        with open(os.path.join(indexDir, 'lock'), 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            yield
+
+
+def readMeta(indexDir):
+    try:
+        with open(os.path.join(indexDir, 'meta.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def writeMeta(indexDir, meta):
+    path = os.path.join(indexDir, 'meta.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.rename(path + '.tmp', path)
+
+
+def getGrid(meta):
+    return np.linspace(meta['grid'][0], meta['grid'][1], meta['grid'][2])
+
+
+def makeGrid(instrument, samples):
+    """ The configured grid for the instrument, or one spanning the samples of its first product """
+    configured = settings.XGDS_INSTRUMENT_SIMILARITY_GRIDS.get(instrument.shortName)
+    if configured:
+        return list(configured)
+    x = samples[:, 0]
+    return [float(np.nanmin(x)), float(np.nanmax(x)), settings.XGDS_INSTRUMENT_SIMILARITY_GRID_SIZE]
+
+
+def toVector(samples, grid):
+    """ y resampled onto the grid, zero outside the sampled x range, scaled to unit length; None if flat or empty """
+    if samples is None or samples.ndim != 2 or samples.shape[1] < 2:
+        return None
+    samples = samples[np.isfinite(samples[:, 0]) & np.isfinite(samples[:, 1])]
+    if len(samples) < 2:
+        return None
+    order = np.argsort(samples[:, 0], kind='mergesort')
+    vector = np.interp(grid, samples[order, 0], samples[order, 1], left=0.0, right=0.0)
+    norm = np.linalg.norm(vector)
+    if not norm:
+        return None
+    return (vector / norm).astype(np.float32)
+
+
+def getModelIndex(meta, dataProduct):
+    label = dataProduct.getProductModelName()
+    if label not in meta['models']:
+        meta['models'].append(label)
+    return meta['models'].index(label)
+
+
+def appendRow(indexDir, vector, row):
+    # the vector goes first, so a reader never sees a row without its vector
+    with open(os.path.join(indexDir, 'vectors.f32'), 'ab') as f:
+        f.write(vector.astype('<f4').tobytes())
+    with open(os.path.join(indexDir, 'rows.f64'), 'ab') as f:
+        f.write(np.asarray(row, dtype='<f8').tobytes())
+
+
+def getRow(meta, dataProduct, valid):
+    acquisitionTime = timeSeriesBlocks.toEpochSeconds(dataProduct.acquisition_time)
+    return [getModelIndex(meta, dataProduct), dataProduct.pk,
+            np.nan if acquisitionTime is None else acquisitionTime, 1.0 if valid else 0.0]
+
+
+def indexProduct(dataProduct, samples=None):
+    """ Add or replace the product in its instrument's index; returns False if its samples cannot be indexed """
+    if samples is None:
+        samples = dataProduct.sampleArray
+    if samples is None or samples.ndim != 2 or samples.shape[1] < 2 or not len(samples):
+        return False
+    indexDir = getIndexDir(dataProduct.instrument)
+    with lockedIndex(indexDir):
+        meta = readMeta(indexDir)
+        if meta is None:
+            meta = {'grid': makeGrid(dataProduct.instrument, samples), 'models': []}
+        vector = toVector(samples, getGrid(meta))
+        if vector is None:
+            return False
+        row = getRow(meta, dataProduct, True)
+        writeMeta(indexDir, meta)
+        appendRow(indexDir, vector, row)
+    return True
+
+
+def removeProduct(dataProduct):
+    indexDir = getIndexDir(dataProduct.instrument)
+    if readMeta(indexDir) is None:
+        return
+    with lockedIndex(indexDir):
+        meta = readMeta(indexDir)
+        row = getRow(meta, dataProduct, False)
+        writeMeta(indexDir, meta)
+        appendRow(indexDir, np.zeros(meta['grid'][2], dtype=np.float32), row)
+
+
+def loadIndex(indexDir):
+    """
+    (meta, vectors, current, rows) where current indexes the latest row of each product still
+    indexed, or None if there is no index
+    """
+    meta = readMeta(indexDir)
+    if meta is None:
+        return None
+    size = meta['grid'][2]
+    rowsPath = os.path.join(indexDir, 'rows.f64')
+    vectorsPath = os.path.join(indexDir, 'vectors.f32')
+    rows = np.fromfile(rowsPath, dtype='<f8')
+    count = min(len(rows) // ROW_COLUMNS, os.path.getsize(vectorsPath) // (4 * size))
+    if not count:
+        return meta, np.empty((0, size), dtype=np.float32), np.empty(0, dtype=int), np.empty((0, ROW_COLUMNS))
+    rows = rows[:count * ROW_COLUMNS].reshape(count, ROW_COLUMNS)
+    vectors = np.memmap(vectorsPath, dtype='<f4', mode='r', shape=(count, size))
+
+    # the last row of each product is the current one
+    keys = rows[:, 0] * 2 ** 40 + rows[:, 1]
+    _, lastFromEnd = np.unique(keys[::-1], return_index=True)
+    latest = np.sort(count - 1 - lastFromEnd)
+    current = latest[rows[latest, 3] > 0]
+    return meta, vectors, current, rows
+
+
+def findSimilar(dataProduct, k=10, metric='cosine', start=None, end=None):
+    """
+    The k products of the same instrument whose samples are most like the product's, as
+    (model label, pk, distance) sorted nearest first.  start and end limit the acquisition times.
+    Distance is 1 - cosine similarity, or the spectral angle in radians.
+    """
+    if metric not in METRICS:
+        raise ValueError('metric must be one of %s' % ', '.join(METRICS))
+    loaded = loadIndex(getIndexDir(dataProduct.instrument))
+    if loaded is None:
+        return []
+    meta, vectors, candidates, rows = loaded
+    query = toVector(dataProduct.sampleArray, getGrid(meta))
+    if query is None:
+        return []
+
+    label = dataProduct.getProductModelName()
+    ownModel = meta['models'].index(label) if label in meta['models'] else -1
+    mask = ~((rows[candidates, 0] == ownModel) & (rows[candidates, 1] == dataProduct.pk))
+    if start is not None:
+        mask &= rows[candidates, 2] >= timeSeriesBlocks.toEpochSeconds(start)
+    if end is not None:
+        mask &= rows[candidates, 2] <= timeSeriesBlocks.toEpochSeconds(end)
+    candidates = candidates[mask]
+    if not len(candidates):
+        return []
+
+    similarity = np.clip(vectors[candidates].dot(query), -1.0, 1.0)
+    k = min(k, len(candidates))
+    nearest = np.argpartition(-similarity, k - 1)[:k]
+    nearest = nearest[np.argsort(-similarity[nearest], kind='mergesort')]
+    if metric == 'angle':
+        distances = np.arccos(similarity[nearest])
+    else:
+        distances = 1.0 - similarity[nearest]
+    return [(meta['models'][int(rows[candidates[i], 0])], int(rows[candidates[i], 1]), float(distance))
+            for i, distance in zip(nearest, distances)]
+
+
+def rebuildIndex(instrument, dataProducts):
+    """ Write a fresh index for the instrument from the given products, then swap it in """
+    indexDir = getIndexDir(instrument)
+    newDir = indexDir + '.new'
+    shutil.rmtree(newDir, ignore_errors=True)
+    os.makedirs(newDir)
+    meta = None
+    count = 0
+    for dataProduct, samples in dataProducts:
+        if samples is None or samples.ndim != 2 or samples.shape[1] < 2 or not len(samples):
+            continue
+        if meta is None:
+            meta = {'grid': makeGrid(instrument, samples), 'models': []}
+        vector = toVector(samples, getGrid(meta))
+        if vector is not None:
+            appendRow(newDir, vector, getRow(meta, dataProduct, True))
+            count += 1
+    if meta is None:
+        shutil.rmtree(newDir, ignore_errors=True)
+        shutil.rmtree(indexDir, ignore_errors=True)
+        return 0
+    writeMeta(newDir, meta)
+    with lockedIndex(indexDir):
+        oldDir = indexDir + '.old'
+        shutil.rmtree(oldDir, ignore_errors=True)
+        os.rename(indexDir, oldDir)
+        os.rename(newDir, indexDir)
+        shutil.rmtree(oldDir, ignore_errors=True)
+    return count
@@ -34,6 +34,36 @@ $.extend(xgds_instrument,{
     		this.renderInstrumentPlot(dataProductJson, data);
     	}
     },
+	getMaxPoints: function(){
+		// a couple of points per pixel is all the plot can show
+		var width = $('#plotDiv').width();
+		return Math.max(200, Math.round(2 * (width ? width : 500)));
+	},
+	getDataUrl: function(dataProductJson, xmin, xmax){
+		var params = {maxPoints: this.getMaxPoints()};
+		if (xmin !== undefined && xmax !== undefined){
+			params.xmin = xmin;
+			params.xmax = xmax;
+		}
+		return dataProductJson.jsonDataUrl + '?' + $.param(params);
+	},
+	getDetail: function(dataProductJson){
+		// after zooming or panning, load the next level of detail for the visible x range
+		clearTimeout(this.detailTimer);
+		this.detailTimer = setTimeout($.proxy(function(){
+			if (this.plot == undefined) {
+				return;
+			}
+			var xaxis = this.plot.getAxes().xaxis;
+			this.loadSamples(this.getDataUrl(dataProductJson, xaxis.min, xaxis.max), $.proxy(function(data) {
+				if (this.plot == undefined || _.isEmpty(data)){
+					return;
+				}
+				this.plot.setData([{data: data, color: 'blue'}]);
+				this.plot.draw();
+			}, this));
+		}, this), 250);
+	},
 	getData: function(dataProductJson){
 		if (true) { //(this.current_data_type !== dataProductJson.instrument_name) {
             if (this.plot != undefined) {
@@ -42,21 +72,87 @@ $.extend(xgds_instrument,{
             }
         }
 		this.setMessage('Loading data...');
-		$.ajax({
-            url: dataProductJson.jsonDataUrl,
-            dataType: 'json',
-            success: $.proxy(function(data) {
+		this.loadSamples(this.getDataUrl(dataProductJson), $.proxy(function(data) {
                 if (_.isUndefined(data) || data.length === 0){
                     this.setMessage("None found.");
                 } else {
                 	this.clearMessage();
                     this.renderInstrumentData(dataProductJson, data);
                 }
-            }, this),
-            error: $.proxy(function(data){
+            }, this), $.proxy(function(){
                 this.setMessage("Search failed.");
-            }, this)
-          });
+            }, this));
+	},
+	decodeSamples: function(buffer){
+		// see sampleEncoding.py: magic, header length, json header, then little endian floats
+		var view = new DataView(buffer);
+		var headerLength = view.getUint32(4, true);
+		var header = JSON.parse(String.fromCharCode.apply(null, new Uint8Array(buffer, 8, headerLength)));
+		var rows = header.shape[0];
+		var columns = header.shape.length > 1 ? header.shape[1] : 1;
+		var offset = 8 + headerLength;
+		var values;
+		// typed arrays use the platform byte order, which is little endian on everything we run on
+		if (header.dtype === 'float32'){
+			values = new Float32Array(buffer, offset, rows * columns);
+		} else {
+			values = new Float64Array(buffer, offset, rows * columns);
+		}
+		var result = new Array(rows);
+		for (var i = 0; i < rows; i++){
+			if (columns == 1){
+				result[i] = values[i];
+			} else {
+				result[i] = Array.prototype.slice.call(values, i * columns, (i + 1) * columns);
+			}
+		}
+		return result;
+	},
+	loadSamples: function(url, success, error){
+		// fetch samples in the compact binary format, falling back to json if the server will not send it
+		var xhr = new XMLHttpRequest();
+		xhr.open('GET', url + (url.indexOf('?') < 0 ? '?' : '&') + 'format=binary&dtype=float32');
+		xhr.responseType = 'arraybuffer';
+		xhr.onload = function() {
+			if (xhr.status === 200) {
+				success(xgds_instrument.decodeSamples(xhr.response));
+			} else {
+				$.ajax({url: url, dataType: 'json', success: success, error: error});
+			}
+		};
+		xhr.onerror = error;
+		xhr.send();
+	},
+	findSimilar: function(dataProductJson){
+		// list the products whose samples look most like this one's
+		var url = dataProductJson.similarDataUrl ? dataProductJson.similarDataUrl :
+			dataProductJson.jsonDataUrl.replace('getInstrumentDataJson', 'getSimilarInstrumentData');
+		var list = $('#similar_instrument_data');
+		list.html('Searching...');
+		$.ajax({
+			url: url,
+			data: {k: 10},
+			dataType: 'json',
+			success: function(data){
+				list.empty();
+				if (_.isEmpty(data)){
+					list.html('None found.');
+					return;
+				}
+				_.each(data, function(match){
+					var label = match.instrument_name + ' ' + (match.name ? match.name : match.pk) + ' ' +
+						(match.acquisition_time ? getLocalTimeString(match.acquisition_time, match.acquisition_timezone) : '');
+					var item = $('<li/>').text(label + ' (' + match.distance.toFixed(3) + ')');
+					item.css('cursor', 'pointer').click(function(){
+						xgds_instrument.getData(match);
+					});
+					list.append(item);
+				});
+			},
+			error: function(){
+				list.html('Search failed.');
+			}
+		});
 	},
 	renderInstrumentPlot: function(dataProductJson, instrumentData){
 		//TODO right now because handlebars needs to rerender the entire template, it is destroying the plot each time
@@ -100,6 +196,14 @@ $.extend(xgds_instrument,{
                 });
 
 
+            $("#similar_instrument_button").off('click').on('click', function(){
+                xgds_instrument.findSimilar(dataProductJson);
+            });
+
+            $("#plotDiv").bind("plotzoom plotpan", function (event, plot) {
+                xgds_instrument.getDetail(dataProductJson);
+            });
+
             $("#plotDiv").bind("plothover", function (event, pos, item) {
                 if (item) {
                     var x = item.datapoint[0],
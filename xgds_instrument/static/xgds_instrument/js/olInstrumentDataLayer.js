@@ -0,0 +1,192 @@
+//__BEGIN_LICENSE__
+// Copyright (c) 2015, United States Government, as represented by the
+// Administrator of the National Aeronautics and Space Administration.
+// All rights reserved.
+//
+// The xGDS platform is licensed under the Apache License, Version 2.0
+// (the "License"); you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+// http://www.apache.org/licenses/LICENSE-2.0.
+//
+// Unless required by applicable law or agreed to in writing, software distributed
+// under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+// CONDITIONS OF ANY KIND, either express or implied. See the License for the
+// specific language governing permissions and limitations under the License.
+//__END_LICENSE__
+
+// Map layers of instrument data products, mixed into InstrumentDataProduct and Spectrometer,
+// so load this before their ol files.  Each needs initStyles and constructMapElement.
+// When the layer json gives a clustersUrl and the page has a map, the layer shows the
+// clusters or products in view, loaded from the server as the map moves.
+
+var InstrumentDataLayer = {
+        getMap: function() {
+            // the openlayers map of the map page, if there is one
+            if (typeof app !== 'undefined' && !_.isUndefined(app.map) && !_.isUndefined(app.map.map)) {
+                return app.map.map;
+            }
+            return null;
+        },
+        constructElements: function(dataJson){
+            if (_.isEmpty(dataJson)){
+                return null;
+            }
+            this.initStyles();
+            var map = this.getMap();
+            var vectorLayer;
+            if (dataJson[0].clustersUrl && map !== null) {
+                vectorLayer = this.constructClusterLayer(map, dataJson[0].clustersUrl, dataJson[0].type);
+            } else {
+                vectorLayer = this.constructProductLayer(dataJson);
+            }
+            this.startPolling(vectorLayer, dataJson);
+            return vectorLayer;
+        },
+        constructProductLayer: function(dataJson) {
+            // a layer with a feature for every product that has a position
+            var olFeatures = [];
+            for (var i = 0; i < dataJson.length; i++) {
+                if (dataJson[i].lat !== "") {
+                    olFeatures.push(this.constructMapElement(dataJson[i]));
+                }
+            }
+            return new ol.layer.Vector({
+                name: dataJson[0].type,
+                source: new ol.source.Vector({
+                    features: olFeatures
+                })
+            });
+        },
+        getClusterStyle: function(count) {
+            // one style per count, shared by every cluster with that many products
+            var key = 'cluster' + count;
+            if (!(key in this.styles)) {
+                this.styles[key] = new ol.style.Style({
+                    zIndex: 1,
+                    image: new ol.style.Circle({
+                        radius: Math.min(30, 8 + 4 * Math.log(count)),
+                        fill: new ol.style.Fill({color: 'rgba(255, 255, 0, 0.6)'}),
+                        stroke: this.styles['greenStroke']
+                    }),
+                    text: new ol.style.Text({
+                        text: count.toString(),
+                        font: this.styles['text'].font,
+                        fill: this.styles['text'].fill
+                    })
+                });
+            }
+            return this.styles[key];
+        },
+        constructClusterElement: function(clusterJson) {
+            var feature = new ol.Feature({
+                name: clusterJson.instrument_name,
+                count: clusterJson.count,
+                geometry: new ol.geom.Point(transform([clusterJson.lon, clusterJson.lat]))
+            });
+            feature.setStyle(this.getClusterStyle(clusterJson.count));
+            return feature;
+        },
+        loadClusters: function(vectorLayer, map, clustersUrl) {
+            // replace the layer's features with the clusters or products in the current view
+            this.initStyles();
+            var context = this;
+            var view = map.getView();
+            var extent = ol.proj.transformExtent(view.calculateExtent(map.getSize()),
+                                                 view.getProjection(), 'EPSG:4326');
+            // only the response to the latest request is shown, however they arrive
+            var request = (vectorLayer.get('clusterRequest') || 0) + 1;
+            vectorLayer.set('clusterRequest', request);
+            $.ajax({
+                url: clustersUrl,
+                data: {zoom: Math.round(view.getZoom()), bbox: extent.join(',')},
+                dataType: 'json',
+                success: function(data) {
+                    if (vectorLayer.get('clusterRequest') !== request) {
+                        return;
+                    }
+                    var features = _.map(data.clusters, context.constructClusterElement, context);
+                    for (var i = 0; i < data.products.length; i++) {
+                        if (data.products[i].lat !== "") {
+                            features.push(context.constructMapElement(data.products[i]));
+                        }
+                    }
+                    var source = vectorLayer.getSource();
+                    source.clear();
+                    source.addFeatures(features);
+                }
+            });
+        },
+        constructClusterLayer: function(map, clustersUrl, name) {
+            // a layer that reloads its clusters whenever the map view moves
+            var vectorLayer = new ol.layer.Vector({
+                name: name,
+                source: new ol.source.Vector()
+            });
+            vectorLayer.set('clustersUrl', clustersUrl);
+            vectorLayer.set('clusterMap', map);
+            var context = this;
+            map.on('moveend', function() {
+                context.loadClusters(vectorLayer, map, clustersUrl);
+            });
+            this.loadClusters(vectorLayer, map, clustersUrl);
+            return vectorLayer;
+        },
+        pollInterval: 30000, // milliseconds between change feed requests; 0 does not poll
+        updateElements: function(vectorLayer, changes) {
+            // apply a change feed response to a layer made by constructElements
+            this.initStyles();
+            var clustersUrl = vectorLayer.get('clustersUrl');
+            if (clustersUrl) {
+                // any change can move a cluster's count and centroid, so load the view again
+                if (!_.isEmpty(changes.created) || !_.isEmpty(changes.updated) || !_.isEmpty(changes.deleted)) {
+                    this.loadClusters(vectorLayer, vectorLayer.get('clusterMap'), clustersUrl);
+                }
+                return;
+            }
+            var source = vectorLayer.getSource();
+            var removed = changes.deleted.concat(_.pluck(changes.updated, 'pk'));
+            for (var i = 0; i < removed.length; i++) {
+                var feature = source.getFeatureById(removed[i]);
+                if (feature !== null) {
+                    source.removeFeature(feature);
+                }
+            }
+            var added = changes.created.concat(changes.updated);
+            for (var j = 0; j < added.length; j++) {
+                if (added[j].lat !== "" && source.getFeatureById(added[j].pk) === null) {
+                    source.addFeature(this.constructMapElement(added[j]));
+                }
+            }
+        },
+        startPolling: function(vectorLayer, dataJson) {
+            // poll for changes made after the newest product the layer was built from
+            var changesUrl = dataJson[0].changesUrl;
+            if (!changesUrl) {
+                return;
+            }
+            var times = _.compact(_.pluck(dataJson, 'modification_time'));
+            var cursor = _.isEmpty(times) ? null : _.max(times, function(time) { return Date.parse(time); });
+            this.pollChanges(vectorLayer, changesUrl, cursor);
+        },
+        pollChanges: function(vectorLayer, changesUrl, cursor) {
+            // keep the layer current by polling the change feed from cursor
+            if (!this.pollInterval) {
+                return;
+            }
+            var context = this;
+            setTimeout(function() {
+                $.ajax({
+                    url: changesUrl,
+                    data: cursor ? {since: cursor} : {},
+                    dataType: 'json',
+                    success: function(changes) {
+                        context.updateElements(vectorLayer, changes);
+                        context.pollChanges(vectorLayer, changesUrl, changes.cursor);
+                    },
+                    error: function() {
+                        context.pollChanges(vectorLayer, changesUrl, cursor);
+                    }
+                });
+            }, this.pollInterval);
+        }
+};
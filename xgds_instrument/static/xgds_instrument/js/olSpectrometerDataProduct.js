@@ -38,26 +38,6 @@ var Spectrometer = {
                 };
             }
         },
-        constructElements: function(dataJson){
-            if (_.isEmpty(dataJson)){
-                return null;
-            }
-            this.initStyles();
-            var olFeatures = [];
-            for (var i = 0; i < dataJson.length; i++) {
-                if (dataJson[i].lat !== "") {
-                    var dataFeature = this.constructMapElement(dataJson[i]);
-                    olFeatures = olFeatures.concat(dataFeature);
-                }
-            }
-            var vectorLayer = new ol.layer.Vector({
-                name: dataJson[0].type,
-                source: new ol.source.Vector({
-                    features: olFeatures
-                }),
-            });  
-            return vectorLayer;
-        },
         constructMapElement:function(dataJson){
             var coords = transform([dataJson.lon, dataJson.lat]);
             var feature = new ol.Feature({
@@ -68,6 +48,7 @@ var Spectrometer = {
                 type: dataJson.type,
                 geometry: new ol.geom.Point(coords)
             });
+            feature.setId(dataJson.pk);
             feature.setStyle(this.getStyles(dataJson));
             this.setupPopup(feature, dataJson);
             return feature;
@@ -118,4 +99,7 @@ var Spectrometer = {
             
             feature['popup'] = popupContents;
         }
-}
\ No newline at end of file
+}
+
+// constructElements, clustering and change feed updates, shared with the other instrument data layers
+_.defaults(Spectrometer, InstrumentDataLayer);
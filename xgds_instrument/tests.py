@@ -14,7 +14,117 @@
 # specific language governing permissions and limitations under the License.
 # __END_LICENSE__
 
-from django.test import TransactionTestCase
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import numpy as np
+import pytz
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils.dateparse import parse_datetime
+
+from geocamUtil.loader import LazyGetModelByName
+
+from xgds_instrument.forms import SearchInstrumentDataForm
+from xgds_instrument.models import (AbstractInstrumentDataProduct, AbstractTimeSeriesDataProduct,
+                                    InstrumentDataFeature, ScienceInstrument)
+
+
+def parseTestValue(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value.decode('utf-8')
+
+
+class TestInstrumentDataProduct(AbstractInstrumentDataProduct):
+    """ Concrete data product, only for tests; the portable data file has comma separated lines """
+    @property
+    def samples(self):
+        if not self.portable_data_file or not self.portable_data_file.storage.exists(self.portable_data_file.name):
+            return []
+        with self.openPortableData() as data:
+            return [[parseTestValue(value) for value in line.split(b',')] for line in data[:].splitlines() if line.strip()]
+
+    class Meta:
+        app_label = 'xgds_instrument'
+
+
+class TestTimeSeriesDataProduct(AbstractTimeSeriesDataProduct):
+    """ Concrete time series product, only for tests """
+    class Meta:
+        app_label = 'xgds_instrument'
+
+
+class TestSearchForm(SearchInstrumentDataForm):
+    class Meta:
+        model = TestInstrumentDataProduct
+        fields = []
+
+
+def createTestInstrument():
+    return ScienceInstrument.objects.create(shortName='test', displayName='Test', dataImportFunctionName='testImporter',
+                                            brand='brand', model='model', serialNum='1',
+                                            xLabel='x', yLabel='y', xUnits='nm', yUnits='counts',
+                                            reverseX=False, reverseY=False)
+
+
+def createTestProducts(count):
+    instrument = createTestInstrument()
+    collector = User.objects.create(username='collector', first_name='Col', last_name='Lector')
+    return [TestInstrumentDataProduct.objects.create(name='product %d' % i,
+                                                     portable_data_file='xgds_instrument/product%d.txt' % i,
+                                                     acquisition_time=datetime.datetime(2016, 1, 1, tzinfo=pytz.utc),
+                                                     acquisition_timezone='Etc/UTC',
+                                                     instrument=instrument,
+                                                     collector=collector)
+            for i in range(count)]
+
+
+def createPosition(latitude, longitude, altitude=0):
+    now = datetime.datetime.now(pytz.utc)
+    return LazyGetModelByName(settings.GEOCAM_TRACK_PAST_POSITION_MODEL).get().objects.create(
+        serverTimestamp=now, timestamp=now, latitude=latitude, longitude=longitude, altitude=altitude)
+
+
+def useLocalStorage(testCase):
+    """ Keep the files the test stores, stages or caches in a temporary directory removed after it """
+    from xgds_instrument import benchmarks
+    storage = benchmarks.localStorage()
+    root = storage.__enter__()
+    testCase.addCleanup(storage.__exit__, None, None, None)
+    return root
+
+
+def loadJson(response):
+    return json.loads(response.content.decode('utf-8'))
+
+
+@override_settings(XGDS_INSTRUMENT_DERIVED_DATA_ASYNC=False)
+class InstrumentDataTestCase(TransactionTestCase):
+    """
+    Stores data files in a temporary directory, and computes derived data on the test's own
+    connection as each save commits rather than on the import job pool
+    """
+    def setUp(self):
+        self.dataRoot = useLocalStorage(self)
 
 
 class xgds_instrumentTest(TransactionTestCase):
@@ -22,4 +132,770 @@ class xgds_instrumentTest(TransactionTestCase):
     Tests for xgds_instrument
     """
     def test_xgds_instrument(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class InstrumentDataProductQueryTest(InstrumentDataTestCase):
+    """
+    Listing products must not follow foreign keys one row at a time
+    """
+    def test_flat_dicts_single_query(self):
+        createTestProducts(10)
+        with self.assertNumQueries(1):
+            result = TestInstrumentDataProduct.objects.all().toFlatDicts()
+        self.assertEqual(len(result), 10)
+        self.assertEqual(result[0]['instrument_name'], 'Test')
+
+    def test_properties_single_query(self):
+        createTestProducts(10)
+        with self.assertNumQueries(1):
+            for dataProduct in TestInstrumentDataProduct.objects.withRelated():
+                dataProduct.instrument_name
+                dataProduct.collector_name
+                dataProduct.getPosition()
+
+
+class EffectivePositionTest(InstrumentDataTestCase):
+    """
+    Products keep a copy of the position they use, the user's over the track's, for indexed searches
+    """
+    def test_saved_with_position(self):
+        dataProduct = createTestProducts(1)[0]
+        self.assertIsNone(dataProduct.effective_latitude)
+        dataProduct.track_position = createPosition(19.5, -155.5, 10)
+        dataProduct.save()
+        dataProduct.refresh_from_db()
+        self.assertEqual((dataProduct.effective_latitude, dataProduct.effective_longitude,
+                          dataProduct.effective_altitude), (19.5, -155.5, 10))
+        dataProduct.user_position = createPosition(19.6, -155.6, 20)
+        dataProduct.save()
+        dataProduct.refresh_from_db()
+        self.assertEqual((dataProduct.effective_latitude, dataProduct.effective_longitude), (19.6, -155.6))
+
+    def test_position_edit_updates_products(self):
+        trackProduct, userProduct = createTestProducts(2)
+        position = createPosition(19.5, -155.5)
+        trackProduct.track_position = position
+        trackProduct.save()
+        userProduct.track_position = position
+        userProduct.user_position = createPosition(19.6, -155.6)
+        userProduct.save()
+        modified = TestInstrumentDataProduct.objects.get(pk=trackProduct.pk).modification_time
+
+        position.latitude, position.longitude = 19.7, -155.7
+        position.save()
+        trackProduct.refresh_from_db()
+        self.assertEqual((trackProduct.effective_latitude, trackProduct.effective_longitude), (19.7, -155.7))
+        self.assertGreater(trackProduct.modification_time, modified)
+        userProduct.refresh_from_db()
+        self.assertEqual((userProduct.effective_latitude, userProduct.effective_longitude), (19.6, -155.6))
+
+
+class SearchFormTest(InstrumentDataTestCase):
+    """
+    Products are found by bounding box, distance from a point, and feature values
+    """
+    def setUp(self):
+        super(SearchFormTest, self).setUp()
+        self.dataProducts = createTestProducts(3)
+        contentType = ContentType.objects.get_for_model(TestInstrumentDataProduct)
+        for dataProduct, latitude, value in zip(self.dataProducts, (19.5, 19.52, 20.5), (1, 5, 9)):
+            dataProduct.track_position = createPosition(latitude, -155.5)
+            dataProduct.save()
+            InstrumentDataFeature.objects.create(content_type=contentType, object_id=dataProduct.pk,
+                                                 name='y_max', value=value)
+
+    def search(self, data):
+        form = TestSearchForm(data, model=TestInstrumentDataProduct)
+        self.assertTrue(form.is_valid(), form.errors)
+        found = TestInstrumentDataProduct.objects.filter(form.getQuery()).distinct()
+        return sorted(self.dataProducts.index(dataProduct) for dataProduct in found)
+
+    def test_bounding_box(self):
+        self.assertEqual(self.search({'min_latitude': 19.4, 'max_latitude': 19.6,
+                                      'min_longitude': -156, 'max_longitude': -155}), [0, 1])
+        self.assertEqual(self.search({'min_latitude': 20}), [2])
+        self.assertEqual(self.search({'max_latitude': 20}), [0, 1])
+
+    def test_radius(self):
+        near = {'near_latitude': 19.5, 'near_longitude': -155.5}
+        self.assertEqual(self.search(dict(near, radius=1000)), [0])
+        self.assertEqual(self.search(dict(near, radius=5000)), [0, 1])
+
+    def test_feature_value(self):
+        self.assertEqual(self.search({'feature_name': 'y_max', 'min_feature_value': 2, 'max_feature_value': 8}), [1])
+        self.assertEqual(self.search({'feature_name': 'y_max', 'min_feature_value': 2}), [1, 2])
+        self.assertEqual(self.search({'feature_name': 'y_max', 'max_feature_value': 8}), [0, 1])
+        self.assertEqual(self.search({'feature_name': 'y_min'}), [])
+
+
+class DerivedDataTest(InstrumentDataTestCase):
+    """
+    Features are computed once the saving transaction commits, and again as time series grow
+    """
+    def test_features_after_commit(self):
+        with transaction.atomic():
+            dataProduct = createTestProducts(1)[0]
+            dataProduct.portable_data_file.save('spectrum.csv', ContentFile(b'400,1\n500,3\n600,2\n'))
+            self.assertEqual(dataProduct.getFeatureDict(), {})
+        features = dataProduct.getFeatureDict()
+        self.assertEqual((features['y_max'], features['x_min'], features['sample_count']), (3, 400, 3))
+
+    def test_time_series_features(self):
+        dataProduct = TestTimeSeriesDataProduct.objects.create(name='series', acquisition_timezone='Etc/UTC',
+                                                               instrument=createTestInstrument())
+        dataProduct.appendSamples(np.array([[0, 1], [60, 5], [120, 2]], dtype=float))
+        self.assertEqual(dataProduct.getFeatureDict()['y_max'], 5)
+        dataProduct.appendSamples(np.array([[180, 7]], dtype=float))
+        features = dataProduct.getFeatureDict()
+        self.assertEqual((features['y_max'], features['sample_count']), (7, 4))
+
+
+class SampleCacheTest(InstrumentDataTestCase):
+    """
+    Parsed samples are cached on disk per portable data file, in the temporary data directory
+    """
+    def setUp(self):
+        super(SampleCacheTest, self).setUp()
+        self.dataProduct = createTestProducts(1)[0]
+        self.dataProduct.portable_data_file.save('spectrum.csv', ContentFile(b'400,1\n500,2\n'))
+
+    def test_cache_hit(self):
+        from xgds_instrument import contentStorage, sampleCache
+        self.assertEqual(self.dataProduct.sampleArray.tolist(), [[400, 1], [500, 2]])
+        self.assertTrue(sampleCache.getFileCacheDir(self.dataProduct).startswith(self.dataRoot))
+        # the cached array is used rather than the file, which is only read again under a new name
+        dataFile = self.dataProduct.portable_data_file
+        with open(contentStorage.getLocalPath(dataFile.storage, dataFile.name), 'wb') as f:
+            f.write(b'400,9\n')
+        self.assertEqual(self.dataProduct.sampleArray.tolist(), [[400, 1], [500, 2]])
+
+    def test_new_portable_file(self):
+        from xgds_instrument import sampleCache
+        self.dataProduct.sampleArray
+        oldCacheDir = sampleCache.getFileCacheDir(self.dataProduct)
+        self.dataProduct.portable_data_file.save('spectrum.csv', ContentFile(b'400,3\n500,4\n600,5\n'))
+        self.assertEqual(self.dataProduct.sampleArray.tolist(), [[400, 3], [500, 4], [600, 5]])
+        self.assertNotEqual(sampleCache.getFileCacheDir(self.dataProduct), oldCacheDir)
+        self.assertFalse(os.path.exists(oldCacheDir))
+
+    def test_removed_on_delete(self):
+        from xgds_instrument import sampleCache
+        self.dataProduct.sampleArray
+        productCacheDir = sampleCache.getProductCacheDir(self.dataProduct)
+        self.assertTrue(os.path.isdir(productCacheDir))
+        self.dataProduct.delete()
+        self.assertFalse(os.path.exists(productCacheDir))
+
+
+class SampleFeaturesTest(TransactionTestCase):
+    """
+    Features are computed from samples in either x order
+    """
+    def test_compute_features(self):
+        from xgds_instrument.sampleFeatures import computeFeatures
+        x = np.linspace(2500, 400, 500)
+        y = np.exp(-((x - 2200) / 30.0) ** 2)
+        features = computeFeatures(np.column_stack([x, y]), bands={'band': (2100, 2300)}, points={'r2200': 2200})
+        self.assertAlmostEqual(features['peak_1_x'], 2200, delta=5)
+        self.assertAlmostEqual(features['band'], 30 * np.sqrt(np.pi), places=2)
+        self.assertEqual(features['sample_count'], 500)
+        self.assertEqual(computeFeatures(np.zeros((0, 2))), {})
+
+
+class ContentStorageTest(InstrumentDataTestCase):
+    """
+    Files are stored once under the sha256 of their content, and a product's digest finds its duplicates
+    """
+    content = b'400,0.1\n500,0.2\n'
+
+    def test_content_addressed_name(self):
+        from xgds_instrument import contentStorage
+        name = contentStorage.DataStorage().save('xgds_instrument/spectrum.CSV', ContentFile(self.content))
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(name, 'xgds_instrument/sha256/%s/%s.csv' % (digest[:2], digest))
+        self.assertEqual(contentStorage.getNameHash(name), digest)
+
+    def test_existing_blob_not_written(self):
+        from xgds_instrument import contentStorage
+        storage = contentStorage.DataStorage()
+        name = storage.save('xgds_instrument/first.csv', ContentFile(self.content))
+        path = contentStorage.getLocalPath(storage, name)
+        os.utime(path, (0, 0))
+        self.assertEqual(storage.save('xgds_instrument/second.csv', ContentFile(self.content)), name)
+        self.assertEqual(os.path.getmtime(path), 0)
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 1)
+
+    def test_duplicate_products(self):
+        from xgds_instrument.models import findDuplicateProducts
+        dataProduct, other = createTestProducts(2)
+        dataProduct.portable_data_file.save('spectrum.csv', ContentFile(self.content))
+        other.portable_data_file.save('other.csv', ContentFile(b'400,0.3\n'))
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(TestInstrumentDataProduct.objects.get(pk=dataProduct.pk).portable_file_sha256, digest)
+        self.assertEqual(findDuplicateProducts(dataProduct.instrument, digest), [dataProduct])
+        self.assertEqual(findDuplicateProducts(dataProduct.instrument, hashlib.sha256(b'').hexdigest()), [])
+
+
+class SampleReductionTest(TransactionTestCase):
+    """
+    Reduced samples stay within maxPoints and keep both ends of the x range shown
+    """
+    def setUp(self):
+        x = np.linspace(2500, 400, 10001)
+        self.samples = np.column_stack([x, np.sin(x / 50.0)])
+
+    def test_within_max_points(self):
+        from xgds_instrument.sampleReduction import reduceSamples
+        for method in ('minmax', 'lttb'):
+            for maxPoints in (1, 2, 3, 4, 5, 100, 1001):
+                reduced = reduceSamples(self.samples, maxPoints, method=method)
+                self.assertLessEqual(len(reduced), maxPoints, (method, maxPoints))
+                if maxPoints > 1:
+                    self.assertEqual((reduced[0, 0], reduced[-1, 0]), (2500, 400), (method, maxPoints))
+            self.assertEqual(len(reduceSamples(self.samples, 20000, method=method)), len(self.samples))
+
+    def test_x_range(self):
+        from xgds_instrument.sampleReduction import reduceSamples
+        inRange = self.samples[(self.samples[:, 0] >= 1000) & (self.samples[:, 0] <= 2000)]
+        for method in ('minmax', 'lttb'):
+            reduced = reduceSamples(self.samples, 100, xmin=1000, xmax=2000, method=method)
+            self.assertLessEqual(len(reduced), 100)
+            self.assertEqual((reduced[0, 0], reduced[-1, 0]), (inRange[0, 0], inRange[-1, 0]))
+            self.assertTrue(((reduced[:, 0] >= 1000) & (reduced[:, 0] <= 2000)).all())
+
+
+class SampleEncodingTest(InstrumentDataTestCase):
+    """
+    Samples can be sent as binary arrays, and products whose samples are not numeric refuse them with a 406
+    """
+    def setUp(self):
+        super(SampleEncodingTest, self).setUp()
+        self.client.force_login(User.objects.create_superuser('plotter', '', 'plotter'))
+        self.dataProduct = createTestProducts(1)[0]
+
+    def getSamples(self, content, **params):
+        self.dataProduct.portable_data_file.save('spectrum.csv', ContentFile(content))
+        return self.client.get(reverse('instrument_data_json',
+                                       kwargs={'productModel': TestInstrumentDataProduct.getProductModelName(),
+                                               'productPk': self.dataProduct.pk}),
+                               params.pop('data', {}), **params)
+
+    def test_round_trip(self):
+        from xgds_instrument import sampleEncoding
+        samples = np.column_stack([np.linspace(400, 2500, 101), np.random.RandomState(1).rand(101)])
+        for dtype in sampleEncoding.DTYPES:
+            content = sampleEncoding.encodeSamples(samples, ['x', 'y'], dtype)
+            headerLength = np.frombuffer(content[4:8], dtype='<u4')[0]
+            self.assertEqual((8 + headerLength) % 8, 0)
+            decoded, labels = sampleEncoding.decodeSamples(content)
+            self.assertEqual(labels, ['x', 'y'])
+            self.assertEqual(decoded.shape, samples.shape)
+            self.assertTrue(np.allclose(decoded, samples.astype(dtype)))
+        self.assertRaises(ValueError, sampleEncoding.decodeSamples, b'{"not": "samples"}')
+
+    def test_binary_response(self):
+        from xgds_instrument import sampleEncoding
+        for params in ({'data': {'format': 'binary'}}, {'HTTP_ACCEPT': sampleEncoding.CONTENT_TYPE}):
+            response = self.getSamples(b'400,1\n500,2\n', **params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], sampleEncoding.CONTENT_TYPE)
+            self.assertEqual(sampleEncoding.decodeSamples(response.content)[0].tolist(), [[400, 1], [500, 2]])
+        response = self.getSamples(b'400,1\n', data={'format': 'binary', 'dtype': 'int8'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_numeric(self):
+        response = self.getSamples(b'red,1\ngreen,2\n', data={'format': 'binary'})
+        self.assertEqual(response.status_code, 406)
+        # the client falls back to json, which gives the samples as they are
+        response = self.getSamples(b'red,1\ngreen,2\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(loadJson(response), [['red', 1], ['green', 2]])
+
+
+class InstrumentDataEtagTest(InstrumentDataTestCase):
+    """
+    Repeated requests for unchanged samples get a 304, and anything that changes the output changes the etag
+    """
+    def setUp(self):
+        super(InstrumentDataEtagTest, self).setUp()
+        self.client.force_login(User.objects.create_superuser('plotter', '', 'plotter'))
+        self.dataProduct = createTestProducts(1)[0]
+        self.dataProduct.portable_data_file.save('spectrum.csv', ContentFile(b'400,1\n500,2\n'))
+
+    def getEtag(self, dataProduct=None, **headers):
+        dataProduct = dataProduct or self.dataProduct
+        response = self.client.get(reverse('instrument_data_json',
+                                           kwargs={'productModel': dataProduct.getProductModelName(),
+                                                   'productPk': dataProduct.pk}), **headers)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        etag = self.getEtag()
+        response = self.client.get(reverse('instrument_data_json',
+                                           kwargs={'productModel': self.dataProduct.getProductModelName(),
+                                                   'productPk': self.dataProduct.pk}),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_changes(self):
+        etags = [self.getEtag()]
+        self.dataProduct.portable_data_file.save('spectrum.csv', ContentFile(b'400,3\n500,4\n'))
+        etags.append(self.getEtag())
+        instrument = self.dataProduct.instrument
+        instrument.xUnits = 'um'
+        instrument.save()
+        etags.append(self.getEtag())
+        etags.append(self.getEtag(HTTP_ACCEPT='application/octet-stream'))
+        self.assertEqual(len(set(etags)), len(etags))
+
+    def test_time_series(self):
+        dataProduct = TestTimeSeriesDataProduct.objects.create(name='series', acquisition_timezone='Etc/UTC',
+                                                               instrument=self.dataProduct.instrument)
+        dataProduct.appendSamples(np.array([[0, 1], [60, 2]], dtype=float))
+        etag = self.getEtag(dataProduct)
+        self.assertEqual(self.getEtag(dataProduct), etag)
+        dataProduct.appendSamples(np.array([[120, 3]], dtype=float))
+        self.assertNotEqual(self.getEtag(dataProduct), etag)
+
+
+@override_settings(XGDS_INSTRUMENT_TIME_SERIES_BLOCK_SIZE=4)
+class TimeSeriesTest(InstrumentDataTestCase):
+    """
+    Time series samples are stored in blocks of rows, and time ranges are read across block boundaries
+    """
+    def setUp(self):
+        super(TimeSeriesTest, self).setUp()
+        self.dataProduct = TestTimeSeriesDataProduct.objects.create(name='series', acquisition_timezone='Etc/UTC',
+                                                                    instrument=createTestInstrument())
+        # a sample a minute, the value counting up from 0
+        self.samples = np.column_stack([np.arange(10) * 60.0, np.arange(10.0)])
+
+    def getTimes(self, start=None, end=None):
+        from xgds_instrument.timeSeriesBlocks import toDatetime
+        samples = self.dataProduct.samples_between(None if start is None else toDatetime(start),
+                                                   None if end is None else toDatetime(end))
+        return samples[:, 0].tolist()
+
+    def test_samples_between(self):
+        self.dataProduct.appendSamples(self.samples[::-1])
+        self.assertEqual(self.dataProduct.blocks.count(), 3)
+        self.assertEqual(self.dataProduct.samples_between().tolist(), self.samples.tolist())
+        self.assertEqual(self.getTimes(180, 300), [180, 240, 300])
+        self.assertEqual(self.getTimes(170, 490), [180, 240, 300, 360, 420, 480])
+        self.assertEqual(self.getTimes(end=60), [0, 60])
+        self.assertEqual(self.getTimes(500), [540])
+        self.assertEqual(self.getTimes(1000), [])
+
+    def test_append_samples(self):
+        from xgds_instrument.timeSeriesBlocks import toDatetime
+        self.dataProduct.appendSamples(self.samples[:5])
+        self.dataProduct.appendSamples(self.samples[5:])
+        self.dataProduct.appendSamples(np.array([[-60.0, 7.0]]))
+        self.dataProduct.refresh_from_db()
+        self.assertEqual(self.dataProduct.blocks.count(), 5)
+        self.assertEqual((self.dataProduct.acquisition_time, self.dataProduct.end_time, self.dataProduct.sample_count),
+                         (toDatetime(-60), toDatetime(540), 11))
+        self.assertEqual(self.getTimes(240, 360), [240, 300, 360])
+        self.assertEqual(self.getTimes(end=0), [-60, 0])
+        self.assertEqual(len(self.dataProduct.samples), 11)
+
+
+class SimilarityTest(InstrumentDataTestCase):
+    """
+    Similar products are listed nearest first, and deleted products drop out of the index
+    """
+    def setUp(self):
+        super(SimilarityTest, self).setUp()
+        self.client.force_login(User.objects.create_superuser('searcher', '', 'searcher'))
+        # one peak per product, further from the first product's peak down the list
+        self.dataProducts = createTestProducts(4)
+        x = np.linspace(400, 900, 251)
+        for dataProduct, peak in zip(self.dataProducts, (500, 520, 600, 800)):
+            y = np.exp(-((x - peak) / 50.0) ** 2)
+            content = ''.join('%f,%f\n' % (xValue, yValue) for xValue, yValue in zip(x, y))
+            dataProduct.portable_data_file.save('peak%d.csv' % peak, ContentFile(content.encode('ascii')))
+
+    def getSimilar(self, **params):
+        response = self.client.get(reverse('instrument_data_similar',
+                                           kwargs={'productModel': TestInstrumentDataProduct.getProductModelName(),
+                                                   'productPk': self.dataProducts[0].pk}), params)
+        self.assertEqual(response.status_code, 200)
+        return loadJson(response)
+
+    def test_order(self):
+        results = self.getSimilar()
+        self.assertEqual([result['pk'] for result in results], [dataProduct.pk for dataProduct in self.dataProducts[1:]])
+        distances = [result['distance'] for result in results]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual([result['pk'] for result in self.getSimilar(k=2, metric='angle')],
+                         [dataProduct.pk for dataProduct in self.dataProducts[1:3]])
+
+    def test_removed_on_delete(self):
+        from xgds_instrument import similarityIndex
+        deletedPk = self.dataProducts[1].pk
+        self.dataProducts[1].delete()
+        matches = similarityIndex.findSimilar(self.dataProducts[0])
+        self.assertEqual([pk for label, pk, distance in matches],
+                         [dataProduct.pk for dataProduct in self.dataProducts[2:]])
+        self.assertNotIn(deletedPk, [result['pk'] for result in self.getSimilar()])
+
+
+class SampleTransformTest(SimpleTestCase):
+    """
+    Samples are converted between units, normalized, put on a grid and ordered as requested
+    """
+    def setUp(self):
+        self.instrument = ScienceInstrument(shortName='test', xUnits='nm', yUnits='fraction', reverseX=True)
+        self.samples = np.array([[500.0, 0.5], [1000.0, 0.25], [2000.0, 0.125]])
+
+    def transform(self, samples=None, **parameters):
+        from xgds_instrument.sampleTransforms import SampleTransform
+        transform = SampleTransform.fromParameters(parameters, self.instrument)
+        return transform.apply(self.samples if samples is None else samples).tolist()
+
+    def test_units(self):
+        self.assertEqual(self.transform(xUnits='um'), [[0.5, 0.5], [1.0, 0.25], [2.0, 0.125]])
+        self.assertEqual(self.transform(xUnits='cm-1'), [[5000, 0.125], [10000, 0.25], [20000, 0.5]])
+        self.assertEqual(self.transform(yUnits='%', order='asc'), [[500, 50], [1000, 25], [2000, 12.5]])
+        from xgds_instrument.sampleTransforms import SampleTransform
+        self.assertRaises(ValueError, SampleTransform.fromParameters, {'xUnits': 'keV'}, self.instrument)
+        self.assertRaises(ValueError, SampleTransform.fromParameters, {'yUnits': 'counts'}, self.instrument)
+        self.assertIsNone(SampleTransform.fromParameters({}, self.instrument))
+
+    def test_normalize(self):
+        self.assertEqual(self.transform(normalize='max', order='asc'), [[500, 1], [1000, 0.5], [2000, 0.25]])
+        self.assertEqual(self.transform(np.array([[0.0, 1.0], [2.0, 1.0]]), normalize='area', order='asc'),
+                         [[0, 0.5], [2, 0.5]])
+        from xgds_instrument.sampleTransforms import SampleTransform
+        self.assertRaises(ValueError, SampleTransform.fromParameters, {'normalize': 'sum'}, self.instrument)
+
+    def test_grid(self):
+        samples = np.column_stack([np.arange(11.0), np.arange(11.0) * 2])
+        # only the part of the grid the samples cover
+        self.assertEqual(self.transform(samples, grid='0,20,5'), [[0, 0], [5, 10], [10, 20]])
+        self.assertEqual(self.transform(samples, grid='2.5,7.5,3'), [[2.5, 5], [5, 10], [7.5, 15]])
+        from xgds_instrument.sampleTransforms import SampleTransform
+        self.assertRaises(ValueError, SampleTransform.fromParameters, {'grid': '10,0,5'}, self.instrument)
+
+    def test_order(self):
+        shuffled = self.samples[[1, 2, 0]]
+        self.assertEqual(self.transform(shuffled, order='asc'), self.samples.tolist())
+        self.assertEqual(self.transform(shuffled, order='desc'), self.samples[::-1].tolist())
+        self.assertEqual(self.transform(shuffled, order='instrument'), self.samples[::-1].tolist())
+        self.instrument.reverseX = False
+        self.assertEqual(self.transform(shuffled, order='instrument'), self.samples.tolist())
+
+
+class StandInCouchHandler(BaseHTTPRequestHandler):
+    """ Serves the attachments of StandInCouchServer.files, keeping connections alive """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.add(self.client_address)
+
+    def do_GET(self):
+        name = self.path.split('/')[2]
+        data = self.server.files.get(name)
+        self.send_response(200 if data is not None else 404)
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+        self.wfile.write(data or b'')
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInCouchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@override_settings(XGDS_INSTRUMENT_COUCHDB_POOL_SIZE=2)
+class CouchClientTest(TransactionTestCase):
+    """
+    Attachments are fetched concurrently over a small pool of reused connections
+    """
+    def setUp(self):
+        self.server = StandInCouchServer(('127.0.0.1', 0), StandInCouchHandler)
+        self.server.files = dict(('file%d' % i, ('data%d' % i).encode('ascii')) for i in range(20))
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_attachments(self):
+        from xgds_instrument.couchClient import CouchAttachmentClient
+        client = CouchAttachmentClient('http://127.0.0.1:%d' % self.server.server_port, 'files')
+        names = sorted(self.server.files) + ['missing']
+        results = list(client.fetchAttachments(names, poolSize=4))
+        self.assertEqual([name for name, data in results], names)
+        for name, data in results[:-1]:
+            self.assertEqual(data, self.server.files[name])
+        self.assertIsInstance(results[-1][1], IOError)
+        self.assertLessEqual(len(self.server.connections), 2)
+
+
+class MapLayerTest(InstrumentDataTestCase):
+    """
+    Map layers get what they need to follow the change feed, which reports what was created,
+    edited or deleted since a cursor that overlaps the previous request a little
+    """
+    def setUp(self):
+        super(MapLayerTest, self).setUp()
+        self.client.force_login(User.objects.create_superuser('mapper', '', 'mapper'))
+        self.url = reverse('instrument_data_changes', kwargs={'productModel': TestInstrumentDataProduct.getProductModelName()})
+
+    def getChanges(self, since=None):
+        response = self.client.get(self.url, {'since': since.isoformat()} if since else {})
+        self.assertEqual(response.status_code, 200)
+        changes = loadJson(response)
+        for kind in ('created', 'updated'):
+            changes[kind] = [flatDict['pk'] for flatDict in changes[kind]]
+        return changes
+
+    def test_map_dict(self):
+        dataProduct = createTestProducts(1)[0]
+        mapDict = dataProduct.toMapDict()
+        self.assertEqual(mapDict['changesUrl'], self.url)
+        self.assertEqual(parse_datetime(mapDict['modification_time']), dataProduct.modification_time)
+
+    def test_changes(self):
+        unchanged, edited, deleted = createTestProducts(3)
+        hourAgo = datetime.datetime.now(pytz.utc) - datetime.timedelta(hours=1)
+        TestInstrumentDataProduct.objects.update(creation_time=hourAgo, modification_time=hourAgo)
+        self.assertEqual(self.getChanges()['created'], [unchanged.pk, edited.pk, deleted.pk])
+
+        edited.description = 'edited'
+        edited.save()
+        created = TestInstrumentDataProduct.objects.create(name='new', acquisition_timezone='Etc/UTC',
+                                                           instrument=unchanged.instrument)
+        deletedPk = deleted.pk
+        deleted.delete()
+        changes = self.getChanges(hourAgo + datetime.timedelta(minutes=30))
+        self.assertEqual(changes['created'], [created.pk])
+        self.assertEqual(changes['updated'], [edited.pk])
+        self.assertEqual(changes['deleted'], [deletedPk])
+
+    @override_settings(XGDS_INSTRUMENT_CHANGES_OVERLAP_SECONDS=60)
+    def test_overlapping_cursor(self):
+        before = datetime.datetime.now(pytz.utc)
+        changes = self.getChanges()
+        cursor = parse_datetime(changes['cursor'])
+        self.assertLessEqual(cursor, before - datetime.timedelta(seconds=60) + datetime.timedelta(seconds=5))
+        self.assertGreaterEqual(cursor, before - datetime.timedelta(seconds=60))
+        # a product saved while the previous request ran is reported again rather than missed
+        dataProduct = createTestProducts(1)[0]
+        self.assertEqual(self.getChanges(cursor)['created'], [dataProduct.pk])
+        self.assertEqual(self.getChanges(cursor)['created'], [dataProduct.pk])
+
+
+class ClustersTest(InstrumentDataTestCase):
+    """
+    Zoomed out, products in view are counted per grid cell; zoomed in they are listed one by one
+    """
+    def setUp(self):
+        super(ClustersTest, self).setUp()
+        self.client.force_login(User.objects.create_superuser('mapper', '', 'mapper'))
+        self.dataProducts = createTestProducts(3)
+        for dataProduct, (latitude, longitude) in zip(self.dataProducts,
+                                                      ((19.5, -155.5), (19.5002, -155.5002), (20.5, -155.5))):
+            dataProduct.track_position = createPosition(latitude, longitude)
+            dataProduct.save()
+
+    def getClusters(self, zoom, bbox='-156,19,-155,21'):
+        response = self.client.get(reverse('instrument_data_clusters',
+                                           kwargs={'productModel': TestInstrumentDataProduct.getProductModelName()}),
+                                   {'zoom': zoom, 'bbox': bbox})
+        self.assertEqual(response.status_code, 200)
+        return loadJson(response)
+
+    def test_clusters(self):
+        # at zoom 5 the 64 pixel cells are 2.8125 degrees, splitting at latitude 19.6875
+        result = self.getClusters(5)
+        self.assertEqual(result['products'], [])
+        clusters = sorted(result['clusters'], key=lambda cluster: cluster['lat'])
+        self.assertEqual([(cluster['instrument'], cluster['count']) for cluster in clusters], [('test', 2), ('test', 1)])
+        self.assertAlmostEqual(clusters[0]['lat'], 19.5001)
+        self.assertAlmostEqual(clusters[0]['lon'], -155.5001)
+        self.assertAlmostEqual(clusters[1]['lat'], 20.5)
+        result = self.getClusters(settings.XGDS_INSTRUMENT_CLUSTER_MAX_ZOOM - 1, bbox='-156,19,-155,20')
+        self.assertEqual([cluster['count'] for cluster in result['clusters']], [2])
+
+    def test_products_when_zoomed_in(self):
+        result = self.getClusters(settings.XGDS_INSTRUMENT_CLUSTER_MAX_ZOOM)
+        self.assertEqual(result['clusters'], [])
+        self.assertEqual([product['pk'] for product in result['products']],
+                         [dataProduct.pk for dataProduct in self.dataProducts])
+        result = self.getClusters(settings.XGDS_INSTRUMENT_CLUSTER_MAX_ZOOM, bbox='-156,20,-155,21')
+        self.assertEqual([product['pk'] for product in result['products']], [self.dataProducts[2].pk])
+
+    def test_map_dict(self):
+        self.assertEqual(self.dataProducts[0].toMapDict()['clustersUrl'],
+                         reverse('instrument_data_clusters',
+                                 kwargs={'productModel': TestInstrumentDataProduct.getProductModelName()}))
+
+
+class ChunkedUploadTest(TransactionTestCase):
+    """
+    Chunks must arrive in order, an interrupted upload resumes from the offset received,
+    the file must match its sha256, and abandoned uploads expire.
+    """
+    data = b'0123456789' * 100
+
+    def setUp(self):
+        useLocalStorage(self)
+        self.client.force_login(User.objects.create_superuser('uploader', '', 'uploader'))
+
+    def createUpload(self, sha256=None):
+        response = self.client.post(reverse('instrument_data_upload_create'),
+                                    {'filename': 'spectrum.csv', 'size': len(self.data),
+                                     'sha256': sha256 or hashlib.sha256(self.data).hexdigest()})
+        self.assertEqual(response.status_code, 201)
+        return loadJson(response)
+
+    def putChunk(self, url, offset, chunk):
+        return self.client.put(url, chunk, content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET=str(offset))
+
+    def test_out_of_order_chunk(self):
+        url = self.createUpload()['uploadUrl']
+        self.assertEqual(self.putChunk(url, 0, self.data[:300]).status_code, 200)
+        response = self.putChunk(url, 600, self.data[600:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(loadJson(response)['offset'], 300)
+
+    def test_resume(self):
+        url = self.createUpload()['uploadUrl']
+        self.putChunk(url, 0, self.data[:400])
+        status = loadJson(self.client.get(url))
+        self.assertEqual((status['offset'], status['complete']), (400, False))
+        status = loadJson(self.putChunk(url, status['offset'], self.data[status['offset']:]))
+        self.assertEqual(status['offset'], len(self.data))
+        self.assertTrue(status['complete'])
+        self.assertTrue(status['verified'])
+
+    def test_sha256_mismatch(self):
+        upload = self.createUpload(sha256=hashlib.sha256(b'other').hexdigest())
+        response = self.putChunk(upload['uploadUrl'], 0, self.data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sha256', loadJson(response)['errors'])
+        self.assertEqual(self.client.get(upload['uploadUrl']).status_code, 404)
+
+    def test_expiry(self):
+        from xgds_instrument import chunkedUpload
+        stale = self.createUpload()
+        self.putChunk(stale['uploadUrl'], 0, self.data[:100])
+        fresh = self.createUpload()
+        staleDir = chunkedUpload.getUploadDir(stale['uploadId'])
+        longAgo = time.time() - 2 * 3600
+        for name in os.listdir(staleDir):
+            os.utime(os.path.join(staleDir, name), (longAgo, longAgo))
+        os.utime(staleDir, None)  # the directory was just touched, its files were not
+        with self.settings(XGDS_INSTRUMENT_UPLOAD_EXPIRY_HOURS=1):
+            chunkedUpload.removeExpiredUploads()
+        self.assertFalse(os.path.exists(staleDir))
+        self.assertTrue(os.path.exists(chunkedUpload.getUploadDir(fresh['uploadId'])))
+
+
+# Seconds that importing the forms, views and urls may take once django is set up, on any python,
+# and microseconds that importing this app's modules may take as reported by python -X importtime.
+IMPORT_TIME_BUDGET_SECONDS = 0.25
+IMPORT_TIME_BUDGET_US = 250000
+HAS_IMPORT_TIME = sys.version_info >= (3, 7)
+
+# These import numpy when they are imported, so they are only loaded when samples are processed
+NUMPY_MODULES = ('xgds_instrument.sampleFeatures', 'xgds_instrument.sampleReduction',
+                 'xgds_instrument.sampleTransforms', 'xgds_instrument.similarityIndex',
+                 'xgds_instrument.timeSeriesBlocks')
+
+IMPORT_CHECK = """
+import sys
+import time
+import django
+django.setup()
+start = time.time()
+import xgds_instrument.models, xgds_instrument.forms, xgds_instrument.views
+import xgds_instrument.urls, xgds_instrument.restUrls
+print(time.time() - start)
+print(' '.join(name for name in sys.modules if sys.modules[name] is not None))
+"""
+
+
+def parseImportTime(stderr):
+    """ (name, depth, cumulative microseconds) for each line of -X importtime output, in the order printed """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # the column headings
+        imports.append((name.strip(), (len(name) - len(name.lstrip()) - 1) // 2, cumulative))
+    return imports
+
+
+def getImporters(imports, index):
+    """ The names of the modules whose import led to the import at index; they are printed after it, less indented """
+    importers = []
+    depth = imports[index][1]
+    for name, importerDepth, cumulative in imports[index + 1:]:
+        if importerDepth < depth:
+            importers.append(name)
+            depth = importerDepth
+    return importers
+
+
+class ImportTimeTest(SimpleTestCase):
+    """
+    Loading the urls, views, forms and models is quick, and does not load numpy, pandas, requests or the
+    modules using them.  Other installed apps may load numpy or requests themselves, so those are only
+    checked where -X importtime can tell which module imported them.
+    """
+    def test_import_time(self):
+        command = [sys.executable] + (['-X', 'importtime'] if HAS_IMPORT_TIME else []) + ['-c', IMPORT_CHECK]
+        process = subprocess.Popen(command, env=os.environ.copy(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        seconds, modules = stdout.decode('utf-8').split('\n', 1)
+        self.assertLess(float(seconds), IMPORT_TIME_BUDGET_SECONDS)
+        modules = set(modules.split())
+        for name in NUMPY_MODULES + ('xgds_instrument.couchClient', 'pandas'):
+            self.assertNotIn(name, modules)
+        if not HAS_IMPORT_TIME:
+            return
+
+        imports = parseImportTime(stderr.decode('utf-8'))
+        ownTime = 0
+        for index, (name, depth, cumulative) in enumerate(imports):
+            importers = [importer for importer in getImporters(imports, index) if importer.startswith('xgds_instrument')]
+            if name in ('numpy', 'requests'):
+                self.assertEqual(importers, [], '%s imported by %s' % (name, ', '.join(importers)))
+            if name.startswith('xgds_instrument') and not importers:
+                ownTime += cumulative
+        self.assertLess(ownTime, IMPORT_TIME_BUDGET_US)
+
+
+class BenchmarkTest(TransactionTestCase):
+    """
+    Synthetic spectra are reproducible, and slower or chattier cases are reported against a baseline
+    """
+    def test_synthetic_spectrum(self):
+        from xgds_instrument import benchmarks
+        samples = benchmarks.syntheticSpectrum(10000, seed=7)
+        self.assertEqual(samples.shape, (10000, 2))
+        self.assertTrue((samples == benchmarks.syntheticSpectrum(10000, seed=7)).all())
+        self.assertFalse((samples == benchmarks.syntheticSpectrum(10000, seed=8)).all())
+
+    def test_compare_to_baseline(self):
+        from xgds_instrument.benchmarks import compareToBaseline
+        baseline = {'json_1000': {'p50': 0.1, 'queries': 2, 'peakMemoryMb': 100.0}}
+        self.assertEqual(compareToBaseline(baseline, baseline), [])
+        self.assertEqual(compareToBaseline({'json_1000': {'p50': 0.11, 'queries': 2, 'peakMemoryMb': 110.0}}, baseline), [])
+        self.assertEqual(len(compareToBaseline({'json_1000': {'p50': 0.2, 'queries': 3, 'peakMemoryMb': 100.0}},
+                                               baseline)), 2)
@@ -0,0 +1,72 @@
+# __BEGIN_LICENSE__
+# Copyright (c) 2015, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The xGDS platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+# __END_LICENSE__
+
+"""
+Columnar blocks of time series samples.
+
+A time series is stored as consecutive blocks of up to XGDS_INSTRUMENT_TIME_SERIES_BLOCK_SIZE
+samples.  Each block holds its columns one after the other as little endian float64, the
+first column being the sample time in seconds since the unix epoch, so a time range is read
+by fetching only the blocks that overlap it and slicing their time column.
+"""
+
+import calendar
+import datetime
+
+import numpy as np
+import pytz
+
+DTYPE = np.dtype('<f8')
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def toEpochSeconds(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if value.tzinfo is None:
+        value = pytz.utc.localize(value)
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+def toDatetime(seconds):
+    return EPOCH + datetime.timedelta(seconds=float(seconds))
+
+
+def encodeBlock(samples):
+    """ bytes of a (count, columns) sample array, stored column by column """
+    return np.ascontiguousarray(samples.T, dtype=DTYPE).tobytes()
+
+
+def decodeBlock(data, count, columns):
+    return np.frombuffer(bytes(data), dtype=DTYPE).reshape(columns, count).T
+
+
+def splitBlocks(samples, blockSize):
+    """ Sort samples by time and yield arrays of at most blockSize rows """
+    samples = np.asarray(samples, dtype=np.float64)
+    if samples.ndim != 2 or samples.shape[1] < 2:
+        raise ValueError('Time series samples need a time column and at least one value column')
+    samples = samples[np.argsort(samples[:, 0], kind='mergesort')]
+    for start in range(0, len(samples), blockSize):
+        yield samples[start:start + blockSize]
+
+
+def sliceBlock(samples, start=None, end=None):
+    """ The rows of a decoded block with start <= time <= end """
+    times = samples[:, 0]
+    first = 0 if start is None else np.searchsorted(times, start, side='left')
+    last = len(times) if end is None else np.searchsorted(times, end, side='right')
+    return samples[first:last]
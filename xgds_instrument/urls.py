@@ -20,8 +20,10 @@ from xgds_instrument import views
 
 urlpatterns = [
     url(r'^instrumentDataImport/$', views.instrumentDataImport, name='instrument_data_import'),
+    url(r'^instrumentDataBulkImport/$', views.instrumentDataBulkImport, name='instrument_data_bulk_import'),
     url(r'^edit/(?P<instrument_name>\w*)/(?P<pk>[\d]+)$', views.editInstrumentData, name="instrument_data_edit"),
     url(r'^getInstrumentDataCsv/(?P<productModel>[\w]+[\.]*[\w]*)/(?P<productPk>[\d]+)$', views.getInstrumentDataCsvResponse, name='instrument_data_csv'),
+    url(r'^getInstrumentDataExport/(?P<productModel>[\w]+[\.]*[\w]*)$', views.getInstrumentDataExport, name='instrument_data_export'),
     
     # Including these in this order ensures that reverse will return the non-rest urls for use in our server
     url(r'^rest/', include('xgds_instrument.restUrls')),
@@ -13,27 +13,36 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the License for the
 # specific language governing permissions and limitations under the License.
 # __END_LICENSE__
+import csv
 import datetime
+import hashlib
 import json
-import pandas as pd
 import pytz
 import httplib
+import shutil
+import zipfile
+from functools import wraps
 
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.utils.html import format_html
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from django.conf import settings
-from xgds_instrument.forms import ImportInstrumentDataForm
-from requests.api import request
+from django.core.exceptions import ImproperlyConfigured
+from xgds_instrument.forms import ImportInstrumentDataForm, BulkImportInstrumentDataForm, StagedImportInstrumentDataForm
+# modules that use numpy are imported by the views that need them, so loading the urls stays light
+from xgds_instrument import (bulkImport, chunkedUpload, contentStorage, importerRegistry, importJobs, instrumentCache,
+                             sampleCache, sampleEncoding)
+from xgds_instrument.models import (AbstractTimeSeriesDataProduct, DeletedInstrumentDataProduct, InstrumentImportJob,
+                                    findDuplicateProducts, iterSampleChunks)
 from django.core.urlresolvers import reverse
-from geocamUtil.loader import LazyGetModelByName
+from geocamUtil.loader import LazyGetModelByName, getClassByName
 
 
-def lookupImportFunctionByName(moduleName, functionName):
-    importModule = __import__(moduleName)
-    function = getattr(getattr(importModule, moduleName.split(".")[-1]),
-                       functionName)
-    return function
-
 def cleanValue(s):
     if not s:
         return None
@@ -88,6 +97,22 @@ def editInstrumentData(request, instrument_name, pk):
     )
 
 
+def hashingUploads(view):
+    '''
+    Hash the files uploaded to the view as they stream in, for content addressed storage.
+    The csrf check reads the upload, so it is run here after the upload handlers are set.
+    '''
+    protectedView = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        contentStorage.useHashingUploadHandlers(request)
+        return protectedView(request, *args, **kwargs)
+    return wrapper
+
+
+@hashingUploads
 def instrumentDataImport(request):
     errors = None
     status = httplib.OK
@@ -95,24 +120,50 @@ def instrumentDataImport(request):
         form = ImportInstrumentDataForm(request.POST, request.FILES)
         if form.is_valid():
             instrument = form.cleaned_data["instrument"]
-            importFxn = lookupImportFunctionByName(
-                settings.XGDS_INSTRUMENT_IMPORT_MODULE_PATH,
-                instrument.dataImportFunctionName)
+            importFxn = importerRegistry.getImporterFunction(instrument.dataImportFunctionName)
             object_id = None
             if 'object_id' in form.cleaned_data:
                 object_id = int(form.cleaned_data['object_id'])
-            return importFxn(instrument=instrument,
-                             portableDataFile=request.FILES["portableDataFile"],
-                             manufacturerDataFile=request.FILES["manufacturerDataFile"],
-                             utcStamp=form.cleaned_data["dataCollectionTime"],
-                             timezone=form.getTimezone(),
-                             vehicle=form.getVehicle(),
-                             user=request.user,
-                             latitude=form.cleaned_data['lat'],
-                             longitude=form.cleaned_data['lon'],
-                             altitude=form.cleaned_data['alt'],
-                             collector=form.cleaned_data["collector"],
-                             object_id=object_id)
+            duplicate = getDuplicateProduct(instrument, request.FILES["portableDataFile"])
+            if duplicate and wantsJson(request):
+                return JsonResponse(bulkImport.buildDuplicateResult(request.FILES["portableDataFile"].name,
+                                                                    duplicate),
+                                    status=httplib.CONFLICT)
+            if duplicate:
+                form.add_error('portableDataFile', getDuplicateMessage(duplicate))
+                errors = form.errors
+                status = httplib.CONFLICT
+            elif isAsyncImport(request):
+                stagingDir = importJobs.createStagingDir()
+                portablePath = importJobs.stageUploadedFile(request.FILES["portableDataFile"], stagingDir)
+                manufacturerPath = None
+                if request.FILES.get("manufacturerDataFile"):
+                    manufacturerPath = importJobs.stageUploadedFile(request.FILES["manufacturerDataFile"], stagingDir)
+                job = importJobs.submitImportJob(importFxn, instrument, [(portablePath, manufacturerPath)],
+                                                 stagingDir=stagingDir,
+                                                 user=request.user,
+                                                 utcStamp=form.cleaned_data["dataCollectionTime"],
+                                                 timezone=form.getTimezone(),
+                                                 vehicle=form.getVehicle(),
+                                                 latitude=form.cleaned_data['lat'],
+                                                 longitude=form.cleaned_data['lon'],
+                                                 altitude=form.cleaned_data['alt'],
+                                                 collector=form.cleaned_data["collector"],
+                                                 object_id=object_id)
+                return JsonResponse(job.toDict(), status=httplib.ACCEPTED)
+            else:
+                return importFxn(instrument=instrument,
+                                 portableDataFile=request.FILES["portableDataFile"],
+                                 manufacturerDataFile=request.FILES["manufacturerDataFile"],
+                                 utcStamp=form.cleaned_data["dataCollectionTime"],
+                                 timezone=form.getTimezone(),
+                                 vehicle=form.getVehicle(),
+                                 user=request.user,
+                                 latitude=form.cleaned_data['lat'],
+                                 longitude=form.cleaned_data['lon'],
+                                 altitude=form.cleaned_data['alt'],
+                                 collector=form.cleaned_data["collector"],
+                                 object_id=object_id)
         else:
             errors = form.errors
             status = status=httplib.NOT_ACCEPTABLE
@@ -133,18 +184,676 @@ def instrumentDataImport(request):
     )
 
 
+def isAsyncImport(request):
+    ''' async=true in the POST runs the import as a job and returns its status right away '''
+    return request.POST.get('async', '').lower() in ('true', '1', 'on')
+
+
+def wantsJson(request):
+    ''' ajax, job and api clients get json answers; the import page gets its form back '''
+    return request.is_ajax() or isAsyncImport(request) or 'application/json' in request.META.get('HTTP_ACCEPT', '')
+
+
+def getDuplicateProduct(instrument, portableDataFile):
+    ''' a product of the instrument already imported from the same portable data file, if skipping those '''
+    if not settings.XGDS_INSTRUMENT_SKIP_DUPLICATE_IMPORTS:
+        return None
+    duplicates = findDuplicateProducts(instrument, contentStorage.getContentHash(portableDataFile))
+    return duplicates[0] if duplicates else None
+
+
+def getDuplicateMessage(dataProduct):
+    viewUrl = getattr(dataProduct, 'view_url', None)
+    if viewUrl:
+        return format_html('This file was already imported as <a href="{}">{}</a>.', viewUrl, dataProduct.name)
+    return 'This file was already imported as %s %s.' % (dataProduct.name, dataProduct.pk)
+
+
+def getBulkImportPaths(request, form, stagingDir):
+    if form.cleaned_data['archive']:
+        return bulkImport.extractZip(request.FILES['archive'], stagingDir)
+    return bulkImport.listDirectory(form.cleaned_data['directory'])
+
+
+@hashingUploads
+def instrumentDataBulkImport(request):
+    errors = None
+    results = None
+    status = httplib.OK
+    if request.method == 'POST':
+        form = BulkImportInstrumentDataForm(request.POST, request.FILES)
+        if form.is_valid():
+            instrument = form.cleaned_data["instrument"]
+            importer = importerRegistry.getImporter(instrument.dataImportFunctionName)
+            importKwargs = dict(timezone=form.getTimezone(),
+                                vehicle=form.getVehicle(),
+                                collector=form.cleaned_data["collector"],
+                                utcStamp=form.cleaned_data["dataCollectionTime"],
+                                latitude=form.cleaned_data['lat'],
+                                longitude=form.cleaned_data['lon'],
+                                altitude=form.cleaned_data['alt'])
+            if isAsyncImport(request):
+                stagingDir = importJobs.createStagingDir()
+                paths = getBulkImportPaths(request, form, stagingDir)
+                pairs, skipped = bulkImport.pairInstrumentFiles(paths, importer.portableExtensions,
+                                                                importer.manufacturerExtensions)
+                job = importJobs.submitImportJob(importer.function, instrument, pairs,
+                                                 stagingDir=stagingDir,
+                                                 user=request.user,
+                                                 skipped=skipped,
+                                                 **importKwargs)
+                return JsonResponse(job.toDict(), status=httplib.ACCEPTED)
+
+            stagingDir = importJobs.createStagingDir()
+            try:
+                paths = getBulkImportPaths(request, form, stagingDir)
+                results = bulkImport.runBulkImport(importer, instrument, paths,
+                                                   user=request.user,
+                                                   **importKwargs)
+            finally:
+                shutil.rmtree(stagingDir, ignore_errors=True)
+            if request.is_ajax():
+                return JsonResponse({'results': results})
+        else:
+            errors = form.errors
+            status = httplib.NOT_ACCEPTABLE
+            if request.is_ajax():
+                return JsonResponse({'errors': errors}, status=status)
+    else:
+        form = BulkImportInstrumentDataForm()
+    return render(
+        request,
+        'xgds_instrument/bulkImportInstrumentData.html',
+        {
+            'form': form,
+            'errorstring': errors,
+            'results': results,
+            'instrumentDataImportUrl': reverse('instrument_data_bulk_import'),
+            'instrumentType': 'Science Instruments',
+            'title': settings.XGDS_CORE_FLIGHT_MONIKER,
+            'help_content_path': 'xgds_instrument/help/import.rst'
+        },
+        status=status
+    )
+
+
+def createInstrumentDataUpload(request):
+    ''' start a chunked upload from POSTed filename, size and sha256 '''
+    if request.method != 'POST':
+        return JsonResponse({'errors': {'__all__': ['POST the filename, size and sha256.']}},
+                            status=httplib.METHOD_NOT_ALLOWED)
+    try:
+        uploadId = chunkedUpload.createUpload(request.POST.get('filename'),
+                                              int(request.POST.get('size', '')),
+                                              request.POST.get('sha256', '').lower())
+    except ValueError:
+        return JsonResponse({'errors': {'size': ['Give the size of the file in bytes.']}}, status=httplib.BAD_REQUEST)
+    except chunkedUpload.UploadError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+    result = chunkedUpload.getUploadStatus(uploadId)
+    result['uploadUrl'] = reverse('instrument_data_upload', kwargs={'uploadId': uploadId})
+    return JsonResponse(result, status=httplib.CREATED)
+
+
+def instrumentDataUpload(request, uploadId):
+    '''
+    GET the status of a chunked upload, PUT or POST the next chunk as the raw request body
+    with its offset in the X-Upload-Offset header (or offset parameter), or DELETE to cancel.
+    '''
+    try:
+        if request.method == 'DELETE':
+            chunkedUpload.getUploadMeta(uploadId)
+            chunkedUpload.removeUpload(uploadId)
+            return JsonResponse({'uploadId': uploadId, 'deleted': True})
+        if request.method not in ('PUT', 'POST'):
+            return JsonResponse(chunkedUpload.getUploadStatus(uploadId))
+        offset = request.META.get('HTTP_X_UPLOAD_OFFSET', request.GET.get('offset'))
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            return JsonResponse({'errors': {'offset': ['Give the offset of the chunk.']}}, status=httplib.BAD_REQUEST)
+        return JsonResponse(chunkedUpload.appendChunk(uploadId, offset, request))
+    except chunkedUpload.UploadOffsetError as e:
+        return JsonResponse({'errors': {'offset': [str(e)]}, 'offset': e.offset}, status=httplib.CONFLICT)
+    except chunkedUpload.UploadChecksumError as e:
+        return JsonResponse({'errors': {'sha256': [str(e)]}}, status=httplib.BAD_REQUEST)
+    except chunkedUpload.UploadError as e:
+        try:
+            chunkedUpload.getUploadMeta(uploadId)
+        except chunkedUpload.UploadError:
+            return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.NOT_FOUND)
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+
+
+def instrumentDataImportStaged(request):
+    '''
+    Import files sent through the chunked upload endpoints, with the same fields as
+    instrumentDataImport but portableUploadId and manufacturerUploadId in place of the files
+    '''
+    if request.method != 'POST':
+        return JsonResponse({'errors': {'__all__': ['POST the import fields.']}}, status=httplib.METHOD_NOT_ALLOWED)
+    form = StagedImportInstrumentDataForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=httplib.NOT_ACCEPTABLE)
+    instrument = form.cleaned_data["instrument"]
+    importFxn = importerRegistry.getImporterFunction(instrument.dataImportFunctionName)
+    stagingDir = importJobs.createStagingDir()
+    portablePath = chunkedUpload.takeVerifiedUpload(form.cleaned_data['portableUploadId']['uploadId'], stagingDir)
+    manufacturerPath = None
+    if form.cleaned_data['manufacturerUploadId']:
+        manufacturerPath = chunkedUpload.takeVerifiedUpload(form.cleaned_data['manufacturerUploadId']['uploadId'],
+                                                            stagingDir)
+    importKwargs = dict(utcStamp=form.cleaned_data["dataCollectionTime"],
+                        timezone=form.getTimezone(),
+                        vehicle=form.getVehicle(),
+                        latitude=form.cleaned_data['lat'],
+                        longitude=form.cleaned_data['lon'],
+                        altitude=form.cleaned_data['alt'],
+                        collector=form.cleaned_data["collector"])
+    if isAsyncImport(request):
+        job = importJobs.submitImportJob(importFxn, instrument, [(portablePath, manufacturerPath)],
+                                         stagingDir=stagingDir,
+                                         user=request.user,
+                                         **importKwargs)
+        return JsonResponse(job.toDict(), status=httplib.ACCEPTED)
+    try:
+        result = bulkImport.importFilePair(importFxn, instrument, portablePath, manufacturerPath,
+                                           user=request.user, **importKwargs)
+    finally:
+        shutil.rmtree(stagingDir, ignore_errors=True)
+    return JsonResponse(result, status=httplib.OK if result['status'] == 'success' else httplib.NOT_ACCEPTABLE)
+
+
+def getInstrumentImporters(request):
+    ''' the importer metadata for each active science instrument '''
+    result = {}
+    for instrument in instrumentCache.getInstruments(active=True):
+        try:
+            result[instrument.shortName] = importerRegistry.getImporter(instrument.dataImportFunctionName).toDict()
+        except ImproperlyConfigured as e:
+            result[instrument.shortName] = {'name': instrument.dataImportFunctionName, 'error': str(e)}
+    return JsonResponse(result)
+
+
+def getImportJobStatus(request, jobId):
+    job = get_object_or_404(InstrumentImportJob, pk=jobId)
+    return JsonResponse(job.toDict())
+
+
+def getFloatParameter(data, name):
+    value = data.get(name)
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
+def getLevelOfDetail(request):
+    """
+    Read the optional maxPoints, xmin, xmax and lodMethod parameters used to decimate samples for plotting.
+    Returns a dict of keyword arguments for sampleReduction.getReducedSamples, or None if none were given.
+    Raises ValueError for bad values.
+    """
+    from xgds_instrument import sampleReduction
+    maxPoints = request.GET.get('maxPoints')
+    xmin = getFloatParameter(request.GET, 'xmin')
+    xmax = getFloatParameter(request.GET, 'xmax')
+    if not maxPoints and xmin is None and xmax is None:
+        return None
+    if maxPoints:
+        maxPoints = int(maxPoints)
+        if maxPoints < 3:
+            raise ValueError('maxPoints must be at least 3')
+        maxPoints = min(maxPoints, settings.XGDS_INSTRUMENT_MAX_PLOT_POINTS)
+    method = request.GET.get('lodMethod', 'minmax')
+    if method not in sampleReduction.METHODS:
+        raise ValueError('lodMethod must be one of %s' % ', '.join(sampleReduction.METHODS))
+    return {'maxPoints': maxPoints or None, 'xmin': xmin, 'xmax': xmax, 'method': method}
+
+
+def getSampleTransform(request, dataProduct):
+    """ The sampleTransforms transform asked for by the request parameters, or None; raises ValueError """
+    from xgds_instrument import sampleTransforms
+    return sampleTransforms.SampleTransform.fromParameters(request.GET, dataProduct.getCachedInstrument())
+
+
+def wantsBinarySamples(request):
+    """ format=binary, or an Accept header preferring octet-stream to json, asks for sampleEncoding bytes """
+    requestedFormat = request.GET.get('format')
+    if requestedFormat:
+        return requestedFormat == 'binary'
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return sampleEncoding.CONTENT_TYPE in accept and 'application/json' not in accept
+
+
+def getPlotLabels(dataProduct):
+    try:
+        return dataProduct.getInstrumentDataCsvLabels()
+    except KeyError:
+        return None
+
+
+# Change this when the json, binary or csv output of a product changes, so cached copies are not reused
+INSTRUMENT_DATA_FORMAT_VERSION = 1
+
+
+def getRequestedProduct(request, productModel, productPk):
+    ''' look up the product once per request, for both the conditional get validators and the view '''
+    key = (productModel, productPk)
+    cached = getattr(request, '_instrumentDataProduct', None)
+    if cached is None or cached[0] != key:
+        INSTRUMENT_DATA_PRODUCT_MODEL = LazyGetModelByName(productModel)
+        cached = (key, get_object_or_404(INSTRUMENT_DATA_PRODUCT_MODEL.get(), pk=productPk))
+        request._instrumentDataProduct = cached
+    return cached[1]
+
+
+def getInstrumentDataEtag(request, productModel, productPk):
+    """
+    A strong validator for a product's sample data: the product, its portable data file (uploads
+    always get a new storage name), its last save, the fields that appear in the output, and the
+    request parameters.  The instrument's labels, units and reverseX are included since sample
+    transforms and csv headers depend on them.
+    """
+    dataProduct = getRequestedProduct(request, productModel, productPk)
+    instrument = dataProduct.getCachedInstrument()
+    parts = [str(INSTRUMENT_DATA_FORMAT_VERSION),
+             productModel,
+             str(dataProduct.pk),
+             dataProduct.portable_data_file.name if dataProduct.portable_data_file else '',
+             str(dataProduct.modification_time),
+             str(dataProduct.instrument_id),
+             instrument.xLabel, instrument.yLabel, instrument.xUnits, instrument.yUnits, str(instrument.reverseX),
+             str(dataProduct.acquisition_time),
+             dataProduct.acquisition_timezone or '',
+             '&'.join(sorted('%s=%s' % (k, v) for k in request.GET for v in request.GET.getlist(k))),
+             request.META.get('HTTP_ACCEPT', '')]
+    if isinstance(dataProduct, AbstractTimeSeriesDataProduct):
+        parts.extend([str(dataProduct.end_time), str(dataProduct.sample_count)])
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+# Clients always revalidate, and get a 304 without the samples being loaded if nothing changed.
+# There is no Last-Modified: the etag also covers changes that leave the product's times alone.
+instrumentDataCondition = condition(etag_func=getInstrumentDataEtag)
+
+
+@cache_control(private=True, no_cache=True)
+@instrumentDataCondition
+@vary_on_headers('Accept')
 def getInstrumentDataJson(request, productModel, productPk):
-    INSTRUMENT_DATA_PRODUCT_MODEL = LazyGetModelByName(productModel)
-    dataProduct = get_object_or_404(INSTRUMENT_DATA_PRODUCT_MODEL.get(), pk=productPk)
-    sampleList = dataProduct.samples
+    from xgds_instrument import sampleReduction, sampleTransforms
+    dataProduct = getRequestedProduct(request, productModel, productPk)
+    try:
+        levelOfDetail = getLevelOfDetail(request)
+        transform = getSampleTransform(request, dataProduct)
+        binary = wantsBinarySamples(request)
+        dtype = request.GET.get('dtype', 'float64')
+        if binary and dtype not in sampleEncoding.DTYPES:
+            raise ValueError('dtype must be one of %s' % ', '.join(sampleEncoding.DTYPES))
+    except ValueError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+
+    if levelOfDetail:
+        samples = sampleReduction.getReducedSamples(dataProduct, transform=transform, **levelOfDetail)
+    else:
+        samples = sampleTransforms.getTransformedSamples(dataProduct, transform)
+
+    if samples is None and transform is not None:
+        return JsonResponse({'errors': {'__all__': ['These samples are not numeric, they cannot be transformed.']}},
+                            status=httplib.NOT_ACCEPTABLE)
+    if binary:
+        if samples is None:
+            return JsonResponse({'errors': {'__all__': ['These samples are not numeric, request json.']}},
+                                status=httplib.NOT_ACCEPTABLE)
+        labels = getPlotLabels(dataProduct)
+        if transform is not None:
+            labels = transform.getLabels(labels)
+        return HttpResponse(sampleEncoding.encodeSamples(samples, labels, dtype),
+                            content_type=sampleEncoding.CONTENT_TYPE)
+
+    sampleList = samples.tolist() if samples is not None else dataProduct.samples
     return HttpResponse(json.dumps(sampleList), content_type='application/json')
 
 
-def getInstrumentDataCsvResponse(request, productModel, productPk):
+def getSearchFormClass(productModel):
+    ''' find the search form registered in XGDS_MAP_SERVER_JS_MAP for the product model '''
+    for entry in settings.XGDS_MAP_SERVER_JS_MAP.values():
+        if entry.get('model') == productModel and 'search_form_class' in entry:
+            return getClassByName(entry['search_form_class'])
+    return None
+
+
+def getRequestedProducts(request, productModel):
+    """
+    Returns a queryset of the requested products and any errors, either from pk parameters
+    (pk=1&pk=2 or pks=1,2) or else from the fields of the model's search form.
+    """
+    INSTRUMENT_DATA_PRODUCT_MODEL = LazyGetModelByName(productModel)
+    data = request.POST if request.method == 'POST' else request.GET
+    pks = data.getlist('pk')
+    if 'pks' in data:
+        pks.extend(data['pks'].split(','))
+    pks = [pk.strip() for pk in pks if pk.strip()]
+    if pks:
+        if not all(pk.isdigit() for pk in pks):
+            return None, {'pk': ['Product ids must be integers.']}
+        return INSTRUMENT_DATA_PRODUCT_MODEL.get().objects.filter(pk__in=pks), None
+
+    formClass = getSearchFormClass(productModel)
+    if formClass is None:
+        return None, {'__all__': ['No search form is registered for %s.' % productModel]}
+    form = formClass(data, model=INSTRUMENT_DATA_PRODUCT_MODEL.get())
+    if not form.is_valid():
+        return None, form.errors
+    query = form.getQuery()
+    if not query:
+        return None, {'__all__': ['Give product ids or search criteria.']}
+    return INSTRUMENT_DATA_PRODUCT_MODEL.get().objects.filter(query), None
+
+
+def getInstrumentDataList(request, productModel):
+    ''' flat json for the products chosen by pk or search form, in one query '''
+    dataProducts, errors = getRequestedProducts(request, productModel)
+    if errors:
+        return JsonResponse({'errors': errors}, status=httplib.BAD_REQUEST)
+    return JsonResponse(dataProducts.order_by('pk').toFlatDicts(), safe=False)
+
+
+def getInstrumentDataClusters(request, productModel):
+    """
+    Products on a map view given by zoom and bbox=minLon,minLat,maxLon,maxLat, as a count and
+    centroid per instrument in each grid cell, or as individual products once zoomed in far enough.
+    """
+    try:
+        zoom = int(request.GET.get('zoom', ''))
+        minLon, minLat, maxLon, maxLat = [float(v) for v in request.GET.get('bbox', '').split(',')]
+    except ValueError:
+        return JsonResponse({'errors': {'__all__': ['Give zoom and bbox=minLon,minLat,maxLon,maxLat.']}},
+                            status=httplib.BAD_REQUEST)
     INSTRUMENT_DATA_PRODUCT_MODEL = LazyGetModelByName(productModel)
-    dataProduct = get_object_or_404(INSTRUMENT_DATA_PRODUCT_MODEL.get(), pk=productPk)
-    filename, dataframe = dataProduct.getInstrumentDataCsv()
-    response = HttpResponse(content_type='text/csv')
+    dataProducts = INSTRUMENT_DATA_PRODUCT_MODEL.get().objects.inBounds(minLat, minLon, maxLat, maxLon)
+    if zoom >= settings.XGDS_INSTRUMENT_CLUSTER_MAX_ZOOM:
+        return JsonResponse({'zoom': zoom,
+                             'clusters': [],
+                             'products': dataProducts.order_by('pk').toFlatDicts()})
+    # a 256 pixel tile spans 360 / 2^zoom degrees of longitude
+    cellSize = 360.0 / (2 ** zoom) * settings.XGDS_INSTRUMENT_CLUSTER_CELL_PIXELS / 256.0
+    return JsonResponse({'zoom': zoom,
+                         'clusters': dataProducts.toClusters(cellSize),
+                         'products': []})
+
+
+def getInstrumentDataChanges(request, productModel):
+    """
+    Products created, edited or deleted since the since cursor (an iso time from a previous response).
+    Without since, every product is returned as created.  The returned cursor overlaps the query time
+    slightly so saves that commit while it runs are not missed; applying a change twice is harmless.
+    """
+    INSTRUMENT_DATA_PRODUCT_MODEL = LazyGetModelByName(productModel)
+    productClass = INSTRUMENT_DATA_PRODUCT_MODEL.get()
+    now = datetime.datetime.now(pytz.utc)
+    since = request.GET.get('since')
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return JsonResponse({'errors': {'since': ['Not a valid cursor.']}}, status=httplib.BAD_REQUEST)
+        created = productClass.objects.filter(creation_time__gt=since)
+        updated = productClass.objects.filter(modification_time__gt=since).exclude(creation_time__gt=since)
+        deleted = DeletedInstrumentDataProduct.objects.filter(product_model=productClass.getProductModelName(),
+                                                              deletion_time__gt=since)
+        deleted = list(deleted.values_list('product_pk', flat=True))
+    else:
+        created = productClass.objects.all()
+        updated = productClass.objects.none()
+        deleted = []
+    cursor = now - datetime.timedelta(seconds=settings.XGDS_INSTRUMENT_CHANGES_OVERLAP_SECONDS)
+    return JsonResponse({'cursor': cursor.isoformat(),
+                         'created': created.order_by('pk').toFlatDicts(),
+                         'updated': updated.order_by('pk').toFlatDicts(),
+                         'deleted': deleted})
+
+
+def streamSampleJson(dataProducts):
+    ''' write one json object of pk to sample list, a product at a time '''
+    yield '{'
+    separator = ''
+    for dataProduct, sampleList in sampleCache.iterLoadedSamples(dataProducts):
+        yield '%s%s: %s' % (separator, json.dumps(str(dataProduct.pk)), json.dumps(sampleList))
+        separator = ', '
+    yield '}'
+
+
+def getInstrumentDataJsonBatch(request, productModel):
+    dataProducts, errors = getRequestedProducts(request, productModel)
+    if errors:
+        return JsonResponse({'errors': errors}, status=httplib.BAD_REQUEST)
+    return StreamingHttpResponse(streamSampleJson(dataProducts.withRelated().order_by('pk').iterator()),
+                                 content_type='application/json')
+
+
+class CsvChunkBuffer(object):
+    """ File-like target for csv.writer that hands back what was written since the last pop """
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def pop(self):
+        result = ''.join(self.parts)
+        self.parts = []
+        return result
+
+
+def iterCsvLines(labels, rowChunks):
+    buf = CsvChunkBuffer()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(labels)
+    yield buf.pop()
+    for rows in rowChunks:
+        writer.writerows(rows)
+        yield buf.pop()
+
+
+@cache_control(private=True, no_cache=True)
+@instrumentDataCondition
+def getInstrumentDataCsvResponse(request, productModel, productPk):
+    dataProduct = getRequestedProduct(request, productModel, productPk)
+    try:
+        transform = getSampleTransform(request, dataProduct)
+    except ValueError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+    labels = dataProduct.getInstrumentDataCsvLabels()
+    if transform is not None:
+        from xgds_instrument import sampleTransforms
+        samples = sampleTransforms.getTransformedSamples(dataProduct, transform)
+        if samples is None:
+            return JsonResponse({'errors': {'__all__': ['These samples are not numeric, they cannot be transformed.']}},
+                                status=httplib.NOT_ACCEPTABLE)
+        labels = transform.getLabels(labels)
+        chunks = iterSampleChunks(samples)
+    else:
+        chunks = dataProduct.iterInstrumentDataCsvChunks()
+    response = StreamingHttpResponse(iterCsvLines(labels, chunks), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=' + dataProduct.getInstrumentDataCsvFilename()
+    return response
+
+
+def getTimeRange(request):
+    """ The start and end iso time parameters as datetimes, raising ValueError if either is not a time """
+    timeRange = []
+    for name in ('start', 'end'):
+        value = request.GET.get(name)
+        if value:
+            value = parse_datetime(value)
+            if value is None:
+                raise ValueError('%s must be an iso time' % name)
+            if value.tzinfo is None:
+                value = pytz.utc.localize(value)
+        timeRange.append(value or None)
+    return timeRange
+
+
+def getSimilarInstrumentData(request, productModel, productPk):
+    '''
+    The products of the same instrument with the most similar samples, nearest first, as flat
+    dicts with a distance.  k, metric (cosine or angle) and start / end times are optional.
+    '''
+    from xgds_instrument import similarityIndex
+    dataProduct = getRequestedProduct(request, productModel, productPk)
+    try:
+        k = min(int(request.GET.get('k', 10)), settings.XGDS_INSTRUMENT_SIMILARITY_MAX_RESULTS)
+        start, end = getTimeRange(request)
+        matches = similarityIndex.findSimilar(dataProduct, k=max(1, k),
+                                             metric=request.GET.get('metric', 'cosine'),
+                                             start=start, end=end)
+    except ValueError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+
+    pksByModel = {}
+    for label, pk, distance in matches:
+        pksByModel.setdefault(label, []).append(pk)
+    flatDicts = {}
+    for label, pks in pksByModel.items():
+        for flatDict in LazyGetModelByName(label).get().objects.filter(pk__in=pks).toFlatDicts():
+            flatDicts[(label, flatDict['pk'])] = flatDict
+    results = []
+    for label, pk, distance in matches:
+        flatDict = flatDicts.get((label, pk))
+        if flatDict is not None:  # deleted since it was indexed
+            flatDict['distance'] = distance
+            results.append(flatDict)
+    return JsonResponse(results, safe=False)
+
+
+def getRequestedTimeSeries(request, productModel, productPk):
+    dataProduct = getRequestedProduct(request, productModel, productPk)
+    if not isinstance(dataProduct, AbstractTimeSeriesDataProduct):
+        raise Http404('%s is not a time series' % productModel)
+    return dataProduct
+
+
+def getTimeSeriesJson(request, productModel, productPk):
+    '''
+    The samples of a time series product between the optional start and end times, with
+    times in milliseconds since the epoch; maxPoints and lodMethod decimate them for plotting
+    '''
+    from xgds_instrument import sampleReduction
+    dataProduct = getRequestedTimeSeries(request, productModel, productPk)
+    try:
+        start, end = getTimeRange(request)
+        levelOfDetail = getLevelOfDetail(request) or {}
+    except ValueError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+    samples = dataProduct.samples_between(start, end)
+    if levelOfDetail.get('maxPoints'):
+        samples = sampleReduction.reduceSamples(samples, levelOfDetail['maxPoints'], method=levelOfDetail['method'])
+    samples = samples.copy()
+    samples[:, 0] *= 1000
+    return JsonResponse({'labels': dataProduct.getTimeSeriesLabels(samples.shape[1]),
+                         'start': start.isoformat() if start else None,
+                         'end': end.isoformat() if end else None,
+                         'samples': samples.tolist()})
+
+
+def getTimeSeriesCsv(request, productModel, productPk):
+    ''' The samples of a time series product between the optional start and end times, streamed as csv '''
+    dataProduct = getRequestedTimeSeries(request, productModel, productPk)
+    try:
+        start, end = getTimeRange(request)
+    except ValueError as e:
+        return JsonResponse({'errors': {'__all__': [str(e)]}}, status=httplib.BAD_REQUEST)
+    response = StreamingHttpResponse(iterCsvLines(dataProduct.getInstrumentDataCsvLabels(),
+                                                  dataProduct.iterInstrumentDataCsvChunks(t0=start, t1=end)),
+                                     content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=' + dataProduct.getInstrumentDataCsvFilename()
+    return response
+
+
+class ZipStreamBuffer(CsvChunkBuffer):
+    """ Unseekable file-like target for zipfile that tracks its offset so the archive can be streamed """
+    def __init__(self):
+        super(ZipStreamBuffer, self).__init__()
+        self.offset = 0
+
+    def write(self, value):
+        super(ZipStreamBuffer, self).write(value)
+        self.offset += len(value)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+
+def iterSampleRows(sampleList):
+    for row in sampleList:
+        if isinstance(row, (list, tuple)):
+            yield row
+        else:
+            yield [row]
+
+
+LONG_CSV_COLUMNS = ['product_id', 'instrument', 'acquisition_time']
+
+
+def iterLongCsvLines(dataProducts):
+    """
+    One csv for all products with product id, instrument and acquisition time columns, using the
+    first product's labels.  With no products it is just the header of the product columns.
+    """
+    buf = CsvChunkBuffer()
+    writer = csv.writer(buf, lineterminator='\n')
+    labels = None
+    for dataProduct, sampleList in sampleCache.iterLoadedSamples(dataProducts):
+        if labels is None:
+            labels = dataProduct.getInstrumentDataCsvLabels()
+            writer.writerow(LONG_CSV_COLUMNS + list(labels))
+        acquisitionTime = dataProduct.acquisition_time.isoformat() if dataProduct.acquisition_time else ''
+        prefix = [dataProduct.pk, dataProduct.instrument.displayName, acquisitionTime]
+        for row in iterSampleRows(sampleList):
+            writer.writerow(prefix + list(row))
+        yield buf.pop()
+    if labels is None:
+        writer.writerow(LONG_CSV_COLUMNS)
+        yield buf.pop()
+
+
+def iterZipArchive(dataProducts):
+    """ A zip holding one csv per product, written out a product at a time """
+    buf = ZipStreamBuffer()
+    archive = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
+    for dataProduct, sampleList in sampleCache.iterLoadedSamples(dataProducts):
+        csvLines = iterCsvLines(dataProduct.getInstrumentDataCsvLabels(), [iterSampleRows(sampleList)])
+        archive.writestr('%s_%s' % (dataProduct.pk, dataProduct.getInstrumentDataCsvFilename()),
+                         ''.join(csvLines))
+        yield buf.pop()
+    archive.close()
+    yield buf.pop()
+
+
+def getInstrumentDataExport(request, productModel):
+    """
+    Export the samples of many products, chosen by pk or by search form fields.
+    exportFormat=zip (the default) gives a zip of one csv per product, exportFormat=csv a single long csv.
+    """
+    dataProducts, errors = getRequestedProducts(request, productModel)
+    if errors:
+        return JsonResponse({'errors': errors}, status=httplib.BAD_REQUEST)
+    dataProducts = dataProducts.withRelated().order_by('pk').iterator()
+    data = request.POST if request.method == 'POST' else request.GET
+    exportFormat = data.get('exportFormat', 'zip')
+    filename = '%s_export' % productModel.split('.')[-1]
+    if exportFormat == 'csv':
+        response = StreamingHttpResponse(iterLongCsvLines(dataProducts), content_type='text/csv')
+        filename += '.csv'
+    elif exportFormat == 'zip':
+        response = StreamingHttpResponse(iterZipArchive(dataProducts), content_type='application/zip')
+        filename += '.zip'
+    else:
+        return JsonResponse({'errors': {'exportFormat': ['Unknown export format %s.' % exportFormat]}},
+                            status=httplib.BAD_REQUEST)
     response['Content-Disposition'] = 'attachment; filename=' + filename
-    dataframe.to_csv(response, index=False)
     return response
+